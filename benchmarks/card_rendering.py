@@ -0,0 +1,101 @@
+import argparse
+import time
+from types import SimpleNamespace
+from typing import Callable
+
+from botrequests.hotel_record import Hotel
+from database.bot_database import User
+from database.user_cache import user_cache
+from utils.handling import internationalize as _, hotel_rating
+from utils.rendering import renderers, LANGUAGES
+
+RATINGS = (None, 0, 1, 2.5, 3.0, 4, 4.5, 5)
+
+
+def make_hotels(amount: int) -> list[Hotel]:
+    """
+    makes hotels like structure_hotels_info returns
+    :param amount: number of hotels
+    :return: list of Hotel
+    """
+    return [Hotel(
+        id=100000 + i,
+        name=f'Hotel {{Grand}} №{i}',
+        star_rating=RATINGS[i % len(RATINGS)],
+        price=1000 + i * 37 % 900,
+        total_nights=3,
+        total_price=(1000 + i * 37 % 900) * 3,
+        distance=f'{i * 0.3:.1f} km'.replace('.', ','),
+        distance_value=round(i * 0.3, 1),
+        distance_unit='km',
+        address=f'ул. Тверская, {i}, Москва',
+        photos=[f'https://img/{i}/{k}.jpg' for k in range(2)] if i % 2 else [],
+    ) for i in range(amount)]
+
+
+def legacy_descriptions(hotels: list[Hotel], msg: SimpleNamespace, currency: str) -> list[tuple[dict, str]]:
+    """
+    hotel cards rendered the way generate_hotels_descriptions did before the renderer, every field is translated
+    separately
+    :param hotels: list of Hotel
+    :param msg: object with from_user.id of a user in the user cache
+    :param currency: currency of hotel prices
+    :return: list of pairs: hotel card and text for search history
+    """
+    result = []
+    for hotel in hotels:
+        message = (
+            f"{_('hotel', msg)}: {hotel.name}\n"
+            f"{_('rating', msg)}: {hotel_rating(hotel.star_rating, msg)}\n"
+            f"{_('price', msg)}: {hotel.price} {currency}\n"
+            f"{_('total_nights', msg)}: {hotel.total_nights}\n"
+            f"{_('total_price', msg)}: {hotel.total_price} {currency}\n"
+            f"{_('distance', msg)}: {hotel.distance}\n"
+            f"{_('address', msg)}: {hotel.address}\n"
+        )
+        history_message = (
+            f"{_('hotel', msg)}: {hotel.name}\n"
+            f"{_('price', msg)}: {hotel.price} {currency}\n"
+            f"{_('address', msg)}: {hotel.address}\n"
+            f"{_('site', msg)}: 'URL:' https://hotels.com/ho{hotel.id}\n"
+        )
+        if hotel.photos:
+            result.append(({'photos': hotel.photos, 'message': message}, history_message))
+        else:
+            result.append(({'message': message}, history_message))
+    return result
+
+
+def renders_per_second(render: Callable[[], list], seconds: float) -> float:
+    """
+    calls render repeatedly for the given time
+    :param render: function rendering a batch of cards
+    :param seconds: duration of the measurement
+    :return: rendered batches per second
+    """
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        render()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hotel card rendering speed before and after the renderer')
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of every measurement')
+    args = parser.parse_args()
+    for number, lang in enumerate(LANGUAGES):
+        user_id = -1 - number
+        user_cache.set(user_id, User(id=user_id, language=lang, currency='USD'))
+        msg = SimpleNamespace(from_user=SimpleNamespace(id=user_id))
+        for amount in (20, 100):
+            hotels = make_hotels(amount)
+            assert legacy_descriptions(hotels, msg, 'USD') == renderers[lang].render(hotels, 'USD'), \
+                f'Cards differ for {lang}'
+            before = renders_per_second(lambda: legacy_descriptions(hotels, msg, 'USD'), args.seconds)
+            after = renders_per_second(lambda: renderers[lang].render(hotels, 'USD'), args.seconds)
+            print(f'{lang} {amount:>3} hotels: before {before:8.0f} batches/s, after {after:8.0f} batches/s, '
+                  f'speedup {after / before:.1f}x')
+        user_cache.pop(user_id)
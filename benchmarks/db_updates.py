@@ -0,0 +1,70 @@
+import argparse
+import os
+import tempfile
+import time
+
+from peewee import SqliteDatabase
+
+from database.bot_database import User, pragmas
+
+BEFORE = {
+    'pragmas': {'journal_mode': 'delete', 'synchronous': 'full'},
+    'only_save_dirty': False,
+    'saves_per_handler': 3,
+}
+AFTER = {
+    'pragmas': pragmas,
+    'only_save_dirty': True,
+    'saves_per_handler': 1,
+}
+
+
+def run(settings: dict, handlers: int, users: int) -> float:
+    """
+    imitates the price range step of /bestdeal: every handler changes three fields of a user row
+    :param settings: database pragmas, only_save_dirty option and number of saves in one handler
+    :param handlers: number of handled updates
+    :param users: number of users
+    :return: handled updates per second
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db = SqliteDatabase(os.path.join(directory, 'bench.db'), pragmas=settings['pragmas'])
+        only_save_dirty = User._meta.only_save_dirty
+        User._meta.only_save_dirty = settings['only_save_dirty']
+        try:
+            with db.bind_ctx([User]):
+                db.create_tables([User])
+                profiles = [User.create(id=i, username='user', language='en', state=2, locale='en_US',
+                                        currency='USD', order='DISTANCE_FROM_LANDMARK', dest_id='1153093',
+                                        destination_name='Moscow', check_in='0', check_out='0', quantity='5',
+                                        min_price='0', max_price='0', distance='0', photo_amt=0)
+                            for i in range(users)]
+                start = time.perf_counter()
+                for number in range(handlers):
+                    curr_user = profiles[number % users]
+                    curr_user.min_price = str(number)
+                    if settings['saves_per_handler'] > 1:
+                        curr_user.save()
+                    curr_user.max_price = str(number + 100)
+                    if settings['saves_per_handler'] > 2:
+                        curr_user.save()
+                    curr_user.state = 3
+                    curr_user.save()
+                seconds = time.perf_counter() - start
+            db.close()
+        finally:
+            User._meta.only_save_dirty = only_save_dirty
+    return handlers / seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Updates per second of the user table before and after tuning')
+    parser.add_argument('--handlers', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+    before = run(BEFORE, args.handlers, args.users)
+    after = run(AFTER, args.handlers, args.users)
+    print(f'before: {before:.0f} updates/s (rollback journal, synchronous=full, full-row save x3)')
+    print(f'after:  {after:.0f} updates/s ({pragmas["journal_mode"]}, synchronous={pragmas["synchronous"]}, '
+          f'dirty fields save x1)')
+    print(f'speedup: {after / before:.1f}x')
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from threading import Event, Lock
+
+from peewee import SqliteDatabase
+from telebot import TeleBot
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Message
+
+from database.bot_database import User, pragmas
+from utils.user_pool import UserThreadPool, serialize_users
+
+
+def make_messages(users: int, per_user: int) -> list[Message]:
+    """
+    makes text messages, the updates of the users are interleaved like quick taps of many users
+    :param users: number of users
+    :param per_user: number of messages of every user
+    :return: list of Message
+    """
+    return [Message.de_json({'message_id': number, 'date': 0, 'text': str(number),
+                             'chat': {'id': 1000 + number % users, 'type': 'private'},
+                             'from': {'id': 1000 + number % users, 'is_bot': False, 'first_name': 'user'}})
+            for number in range(users * per_user)]
+
+
+def run(pool: str, users: int, per_user: int, threads: int, delay: float) -> dict:
+    """
+    sends the messages to a bot whose handler increments a counter in the user row with a read-modify-write, like
+    the handlers change the user's state
+    :param pool: "telebot" - the thread pool of TeleBot, "user" - UserThreadPool, "asyncio" - tasks of AsyncTeleBot,
+    "asyncio user" - tasks of AsyncTeleBot with per-user locks
+    :param users: number of users
+    :param per_user: number of messages of every user
+    :param threads: number of handler threads
+    :param delay: seconds between reading and writing the row
+    :return: dict with lost and reordered updates and updates per second
+    """
+    messages = make_messages(users, per_user)
+    with tempfile.TemporaryDirectory() as directory:
+        db = SqliteDatabase(os.path.join(directory, 'stress.db'), pragmas=pragmas, thread_safe=True,
+                            check_same_thread=False)
+        with db.bind_ctx([User]):
+            db.create_tables([User])
+            for user_id in range(1000, 1000 + users):
+                User.create(id=user_id, username='user', language='en', state=0, locale='en_US', currency='USD',
+                            order='PRICE', dest_id='0', destination_name='0', check_in='0', check_out='0',
+                            quantity='0', min_price='0', max_price='0', distance='0', photo_amt=0)
+            seen = dict()
+            lock = Lock()
+            finished = Event()
+
+            def handled(message: Message) -> None:
+                with lock:
+                    seen.setdefault(message.from_user.id, []).append(message.message_id)
+                    if sum(map(len, seen.values())) == len(messages):
+                        finished.set()
+
+            start = time.perf_counter()
+            if pool.startswith('asyncio'):
+                async_bot = AsyncTeleBot('1:stress')
+
+                @async_bot.message_handler(content_types=['text'])
+                async def async_count(message: Message) -> None:
+                    # like the asyncio handlers, the database is used in worker threads
+                    user = await asyncio.to_thread(User.get_by_id, message.from_user.id)
+                    handled_before = int(user.quantity)
+                    await asyncio.sleep(delay)
+                    user.quantity = str(handled_before + 1)
+                    await asyncio.to_thread(user.save)
+                    handled(message)
+
+                if pool == 'asyncio user':
+                    serialize_users(async_bot)
+                asyncio.run(async_bot.process_new_messages(messages))
+            else:
+                bot = TeleBot('1:stress', threaded=True, num_threads=threads)
+                if pool == 'user':
+                    bot.worker_pool.close()
+                    bot.worker_pool = UserThreadPool(bot, threads)
+
+                @bot.message_handler(content_types=['text'])
+                def count(message: Message) -> None:
+                    user = User.get_by_id(message.from_user.id)
+                    handled_before = int(user.quantity)
+                    time.sleep(delay)
+                    user.quantity = str(handled_before + 1)
+                    user.save()
+                    handled(message)
+
+                bot.process_new_messages(messages)
+                finished.wait(60)
+                bot.worker_pool.close()
+            seconds = time.perf_counter() - start
+            stored = sum(int(user.quantity) for user in User.select())
+        db.close()
+    return {
+        'lost': len(messages) - stored,
+        'reordered': sum(ids != sorted(ids) for ids in seen.values()),
+        'rate': len(messages) / seconds,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lost and reordered updates of quick taps with and without '
+                                                 'per-user serialization')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--per-user', type=int, default=50, help='messages of every user')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.002, help='seconds between reading and writing the row')
+    args = parser.parse_args()
+    total = args.users * args.per_user
+    for pool in ('telebot', 'user', 'asyncio', 'asyncio user'):
+        result = run(pool, args.users, args.per_user, args.threads, args.delay)
+        print(f'{pool:>12}: {result["lost"]:4} of {total} updates lost, {result["reordered"]:3} of {args.users} '
+              f'users with reordered updates, {result["rate"]:6.0f} updates/s')
@@ -0,0 +1,84 @@
+import argparse
+import random
+import time
+
+import requests
+
+from config_data.config import HEDGE_QUANTILE
+from utils import http_client
+from utils.http_client import api_get
+from utils.resilience import endpoint_health
+
+
+class SlowApi:
+    """
+    class SlowApi. Imitates the hotels api session: most answers take about fast seconds, a share of them slow
+    seconds, a request longer than its timeout fails
+     Attributes:
+        :fast(float): usual answer time
+        :slow(float): answer time of slow requests
+        :share(float): share of slow requests
+    """
+    def __init__(self, fast: float, slow: float, share: float, seed: int = 1) -> None:
+        self.fast = fast
+        self.slow = slow
+        self.share = share
+        self.random = random.Random(seed)
+
+    def get(self, url: str, params: dict = None, timeout: float = None) -> requests.Response:
+        delay = self.slow if self.random.random() < self.share else self.fast * self.random.uniform(0.5, 1.5)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f'No answer in {timeout} s')
+        time.sleep(delay)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        return response
+
+
+def run(endpoint: str, hedge_quantile: float, amount: int, api: SlowApi) -> list[float]:
+    """
+    sends requests one after another
+    :param endpoint: endpoint name, every run uses its own latency statistics
+    :param hedge_quantile: quantile of durations after which a request is hedged, 0 - hedging is off
+    :param amount: number of requests
+    :param api: imitation of the api
+    :return: durations of the requests in seconds
+    """
+    endpoint_health(endpoint).latency.hedge_quantile = hedge_quantile
+    http_client.session = api
+    durations = []
+    for number in range(amount):
+        start = time.perf_counter()
+        api_get(endpoint, {'number': number})
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(durations: list[float], q: float) -> float:
+    """
+    returns percentile of durations
+    :param durations: seconds
+    :param q: percentile from 0 to 100
+    :return: seconds
+    """
+    durations = sorted(durations)
+    return durations[min(len(durations) - 1, int(q / 100 * len(durations)))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency of hotels api requests with and without hedging')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--fast', type=float, default=0.02, help='usual answer time, seconds')
+    parser.add_argument('--slow', type=float, default=0.5, help='answer time of slow requests, seconds')
+    parser.add_argument('--share', type=float, default=0.03, help='share of slow requests, below 1 - quantile')
+    parser.add_argument('--quantile', type=float, default=HEDGE_QUANTILE, help='hedging quantile')
+    args = parser.parse_args()
+    # the first requests only fill the latency statistics
+    warmup = 100
+    for name, quantile in (('without hedging', 0.0), ('with hedging', args.quantile)):
+        api = SlowApi(args.fast, args.slow, args.share)
+        durations = run(f'bench/{quantile}', quantile, warmup + args.requests, api)[warmup:]
+        print(f'{name:>15}: p50 {percentile(durations, 50) * 1000:6.0f} ms, p95 {percentile(durations, 95) * 1000:6.0f} '
+              f'ms, p99 {percentile(durations, 99) * 1000:6.0f} ms, total {sum(durations):5.1f} s')
@@ -0,0 +1,88 @@
+import argparse
+import random
+import time
+from typing import Callable
+
+from botrequests.hotel_index import HotelIndex
+from botrequests.hotel_record import Hotel
+
+CENTER = (55.7558, 37.6173)
+
+
+def make_hotels(amount: int, seed: int = 1) -> list[Hotel]:
+    """
+    makes hotels like structure_hotels_info returns, prices repeat to check the order of equal prices
+    :param amount: number of hotels
+    :param seed: random seed
+    :return: list of Hotel
+    """
+    rnd = random.Random(seed)
+    hotels = []
+    for i in range(amount):
+        distance = round(rnd.uniform(0, 30), 1)
+        price = rnd.randrange(20, 400) * 10
+        hotels.append(Hotel(
+            id=100000 + i,
+            name=f'Hotel {i}',
+            star_rating=rnd.choice((0, 2, 3, 3.5, 4, 5)),
+            price=price,
+            total_nights=3,
+            total_price=price * 3,
+            distance=f'{distance:.1f} km'.replace('.', ','),
+            distance_value=distance,
+            distance_unit='km',
+            address=f'Street {i}',
+            coordinates=(CENTER[0] + rnd.uniform(-0.2, 0.2), CENTER[1] + rnd.uniform(-0.3, 0.3)),
+        ))
+    return hotels
+
+
+def legacy_best_hotels(hotels: list[Hotel], distance: float, limit: int) -> list[Hotel]:
+    """
+    best hotels selected the way choose_best_hotels did before the index: the distance string of every hotel is parsed,
+    all matching hotels are sorted
+    :param hotels: list of Hotel
+    :param distance: maximum distance from city center
+    :param limit: number of hotels
+    :return: required number of best hotels
+    """
+    hotels = list(filter(lambda x: float(x.distance.strip().replace(',', '.').split()[0]) <= distance, hotels))
+    hotels = sorted(hotels, key=lambda k: k.price)
+    if len(hotels) > limit:
+        hotels = hotels[:limit]
+    return hotels
+
+
+def calls_per_second(function: Callable[[], list], seconds: float) -> float:
+    """
+    calls function repeatedly for the given time
+    :param function: function to measure
+    :param seconds: duration of the measurement
+    :return: calls per second
+    """
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        function()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='/bestdeal selection speed before and after the hotel index')
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of every measurement')
+    parser.add_argument('--distance', type=float, default=10.0, help='maximum distance from city center in km')
+    parser.add_argument('--limit', type=int, default=20, help='number of hotels')
+    args = parser.parse_args()
+    for amount in (100, 1000, 10000):
+        hotels = make_hotels(amount)
+        index = HotelIndex(hotels)
+        expected = [hotel.id for hotel in legacy_best_hotels(hotels, args.distance, args.limit)]
+        assert [hotel.id for hotel in index.query(args.distance, args.limit)] == expected, \
+            f'Hotels differ for {amount} hotels'
+        before = calls_per_second(lambda: legacy_best_hotels(hotels, args.distance, args.limit), args.seconds)
+        built = calls_per_second(lambda: HotelIndex(hotels).query(args.distance, args.limit), args.seconds)
+        after = calls_per_second(lambda: index.query(args.distance, args.limit), args.seconds)
+        print(f'{amount:>5} hotels: before {before:8.0f} queries/s, index with building {built:8.0f} queries/s, '
+              f'built index {after:8.0f} queries/s (speedup {after / before:.1f}x)')
@@ -0,0 +1,108 @@
+import argparse
+import tracemalloc
+from typing import Callable
+
+from telebot.types import Message
+
+from benchmarks.pipeline import PARAMETERS, load, measure, message, stubs
+from botrequests.hotel_index import HotelIndex
+from botrequests.hotel_record import Hotel
+from botrequests.hotels import structure_hotels_info
+from utils.handling import internationalize as _, hotel_price, hotel_address
+
+PAGES = [f'properties_list_25_page{page}.json' for page in range(1, 5)]
+
+
+def legacy_structure(msg: Message, data: dict) -> list[dict]:
+    """
+    hotels of a page structured the way structure_hotels_info did before Hotel: a dict of every hotel, duplicates are
+    found by comparing it with all hotels of the page
+    :param msg: Message
+    :param data: response from hotel api
+    :return: structured hotels data
+    """
+    results = []
+    for cur_hotel in data['data']['body']['searchResults']['results']:
+        hotel = dict()
+        hotel['id'] = cur_hotel.get('id')
+        hotel['name'] = cur_hotel.get('name')
+        hotel['star_rating'] = cur_hotel.get('starRating', 0)
+        hotel['price'] = hotel_price(cur_hotel)
+        hotel['total_nights'] = PARAMETERS['total_nights']
+        hotel['total_price'] = round(PARAMETERS['total_nights'] * hotel['price'], 2)
+        if not hotel['price']:
+            continue
+        hotel['distance'] = cur_hotel.get('landmarks')[0].get('distance', _('no_information', msg))
+        hotel['address'] = hotel_address(cur_hotel, msg)
+        if hotel not in results:
+            results.append(hotel)
+    return results
+
+
+def legacy_bestdeal(msg: Message, pages: list[dict], distance: float, limit: int) -> list[dict]:
+    """
+    /bestdeal selection before Hotel and the index: hotels of all pages are structured, the distance text of every
+    hotel is parsed for filtering, the rest are sorted by price
+    :param msg: Message
+    :param pages: responses from hotel api
+    :param distance: maximum distance from city center
+    :param limit: number of hotels
+    :return: required number of best hotels
+    """
+    hotels = [hotel for page in pages for hotel in legacy_structure(msg, page)]
+    hotels = list(filter(lambda x: float(x['distance'].strip().replace(',', '.').split()[0]) <= distance, hotels))
+    return sorted(hotels, key=lambda k: k['price'])[:limit]
+
+
+def bestdeal(msg: Message, pages: list[dict], distance: float, limit: int) -> list[Hotel]:
+    """
+    /bestdeal selection with Hotel records deduplicated by id across pages and the hotel index
+    :param msg: Message
+    :param pages: responses from hotel api
+    :param distance: maximum distance from city center in km
+    :param limit: number of hotels
+    :return: required number of best hotels
+    """
+    seen = set()
+    hotels = [hotel for page in pages for hotel in structure_hotels_info(msg, page, PARAMETERS, seen)['results']]
+    return HotelIndex(hotels).query(distance, limit)
+
+
+def allocated(function: Callable[[], object]) -> tuple[int, int]:
+    """
+    measures memory allocated by function
+    :param function: function to measure
+    :return: bytes still held by the result and peak bytes during the call
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='/bestdeal run on 100 recorded hotels with dicts and with Hotel')
+    parser.add_argument('--distance', type=float, default=20.0, help='maximum distance from city center in km')
+    parser.add_argument('--limit', type=int, default=25, help='number of hotels')
+    parser.add_argument('--repeats', type=int, default=7, help='number of timings')
+    args = parser.parse_args()
+    pages = [load(name) for name in PAGES]
+    with stubs():
+        msg = message('Moscow')
+        expected = [hotel['id'] for hotel in legacy_bestdeal(msg, pages, args.distance, args.limit)]
+        assert [hotel.id for hotel in bestdeal(msg, pages, args.distance, args.limit)] == expected, 'Hotels differ'
+        runs = {
+            'dicts': lambda: legacy_bestdeal(msg, pages, args.distance, args.limit),
+            'Hotel': lambda: bestdeal(msg, pages, args.distance, args.limit),
+            'dicts, structuring': lambda: [legacy_structure(msg, page) for page in pages],
+            'Hotel, structuring': lambda: [structure_hotels_info(msg, page, PARAMETERS) for page in pages],
+        }
+        for name, run in runs.items():
+            timing = measure(run, args.repeats, 0.1)
+            held, peak = allocated(run)
+            print(f"{name:<20} min {timing['min_us']:>9.1f} us  median {timing['median_us']:>9.1f} us  "
+                  f"result {held / 1024:>7.1f} KiB  peak {peak / 1024:>7.1f} KiB")
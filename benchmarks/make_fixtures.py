@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import random
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+STREETS = ('Tverskaya', 'Arbat', 'Nikolskaya', 'Petrovka', 'Myasnitskaya', 'Ostozhenka', 'Pyatnitskaya')
+NAMES = ('Grand', 'Park', 'Central', 'Boutique', 'Riverside', 'Plaza', 'Garden', 'Royal')
+
+
+def hotel(rnd: random.Random, hotel_id: int, distance: float) -> dict:
+    """
+    makes one result of properties/list in the shape the hotels api returns
+    :param rnd: random generator
+    :param hotel_id: hotel id
+    :param distance: distance from the city center in km
+    :return: hotel data
+    """
+    price = rnd.randint(1500, 25000)
+    street = rnd.choice(STREETS)
+    return {
+        'id': hotel_id,
+        'name': f'{rnd.choice(NAMES)} Hotel {street}',
+        'starRating': rnd.choice((0, 1.0, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0)),
+        'urls': {},
+        'address': {
+            'streetAddress': f'{street} ulitsa, {rnd.randint(1, 120)}',
+            'extendedAddress': '',
+            'locality': 'Moscow',
+            'postalCode': f'1{rnd.randint(10000, 29999)}',
+            'region': 'Moscow',
+            'countryName': 'Russia',
+            'countryCode': 'ru',
+            'obfuscate': False,
+        },
+        'guestReviews': {'unformattedRating': round(rnd.uniform(6, 10), 1), 'rating': '8.6', 'total': rnd.randint(1, 900),
+                         'scale': 10},
+        'landmarks': [
+            {'label': 'City center', 'distance': f'{distance:.1f} km'.replace('.', ',')},
+            {'label': 'Kremlin', 'distance': f'{distance + rnd.uniform(0, 2):.1f} km'.replace('.', ',')},
+        ],
+        'ratePlan': {
+            'price': {'current': f'{price:,} RUB', 'exactCurrent': price,
+                      'old': f'{int(price * 1.2):,} RUB'} if rnd.random() > 0.05 else {'current': f'{price:,} RUB'},
+            'features': {'paymentPreference': False, 'noCCRequired': False},
+        },
+        'neighbourhood': 'Tverskoy',
+        'deals': {},
+        'messaging': {},
+        'badging': {},
+        'pimmsAttributes': 'DoubleStamps|D13|TESCO',
+        'coordinate': {'lat': round(55.75 + rnd.uniform(-0.1, 0.1), 6), 'lon': round(37.61 + rnd.uniform(-0.1, 0.1), 6)},
+        'roomsLeft': rnd.randint(0, 10),
+        'providerType': 'LOCAL',
+        'supplierHotelId': hotel_id + 7,
+        'isAlternative': False,
+        'optimizedThumbUrls': {'srpDesktop': f'https://exp.cdn-hotels.com/hotels/{hotel_id}/main.jpg'},
+    }
+
+
+def properties_list(rnd: random.Random, size: int, page: int, next_page: [int, None]) -> dict:
+    """
+    makes properties/list response
+    :param rnd: random generator
+    :param size: number of hotels on the page
+    :param page: page number
+    :param next_page: number of the next page or None
+    :return: response
+    """
+    results = [hotel(rnd, 100000 * page + i, ((page - 1) * size + i) * 0.35) for i in range(size)]
+    return {
+        'result': 'OK',
+        'data': {'body': {
+            'header': 'Moscow, Russia',
+            'query': {'destination': {'id': '1153093', 'value': 'Moscow, Russia'}},
+            'searchResults': {
+                'totalCount': size * 4,
+                'results': results,
+                'pagination': {'currentPage': page, 'pageGroup': 'EXPEDIA_IN_POLYGON', 'nextPageNumber': next_page},
+            },
+        }},
+    }
+
+
+def locations_search(rnd: random.Random, size: int) -> dict:
+    """
+    makes locations/search response, captions contain html tags like the api returns
+    :param rnd: random generator
+    :param size: number of locations
+    :return: response
+    """
+    entities = [{
+        'geoId': str(rnd.randint(10 ** 6, 10 ** 7)),
+        'destinationId': str(1153093 + i),
+        'landmarkCityDestinationId': None,
+        'type': 'CITY',
+        'redirectPage': 'DEFAULT_PAGE',
+        'latitude': round(55.75 + i * 0.01, 5),
+        'longitude': round(37.61 + i * 0.01, 5),
+        'searchDetail': None,
+        'caption': f"<span class='highlighted'>Moscow</span> {rnd.choice(STREETS)} {i}, "
+                   f"<span class='highlighted'>Moscow</span> Oblast, Russia",
+        'name': f'Moscow {i}',
+    } for i in range(size)]
+    return {
+        'term': 'moscow',
+        'moresuggestions': size,
+        'autoSuggestInstance': None,
+        'trackingID': 'a1b2c3',
+        'misspellingfallback': False,
+        'suggestions': [
+            {'group': 'CITY_GROUP', 'entities': entities},
+            {'group': 'HOTEL_GROUP', 'entities': []},
+            {'group': 'LANDMARK_GROUP', 'entities': []},
+        ],
+        'geocodeFallback': False,
+    }
+
+
+def hotel_photos(rnd: random.Random, size: int) -> dict:
+    """
+    makes get-hotel-photos response
+    :param rnd: random generator
+    :param size: number of photos
+    :return: response
+    """
+    return {
+        'hotelId': 100001,
+        'hotelImages': [{
+            'baseUrl': f'https://exp.cdn-hotels.com/hotels/1000000/100000/{rnd.randint(10 ** 5, 10 ** 6)}/'
+                       f'{rnd.randint(10 ** 5, 10 ** 6)}_{{size}}.jpg',
+            'imageId': 1000 + i,
+            'mediaGUID': None,
+            'sizes': [{'type': 3, 'suffix': 'z'}, {'type': 14, 'suffix': 'y'}],
+            'trackingDetails': None,
+        } for i in range(size)],
+        'roomImages': [],
+        'featuredImageTrackingDetails': None,
+        'propertyImageTrackingDetails': None,
+    }
+
+
+def generate() -> dict:
+    """
+    makes all fixtures, the same ones every time
+    :return: dict file name - response
+    """
+    rnd = random.Random(2022)
+    fixtures = {
+        'properties_list_10.json': properties_list(rnd, 10, 1, 2),
+        'properties_list_25.json': properties_list(rnd, 25, 1, 2),
+        'locations_search_5.json': locations_search(rnd, 5),
+        'locations_search_30.json': locations_search(rnd, 30),
+        'hotel_photos_10.json': hotel_photos(rnd, 10),
+        'hotel_photos_60.json': hotel_photos(rnd, 60),
+    }
+    for page in range(1, 5):
+        fixtures[f'properties_list_25_page{page}.json'] = properties_list(rnd, 25, page, page + 1 if page < 4 else None)
+    return fixtures
+
+
+def record() -> dict:
+    """
+    records real responses of the hotels api, X_RAPIDAPI_KEY must be set
+    :return: dict file name - response
+    """
+    from utils.http_client import api_get
+
+    query = {'destinationId': '1153093', 'checkIn': '2022-12-01', 'checkOut': '2022-12-04', 'adults1': '1',
+             'sortOrder': 'DISTANCE_FROM_LANDMARK', 'locale': 'en_US', 'currency': 'USD'}
+    fixtures = {
+        'properties_list_10.json': api_get('properties/list', dict(query, pageNumber=1, pageSize=10)).json(),
+        'properties_list_25.json': api_get('properties/list', dict(query, pageNumber=1, pageSize=25)).json(),
+        'locations_search_5.json': api_get('locations/search', {'query': 'paris', 'locale': 'en_US'}).json(),
+        'locations_search_30.json': api_get('locations/search', {'query': 'moscow', 'locale': 'en_US'}).json(),
+    }
+    for page in range(1, 5):
+        fixtures[f'properties_list_25_page{page}.json'] = api_get(
+            'properties/list', dict(query, pageNumber=page, pageSize=25)).json()
+    hotel_id = fixtures['properties_list_10.json']['data']['body']['searchResults']['results'][0]['id']
+    photos = api_get('properties/get-hotel-photos', {'id': hotel_id}).json()
+    fixtures['hotel_photos_60.json'] = photos
+    fixtures['hotel_photos_10.json'] = dict(photos, hotelImages=photos['hotelImages'][:10])
+    return fixtures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes hotels api fixtures for the benchmark suite')
+    parser.add_argument('--record', action='store_true', help='record real api responses instead of generated ones')
+    args = parser.parse_args()
+    os.makedirs(FIXTURES, exist_ok=True)
+    for name, data in (record() if args.record else generate()).items():
+        with open(os.path.join(FIXTURES, name), 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=1)
+        print(name)
@@ -0,0 +1,232 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable
+from unittest import mock
+
+import requests
+from loguru import logger
+from telebot.types import Message
+
+import database.session_store
+from benchmarks.make_fixtures import FIXTURES
+from botrequests import hotels, locations
+from botrequests.hotel_index import HotelIndex
+from config_data.config import LOG_LEVEL
+from database.bot_database import User
+from database.session_store import MemorySessionStore, Session
+from database.user_cache import user_cache
+from utils.handling import is_input_correct, extract_search_parameters, photo_links
+
+USER_ID = -100
+PARAMETERS = {'total_nights': 3}
+
+
+def load(name: str) -> dict:
+    """
+    reads fixture
+    :param name: file name in benchmarks/fixtures
+    :return: recorded api response
+    """
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def message(text: str) -> Message:
+    """
+    makes message of the benchmark user
+    :param text: message text
+    :return: Message
+    """
+    return Message.de_json({'message_id': 1, 'date': 1, 'chat': {'id': USER_ID, 'type': 'private'}, 'text': text,
+                            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Bench', 'language_code': 'en'}})
+
+
+def api_response(data: dict) -> requests.Response:
+    """
+    makes response of the hotels api with recorded body
+    :param data: recorded response
+    :return: requests.Response
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(data).encode('utf-8')
+    return response
+
+
+def stubs() -> ExitStack:
+    """
+    replaces database, network and logging with in-memory stand-ins: the user profile is put to the user cache,
+    sessions are kept in memory, locations cache is always empty, hotels api answers with fixtures ('paris' - 5
+    locations, 'moscow' - 30), log records are formatted as for the LOG_LEVEL file sink but not written
+    :return: context that restores everything on exit
+    """
+    stack = ExitStack()
+    user_cache.set(USER_ID, User(id=USER_ID, username='bench', language='en', locale='en_US', currency='USD'))
+    stack.callback(user_cache.pop, USER_ID)
+    store = MemorySessionStore()
+    session = Session(USER_ID, {'state': 2, 'order': 'DISTANCE_FROM_LANDMARK', 'dest_id': '1153093',
+                                'destination_name': 'Moscow, Russia', 'check_in': '2022-12-01',
+                                'check_out': '2022-12-04', 'quantity': '10', 'min_price': '1000',
+                                'max_price': '20000', 'distance': '5', 'photo_amt': 3})
+    store.set(USER_ID, session.to_dict())
+    stack.enter_context(mock.patch.object(database.session_store, 'session_store', store))
+    responses = {'paris': api_response(load('locations_search_5.json')),
+                 'moscow': api_response(load('locations_search_30.json'))}
+    stack.enter_context(mock.patch.object(locations, 'api_get', lambda endpoint, params: responses[params['query']]))
+    stack.enter_context(mock.patch.object(locations, 'locations_cache',
+                                          SimpleNamespace(get=lambda key, default=None: default,
+                                                          set=lambda key, value: None)))
+    logger.remove()
+    sink = logger.add(lambda record: None, level=LOG_LEVEL)
+    stack.callback(logger.remove, sink)
+    stack.callback(logger.add, sys.stderr)
+    return stack
+
+
+def cases() -> dict[str, Callable[[], object]]:
+    """
+    makes benchmark cases, the fixtures are read before the measurement
+    :return: dict case name - function to measure
+    """
+    msg = message('Moscow')
+    paris, moscow = message('paris'), message('moscow')
+    pages = [load(f'properties_list_25_page{page}.json') for page in range(1, 5)]
+    page_10 = load('properties_list_10.json')
+    page_25 = load('properties_list_25.json')
+    structured = [hotel for page in pages for hotel in hotels.structure_hotels_info(msg, page, PARAMETERS)['results']]
+    captions = [item['caption'] for item in load('locations_search_30.json')['suggestions'][0]['entities']]
+    photos = load('hotel_photos_60.json')
+    inputs = [(2, message('1000 20000')), (3, message('5')), (4, message('10')), (7, message('3')),
+              (1, message('New York'))]
+    store = database.session_store.session_store
+
+    def input_checks() -> list[bool]:
+        result = []
+        for state, text in inputs:
+            store.set(USER_ID, dict(store.get(USER_ID), state=state))
+            result.append(is_input_correct(text))
+        return result
+
+    return {
+        'structure_hotels_info[10]': lambda: hotels.structure_hotels_info(msg, page_10, PARAMETERS),
+        'structure_hotels_info[25]': lambda: hotels.structure_hotels_info(msg, page_25, PARAMETERS),
+        'best_deals[100]': lambda: HotelIndex(structured).query(20.0, 25),
+        'generate_hotels_descriptions[20]': lambda: list(hotels.generate_hotels_descriptions(structured[:20], msg)),
+        'generate_hotels_descriptions[100]': lambda: list(hotels.generate_hotels_descriptions(structured, msg)),
+        'make_locations_list[5]': lambda: locations.make_locations_list(paris),
+        'make_locations_list[30]': lambda: locations.make_locations_list(moscow),
+        'delete_tags[30]': lambda: [locations.delete_tags(caption) for caption in captions],
+        'is_input_correct[5]': input_checks,
+        'extract_search_parameters': lambda: extract_search_parameters(msg),
+        'photo_links[60]': lambda: photo_links(photos, 60),
+    }
+
+
+def measure(function: Callable[[], object], repeats: int, min_time: float) -> dict:
+    """
+    measures function: finds the number of loops running at least min_time, then times the loops several times,
+    garbage collection is off during timing like in timeit
+    :param function: function to measure
+    :param repeats: number of timings
+    :param min_time: minimal duration of one timing in seconds
+    :return: median and minimal time of one call in microseconds and calls per second
+    """
+    function()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= min_time:
+            break
+        loops *= 2
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(loops):
+                function()
+            timings.append((time.perf_counter() - start) / loops * 1e6)
+    finally:
+        gc.enable()
+    median = statistics.median(timings)
+    return {'median_us': round(median, 2), 'min_us': round(min(timings), 2), 'ops_per_sec': round(1e6 / median, 1),
+            'loops': loops}
+
+
+def commit() -> str:
+    """
+    returns current git commit of the repository
+    :return: commit hash or empty string
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(FIXTURES)).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    finds cases that became slower than the baseline by more than threshold, the fastest timings are compared as
+    they depend least on other processes of the machine
+    :param report: current report
+    :param baseline: report to compare with
+    :param threshold: allowed slowdown, 0.15 - 15%
+    :return: descriptions of regressions
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before and result['min_us'] > before['min_us'] * (1 + threshold):
+            regressions.append(f"{name}: {before['min_us']} us -> {result['min_us']} us "
+                               f"({(result['min_us'] / before['min_us'] - 1) * 100:+.0f}%)")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the search pipeline on recorded api responses')
+    parser.add_argument('--report', help='write json report to this file')
+    parser.add_argument('--baseline', help='json report of another commit to compare with')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed slowdown against the baseline')
+    parser.add_argument('--repeats', type=int, default=7, help='number of timings of every case')
+    parser.add_argument('--min-time', type=float, default=0.1, help='minimal duration of one timing in seconds')
+    parser.add_argument('--filter', default='', help='run only cases containing this text')
+    args = parser.parse_args()
+
+    results = dict()
+    with stubs():
+        for name, function in cases().items():
+            if args.filter in name:
+                results[name] = measure(function, args.repeats, args.min_time)
+    report = {
+        'commit': commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    for name, result in results.items():
+        print(f"{name:<36} median {result['median_us']:>10.2f} us  min {result['min_us']:>10.2f} us "
+              f"{result['ops_per_sec']:>10.1f} ops/s")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,90 @@
+import argparse
+import os
+import time
+
+from telebot.types import Update
+
+from benchmarks.hotel_index import make_hotels
+from botrequests.hotel_index import HotelIndex
+from utils.rendering import renderers
+from utils.supervisor import Supervisor, context, update_user_id
+
+
+def make_updates(amount: int, users: int) -> list[Update]:
+    """
+    makes text messages of several users
+    :param amount: number of updates
+    :param users: number of users
+    :return: list of Update
+    """
+    return [Update.de_json({
+        'update_id': number,
+        'message': {'message_id': number, 'date': 0, 'text': '12',
+                    'chat': {'id': 1000 + number % users, 'type': 'private'},
+                    'from': {'id': 1000 + number % users, 'is_bot': False, 'first_name': 'user'}},
+    }) for number in range(amount)]
+
+
+def handle_updates(index: int, updates, done, hotels_amount: int, quantity: int) -> None:
+    """
+    benchmark worker: every update is a /bestdeal search over hotels_amount hotels, the best hotels are selected and
+    their cards are rendered, like the bot does after the last question
+    :param index: worker index
+    :param updates: queue of updates of the worker
+    :param done: queue of senders of handled updates
+    :param hotels_amount: number of hotels of the destination
+    :param quantity: number of hotels shown
+    :return: None
+    """
+    hotels = make_hotels(hotels_amount, seed=index)
+    renderer = renderers['en']
+    done.put(None)
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        best = HotelIndex(hotels).query(10.0, quantity)
+        renderer.render(best, 'USD')
+        done.put(update_user_id(update))
+
+
+def run(workers: int, updates: list[Update], hotels_amount: int, quantity: int) -> float:
+    """
+    passes updates through the supervisor to the benchmark workers
+    :param workers: number of worker processes
+    :param updates: list of Update
+    :param hotels_amount: number of hotels of the destination
+    :param quantity: number of hotels shown
+    :return: handled updates per second, process start is not measured
+    """
+    done = context.Queue()
+    supervisor = Supervisor(workers, handle_updates, (done, hotels_amount, quantity))
+    supervisor.start()
+    try:
+        for _ in range(workers):
+            done.get()
+        start = time.perf_counter()
+        supervisor.process_new_updates(updates)
+        for _ in updates:
+            done.get()
+        seconds = time.perf_counter() - start
+    finally:
+        supervisor.stop()
+    return len(updates) / seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Updates per second handled by 1..N worker processes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--hotels', type=int, default=1000, help='number of hotels of the destination')
+    parser.add_argument('--quantity', type=int, default=25, help='number of hotels shown')
+    args = parser.parse_args()
+    updates = make_updates(args.updates, args.users)
+    print(f'{os.cpu_count()} cpus')
+    first = None
+    for workers in args.workers:
+        rate = run(workers, updates, args.hotels, args.quantity)
+        first = first or rate
+        print(f'{workers:>2} workers: {rate:8.0f} updates/s (speedup {rate / first:.1f}x)')
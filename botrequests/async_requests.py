@@ -0,0 +1,212 @@
+import asyncio
+from typing import AsyncIterator
+
+from loguru import logger
+from telebot.types import Message
+
+from botrequests.hotels import make_hotels_querystring, hotels_cache_key, lookup_hotels_cache, store_hotels, \
+    structure_hotels_info, save_history, generate_hotels_descriptions, refreshing, refreshing_lock, MAX_PAGE
+from botrequests.hotel_index import best_deals
+from botrequests.hotel_record import Hotel
+from botrequests.locations import locations_cache, locations_cache_key, parse_locations
+from config_data.config import PHOTO_WORKERS, PHOTO_TIMEOUT, PAGE_WORKERS
+from database.user_cache import get_user
+from utils.async_http_client import async_api_get
+from utils.handling import photo_links, photos_cache, MAX_PHOTOS
+from utils.log_config import payload
+from utils.metrics import timed
+from utils.prefetcher import prefetcher
+
+photo_semaphore = None
+
+
+async def async_get_hotels(msg: Message, parameters: dict) -> [list, None]:
+    """
+    asyncio version of get_hotels: calls the required functions to take and process the hotel data
+    :param msg: Message
+    :param parameters: search parameters
+    :return: list of Hotel, ['bad_request'] or None if hotels are not found
+    """
+    data = await async_request_hotels(parameters)
+    if 'bad_req' in data:
+        return ['bad_request']
+    seen = set()
+    data = structure_hotels_info(msg, data, parameters, seen)
+    if not data or len(data['results']) < 1:
+        return None
+    if parameters['order'] == 'DISTANCE_FROM_LANDMARK':
+        next_page = data.get('next_page')
+        distance = float(parameters['distance'])
+        pages = dict()
+        try:
+            while next_page and next_page < MAX_PAGE and data['results'][-1].distance_value <= distance:
+                # only PAGE_WORKERS pages starting from the one being read are requested, like in get_hotels
+                for page in range(next_page, min(next_page + PAGE_WORKERS, MAX_PAGE)):
+                    if page not in pages:
+                        pages[page] = asyncio.create_task(async_request_hotels(parameters, page))
+                add_data = await pages.pop(next_page)
+                if 'bad_req' in add_data:
+                    logger.warning('bad_request')
+                    break
+                add_data = structure_hotels_info(msg, add_data, parameters, seen)
+                if not add_data:
+                    break
+                data['results'].extend(add_data['results'])
+                next_page = add_data['next_page']
+        finally:
+            for page in pages.values():
+                page.cancel()
+        data = best_deals(parameters, data['results'])
+    else:
+        data = data['results']
+
+    return data
+
+
+async def async_stream_hotels(msg: Message, parameters: dict, hotels: list[Hotel]) -> AsyncIterator[dict]:
+    """
+    asyncio version of stream_hotels: yields hotel descriptions one by one as soon as the hotel photos are received,
+    saves the search to the user's history after the last one
+    :param msg: Message
+    :param parameters: search parameters
+    :param hotels: found hotels
+    :return: async iterator of hotel descriptions
+    """
+    amt = int(parameters['photo_amt'])
+    photos = [asyncio.create_task(async_request_photos(hotel, amt)) for hotel in hotels] if amt > 0 else []
+    try:
+        for number, hotel in enumerate(hotels):
+            if photos:
+                hotel.photos = await photos[number]
+            hotel_info, history_message = next(generate_hotels_descriptions([hotel], msg))
+            yield hotel_info
+    finally:
+        for task in photos:
+            task.cancel()
+    await asyncio.to_thread(save_history, msg, parameters, hotels)
+
+
+@timed('request_hotels')
+async def async_request_hotels(parameters: dict, page: int = 1) -> dict:
+    """
+    asyncio version of request_hotels, uses the same response cache
+    :param parameters: search parameters
+    :param page: page number
+    :return: response from hotel api
+    """
+    logger.debug('Function {} called with argument: page = {}, parameters = {}', async_request_hotels.__name__,
+                 page, payload(parameters))
+    querystring = make_hotels_querystring(parameters, page)
+    key = hotels_cache_key(querystring)
+    prefetcher.used('hotels', key)
+    state, cached = lookup_hotels_cache(key)
+    if state == 'fresh':
+        return cached
+    if state == 'stale':
+        with refreshing_lock:
+            if key not in refreshing:
+                refreshing.add(key)
+                asyncio.create_task(async_refresh_hotels(key, querystring))
+        return cached
+
+    data = await async_fetch_hotels(key, querystring)
+    if 'bad_req' in data and cached:
+        logger.warning(f'Hotels api failed, stale response taken from cache: {key}')
+        return cached
+    return data
+
+
+async def async_fetch_hotels(key: str, querystring: dict) -> dict:
+    """
+    sends request to the hotel api and caches a successful response
+    :param key: cache key
+    :param querystring: request parameters
+    :return: response from hotel api
+    """
+    try:
+        status, data, size = await async_api_get("properties/list", querystring)
+        if status != 200:
+            logger.error(f'Hotels api(properties/list) answered with status {status}')
+            return {'bad_req': 'bad_req'}
+        return store_hotels(key, data, size)
+    except Exception as e:
+        logger.error(f'Error in function {async_fetch_hotels.__name__}: {e}')
+        return {'bad_req': 'bad_req'}
+
+
+async def async_refresh_hotels(key: str, querystring: dict) -> None:
+    """
+    refreshes cached hotel api response in the background
+    :param key: cache key
+    :param querystring: request parameters
+    :return: None
+    """
+    try:
+        await async_fetch_hotels(key, querystring)
+    finally:
+        with refreshing_lock:
+            refreshing.discard(key)
+
+
+@timed('request_photos')
+async def async_request_photos(hotel: Hotel, amt: int) -> list[str]:
+    """
+    returns links to hotel photos, or an empty list if the photos could not be received. Uses the same photos cache
+    as request_photos, no more than PHOTO_WORKERS requests run at once
+    :param hotel: Hotel - hotel information
+    :param amt: int - Number of photos
+    :return: links to hotel photos
+    """
+    global photo_semaphore
+    if photo_semaphore is None:
+        photo_semaphore = asyncio.Semaphore(PHOTO_WORKERS)
+    if not hotel.id:
+        return []
+    try:
+        key = str(hotel.id)
+        prefetcher.used('photos', key)
+        photos_list = await asyncio.to_thread(photos_cache.get, key)
+        if photos_list is None:
+            async with photo_semaphore:
+                status, data, size = await async_api_get("properties/get-hotel-photos", {"id": hotel.id},
+                                                         timeout=PHOTO_TIMEOUT)
+            photos_list = photo_links(data, MAX_PHOTOS)
+            await asyncio.to_thread(photos_cache.set, key, photos_list)
+        return photos_list[:amt]
+    except Exception as e:
+        logger.warning(f'Could not get photos of hotel {hotel.id}: {e}')
+        return []
+
+
+@timed('make_locations_list')
+async def async_make_locations_list(msg: Message) -> dict:
+    """
+    asyncio version of make_locations_list, uses the same locations cache
+    :param msg: Message
+    :return: dict: location name - location id
+    """
+    locale = (await asyncio.to_thread(get_user, msg.from_user.id)).locale
+    key = locations_cache_key(msg.text, locale)
+    locations = await asyncio.to_thread(locations_cache.get, key)
+    if locations:
+        logger.info(f'Locations for {key} taken from cache')
+        return locations
+
+    querystring = {
+        "query": msg.text.strip(),
+        "locale": locale,
+    }
+    logger.debug('Parameters for search locations: {}', payload(querystring))
+    try:
+        status, data, size = await async_api_get("locations/search", querystring)
+    except Exception as e:
+        logger.error(f'Server error: {e}')
+        return {'bad_request': 'bad_request'}
+    if status != 200 or not data or data.get('message'):
+        logger.error('Hotels api(locations) error: {} {}', status, payload(data, failed=True))
+        return {'bad_request': 'bad_request'}
+
+    locations = parse_locations(data)
+    if locations:
+        await asyncio.to_thread(locations_cache.set, key, locations)
+    return locations
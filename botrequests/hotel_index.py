@@ -0,0 +1,272 @@
+import math
+import time
+from itertools import chain
+from threading import Lock
+from typing import Iterable, Optional
+
+import numpy as np
+from loguru import logger
+
+from botrequests.hotel_record import Hotel, MILE_KM
+from config_data.config import HOTEL_INDEX_SIZE, HOTELS_CACHE_TTL
+from database.cache import LRUCache
+from utils.metrics import watch_cache
+
+COLUMNS = ('price', 'stars', 'distance')
+
+
+def distance_to_km(distance: float, locale: str) -> float:
+    """
+    converts distance entered by the user to kilometers, for en_US the hotel api and the bot use miles
+    :param distance: distance in the user's units
+    :param locale: user's location code
+    :return: distance in km
+    """
+    return distance * MILE_KM if locale == 'en_US' else distance
+
+
+def cheapest(prices: np.ndarray, rows: np.ndarray, limit: Optional[int]) -> np.ndarray:
+    """
+    selects limit cheapest rows without sorting all of them, hotels with the same price keep their order in rows
+    :param prices: prices of all rows
+    :param rows: rows to select from
+    :param limit: number of rows, None - all
+    :return: selected rows, the cheapest first
+    """
+    selected = prices[rows]
+    if limit is not None and len(rows) > limit:
+        if limit <= 0:
+            return rows[:0]
+        kth = np.partition(selected, limit - 1)[limit - 1]
+        keep = selected < kth
+        keep[np.flatnonzero(selected == kth)[:limit - np.count_nonzero(keep)]] = True
+        rows, selected = rows[keep], selected[keep]
+    return rows[np.argsort(selected, kind='stable')]
+
+
+def hotel_values(hotel: Hotel) -> tuple:
+    """
+    returns values of the hotel kept in the index, in the order of COLUMNS
+    :param hotel: Hotel
+    :return: tuple of numbers, nan if a value is unknown
+    """
+    return hotel.price, hotel.star_rating or 0, hotel.distance_km
+
+
+class HotelIndex:
+    """
+    class HotelIndex. Hotels of one destination and dates found by previous searches. Nightly prices, star ratings and
+    distances to the city center in km are kept in a NumPy array, only added and changed hotels are copied to the
+    array when it is updated. Hotels not found by any search for max_age seconds are removed, their
+    prices are as old as the hotel api responses that are no longer cached
+     Attributes:
+        :hotels(list): hotels in the order they were added
+        :rows(dict): hotel id - position in hotels
+        :max_age(float): seconds a hotel is kept after the last search that found it
+    """
+    def __init__(self, hotels: Iterable[Hotel] = (), max_age: float = HOTELS_CACHE_TTL) -> None:
+        self.hotels = []
+        self.rows = dict()
+        self.max_age = max_age
+        self._found = []
+        # no hotel was found earlier, hotels found again only move their time forward
+        self._oldest = math.inf
+        self._values = np.empty((0, len(COLUMNS)))
+        self._changed = set()
+        self._lock = Lock()
+        self.add(hotels)
+
+    def add(self, hotels: Iterable[Hotel]) -> None:
+        """
+        adds hotels, a hotel that is already in the index is replaced with the new data
+        :param hotels: hotels
+        :return: None
+        """
+        with self._lock:
+            self.insert(hotels, time.monotonic())
+
+    def insert(self, hotels: Iterable[Hotel], now: float) -> None:
+        """
+        adds hotels, must be called under lock
+        :param hotels: hotels
+        :param now: time.monotonic()
+        :return: None
+        """
+        self.expire(now)
+        for hotel in hotels:
+            row = self.rows.get(hotel.id)
+            if row is None:
+                self.rows[hotel.id] = len(self.hotels)
+                self.hotels.append(hotel)
+                self._found.append(now)
+                continue
+            if self.hotels[row] != hotel:
+                self.hotels[row] = hotel
+                self._changed.add(row)
+            self._found[row] = now
+        if self.hotels:
+            self._oldest = min(self._oldest, now)
+
+    def expire(self, now: float) -> None:
+        """
+        removes hotels not found for max_age seconds, the array is built again, must be called under lock
+        :param now: time.monotonic()
+        :return: None
+        """
+        if self._oldest >= now - self.max_age:
+            return
+        keep = [row for row, found in enumerate(self._found) if found >= now - self.max_age]
+        self._oldest = min((self._found[row] for row in keep), default=math.inf)
+        if len(keep) == len(self.hotels):
+            return
+        self.hotels = [self.hotels[row] for row in keep]
+        self._found = [self._found[row] for row in keep]
+        self.rows = {hotel.id: row for row, hotel in enumerate(self.hotels)}
+        self._values = np.empty((0, len(COLUMNS)))
+        self._changed.clear()
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        returns arrays of hotel values, converts hotels added or changed since the last call, must be called under lock
+        :return: dict column name - array
+        """
+        built = len(self._values)
+        if built < len(self.hotels):
+            # values go to the array one by one, without a list of tuples for all hotels
+            added = np.fromiter(chain.from_iterable(map(hotel_values, self.hotels[built:])), dtype=float,
+                                count=(len(self.hotels) - built) * len(COLUMNS)).reshape(-1, len(COLUMNS))
+            self._values = np.concatenate((self._values, added)) if built else added
+        for row in self._changed:
+            if row < built:
+                self._values[row] = hotel_values(self.hotels[row])
+        self._changed.clear()
+        return {name: self._values[:, column] for column, name in enumerate(COLUMNS)}
+
+    def query(self, max_distance: Optional[float] = None, limit: Optional[int] = None,
+              min_price: Optional[float] = None, max_price: Optional[float] = None,
+              min_stars: Optional[float] = None, ids: Optional[Iterable[int]] = None) -> list[Hotel]:
+        """
+        finds the cheapest hotels matching the conditions, hotels without a known distance do not match max_distance
+        :param max_distance: maximum distance in km from the city center
+        :param limit: maximum number of hotels
+        :param min_price: minimum nightly price
+        :param max_price: maximum nightly price
+        :param min_stars: minimum star rating
+        :param ids: ids of the hotels to select from, hotels with the same price keep this order. None - all hotels
+         of the index in the order they were added
+        :return: copies of hotels (photos are added to them later), the cheapest first
+        """
+        with self._lock:
+            self.expire(time.monotonic())
+            return self.select(max_distance, limit, min_price, max_price, min_stars, ids)
+
+    def search(self, hotels: list[Hotel], max_distance: Optional[float] = None, limit: Optional[int] = None,
+               min_price: Optional[float] = None, max_price: Optional[float] = None,
+               min_stars: Optional[float] = None) -> list[Hotel]:
+        """
+        adds hotels found by a search and selects the cheapest of them matching the conditions, hotels found by the
+        other searches are not selected, so the result is the same as without the index
+        :param hotels: hotels found by the search
+        :param max_distance: maximum distance in km from the city center
+        :param limit: maximum number of hotels
+        :param min_price: minimum nightly price
+        :param max_price: maximum nightly price
+        :param min_stars: minimum star rating
+        :return: copies of hotels, the cheapest first
+        """
+        with self._lock:
+            self.insert(hotels, time.monotonic())
+            return self.select(max_distance, limit, min_price, max_price, min_stars, [hotel.id for hotel in hotels])
+
+    def select(self, max_distance: Optional[float], limit: Optional[int], min_price: Optional[float],
+               max_price: Optional[float], min_stars: Optional[float], ids: Optional[Iterable[int]]) -> list[Hotel]:
+        """
+        finds the cheapest hotels matching the conditions, must be called under lock
+        :param max_distance: maximum distance in km from the city center
+        :param limit: maximum number of hotels
+        :param min_price: minimum nightly price
+        :param max_price: maximum nightly price
+        :param min_stars: minimum star rating
+        :param ids: ids of the hotels to select from, None - all hotels
+        :return: copies of hotels, the cheapest first
+        """
+        arrays = self.arrays()
+        if ids is None:
+            rows = np.arange(len(self.hotels))
+        else:
+            rows = np.fromiter((self.rows[hotel_id] for hotel_id in dict.fromkeys(ids) if hotel_id in self.rows),
+                               dtype=np.intp)
+        mask = np.ones(len(rows), dtype=bool)
+        if max_distance is not None:
+            mask &= arrays['distance'][rows] <= max_distance
+        if min_price is not None:
+            mask &= arrays['price'][rows] >= min_price
+        if max_price is not None:
+            mask &= arrays['price'][rows] <= max_price
+        if min_stars is not None:
+            mask &= arrays['stars'][rows] >= min_stars
+        rows = cheapest(arrays['price'], rows[mask], limit)
+        return [self.hotels[row].copy() for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.hotels)
+
+
+hotel_indexes = LRUCache(maxsize=HOTEL_INDEX_SIZE)
+hotel_indexes_lock = Lock()
+watch_cache('hotel_indexes', hotel_indexes)
+
+
+def destination_index(parameters: dict) -> HotelIndex:
+    """
+    returns index of hotels found for the destination, dates, currency and language of the search
+    :param parameters: search parameters
+    :return: HotelIndex
+    """
+    key = (parameters['destination_id'], parameters['check_in'], parameters['check_out'], parameters['currency'],
+           parameters['locale'])
+    with hotel_indexes_lock:
+        index = hotel_indexes.get(key)
+        if index is None:
+            index = HotelIndex()
+            hotel_indexes.set(key, index)
+    return index
+
+
+def deal_conditions(parameters: dict) -> dict:
+    """
+    returns conditions of HotelIndex.query for the distance, price range and number of hotels of the search
+    :param parameters: search parameters
+    :return: dict argument name - value
+    """
+    return {
+        'max_distance': distance_to_km(float(parameters['distance']), parameters['locale']),
+        'limit': int(parameters['quantity']),
+        'min_price': float(parameters['priceMin']) if parameters.get('priceMin') else None,
+        'max_price': float(parameters['priceMax']) if parameters.get('priceMax') else None,
+    }
+
+
+def best_deals(parameters: dict, hotels: list[Hotel]) -> list[Hotel]:
+    """
+    adds hotels to the destination index and selects the cheapest of them within the distance and price range of
+    the search, the index keeps their values for the next searches of the destination
+    :param parameters: search parameters
+    :param hotels: hotels found by the search
+    :return: required number of best hotels
+    """
+    index = destination_index(parameters)
+    best = index.search(hotels, **deal_conditions(parameters))
+    logger.debug('Hotels in the index of destination {}: {}', parameters['destination_id'], len(index))
+    return best
+
+
+def preview_deals(parameters: dict, hotels: list[Hotel]) -> list[Hotel]:
+    """
+    selects the hotels best_deals would select without adding them to the destination index, used by prefetching
+    :param parameters: search parameters
+    :param hotels: hotels found for the search
+    :return: required number of best hotels
+    """
+    return HotelIndex(hotels).query(**deal_conditions(parameters))
@@ -0,0 +1,105 @@
+import math
+from operator import attrgetter
+from typing import Optional
+
+MILE_KM = 1.609344
+
+
+def parse_distance(text: str) -> tuple[float, str]:
+    """
+    converts localized distance of the hotel api to a number and a unit: '1,2 km' - (1.2, 'km'),
+    '0.5 miles' - (0.5, 'mile')
+    :param text: distance from the hotel api
+    :return: distance and unit, nan and empty unit if there is no number in the text
+    """
+    try:
+        number, *unit = text.split(None, 1)
+        value = float(number.replace(',', '.'))
+    except (AttributeError, ValueError):
+        return math.nan, ''
+    return value, 'mile' if unit and unit[0].startswith('mile') else 'km'
+
+
+class Hotel:
+    """
+    class Hotel. Hotel found by a search, created once from the hotel api response. The distance is parsed at
+    creation, the localized text is kept for the hotel card. Arguments are taken in the order of the attributes
+     Attributes:
+        :id(int): hotel id
+        :name(str): hotel name
+        :star_rating(float): star rating, 0 if unknown
+        :price(float): nightly price
+        :total_nights(int): number of nights
+        :total_price(float): price of all nights
+        :distance(str): distance to the city center as the hotel api shows it
+        :distance_value(float): distance to the city center in distance_unit, nan if unknown
+        :distance_unit(str): 'km' or 'mile'
+        :address(str): street address
+        :coordinates(tuple): latitude and longitude or None
+        :photos(list): links to hotel photos, added before the card is sent
+    """
+    __slots__ = ('id', 'name', 'star_rating', 'price', 'total_nights', 'total_price', 'distance', 'distance_value',
+                 'distance_unit', 'address', 'coordinates', 'photos')
+
+    def __init__(self, id: int, name: str, star_rating: float, price: float, total_nights: int, total_price: float,
+                 distance: str, distance_value: float, distance_unit: str, address: str,
+                 coordinates: Optional[tuple[float, float]] = None, photos: Optional[list[str]] = None) -> None:
+        self.id = id
+        self.name = name
+        self.star_rating = star_rating
+        self.price = price
+        self.total_nights = total_nights
+        self.total_price = total_price
+        self.distance = distance
+        self.distance_value = distance_value
+        self.distance_unit = distance_unit
+        self.address = address
+        self.coordinates = coordinates
+        self.photos = photos
+
+    @property
+    def distance_km(self) -> float:
+        """
+        returns distance to the city center in km
+        :return: distance, nan if unknown
+        """
+        return self.distance_value * MILE_KM if self.distance_unit == 'mile' else self.distance_value
+
+    def to_dict(self) -> dict:
+        """
+        returns hotel data as a dict for search history
+        :return: dict attribute name - value
+        """
+        return dict(zip(self.__slots__, hotel_fields(self)))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Hotel':
+        """
+        makes hotel from a dict of search history, the distance is parsed if the dict was saved without distance_value
+        :param data: dict attribute name - value
+        :return: Hotel
+        """
+        hotel = cls(*(data.get(name) for name in cls.__slots__))
+        if hotel.distance_value is None:
+            hotel.distance_value, hotel.distance_unit = parse_distance(hotel.distance)
+        if hotel.coordinates:
+            hotel.coordinates = tuple(hotel.coordinates)
+        return hotel
+
+    def copy(self) -> 'Hotel':
+        """
+        returns a shallow copy of the hotel
+        :return: Hotel
+        """
+        return Hotel(*hotel_fields(self))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Hotel):
+            return NotImplemented
+        return hotel_fields(self) == hotel_fields(other)
+
+    def __repr__(self) -> str:
+        return f'Hotel({self.to_dict()!r})'
+
+
+hotel_fields = attrgetter(*Hotel.__slots__)
@@ -1,85 +1,227 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlencode
 
 import requests
 from dotenv import load_dotenv
 from loguru import logger
-from datetime import datetime
-from telebot.types import Message
-from config_data.config import X_RAPIDAPI_KEY
+from telebot.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from config_data.config import HOTELS_CACHE_TTL, HOTELS_CACHE_STALE, HOTELS_CACHE_SIZE, \
+    HOTELS_CACHE_MAX_BYTES, PAGE_WORKERS
 
-from utils.handling import hotel_price, _, hotel_address, \
-    hotel_rating, request_photos
-from database.bot_database import User, SearchHistory
+from utils.handling import hotel_price, _, hotel_address, stream_photos
+from database.bot_database import SearchRecord
+from database.history import add_search, get_search, get_search_by_id, search_parameters, search_results
+from database.user_cache import get_user
+from database.cache import LRUCache
+from botrequests.hotel_index import best_deals
+from botrequests.hotel_record import Hotel, parse_distance
+from utils.http_client import api_get
+from utils.log_config import payload
+from utils.metrics import timed, watch_cache
+from utils.prefetcher import prefetcher
+from utils.rendering import renderers
 
 load_dotenv()
 
+hotels_cache = LRUCache(maxsize=HOTELS_CACHE_SIZE, max_weight=HOTELS_CACHE_MAX_BYTES, weigher=lambda x: x['size'])
+watch_cache('hotels', hotels_cache)
+refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hotels_refresh')
+page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='hotels_pages')
+MAX_PAGE = 5
+refreshing = set()
+refreshing_lock = Lock()
+
 
 def get_hotels(msg: Message, parameters: dict) -> [list, None]:
     """
     calls the required functions to take and process the hotel data
     :param msg: Message
     :param parameters: search parameters
-    :return: list with string like hotel descriptions
+    :return: list of Hotel, ['bad_request'] or None if hotels are not found
     """
-    data = request_hotels(parameters, msg)
+    data = request_hotels(parameters)
     if 'bad_req' in data:
         return ['bad_request']
-    data = structure_hotels_info(msg, data, parameters)
+    seen = set()
+    data = structure_hotels_info(msg, data, parameters, seen)
     if not data or len(data['results']) < 1:
         return None
     if parameters['order'] == 'DISTANCE_FROM_LANDMARK':
         next_page = data.get('next_page')
         distance = float(parameters['distance'])
-        while next_page and next_page < 5 \
-                and float(data['results'][-1]['distance'].replace(',', '.').split()[0]) <= distance:
-            add_data = request_hotels(parameters, next_page)
-            if 'bad_req' in data:
-                logger.warning('bad_request')
-                break
-            add_data = structure_hotels_info(msg, add_data, parameters)
-            if add_data and len(add_data["results"]) > 0:
+        pages = dict()
+        stop = Event()
+        try:
+            while next_page and next_page < MAX_PAGE and data['results'][-1].distance_value <= distance:
+                # only PAGE_WORKERS pages starting from the one being read are requested, the pages after the last
+                # needed one are not requested at all
+                for page in range(next_page, min(next_page + PAGE_WORKERS, MAX_PAGE)):
+                    if page not in pages:
+                        pages[page] = page_executor.submit(request_page, parameters, page, stop)
+                add_data = pages.pop(next_page).result()
+                if 'bad_req' in add_data:
+                    logger.warning('bad_request')
+                    break
+                add_data = structure_hotels_info(msg, add_data, parameters, seen)
+                if not add_data:
+                    break
+                # a page of hotels that were all found on the previous pages is empty but the next one is requested
                 data['results'].extend(add_data['results'])
                 next_page = add_data['next_page']
-            else:
-                break
-        quantity = int(parameters['quantity'])
-        data = choose_best_hotels(data['results'], distance, quantity)
+        finally:
+            stop.set()
+            for page in pages.values():
+                page.cancel()
+        data = best_deals(parameters, data['results'])
     else:
         data = data['results']
 
-    data, history_msg = generate_hotels_descriptions(data, msg)
+    return data
+
+
+def request_page(parameters: dict, page: int, stop: Event) -> dict:
+    """
+    requests one page of hotels in the page executor
+    :param parameters: search parameters
+    :param page: page number
+    :param stop: set when the search does not need more pages, a page waiting for a free thread is not requested
+    :return: response from hotel api, {'bad_req': 'stopped'} if the page is not needed
+    """
+    if stop.is_set():
+        return {'bad_req': 'stopped'}
+    return request_hotels(parameters, page)
+
 
+def stream_hotels(msg: Message, parameters: dict, hotels: list[Hotel]) -> Iterator[dict]:
+    """
+    yields hotel descriptions one by one as soon as the hotel photos are received, saves the search to the user's
+    history after the last one
+    :param msg: Message
+    :param parameters: search parameters
+    :param hotels: found hotels
+    :return: iterator of hotel descriptions
+    """
+    found = hotels
+    if int(parameters['photo_amt']) > 0:
+        hotels = stream_photos(hotels, int(parameters['photo_amt']))
+    for hotel_info, history_message in generate_hotels_descriptions(hotels, msg):
+        yield hotel_info
+    save_history(msg, parameters, found)
+
+
+def save_history(msg: Message, parameters: dict, hotels: list[Hotel]) -> None:
+    """
+    saves the search and the found hotels to the user's history
+    :param msg: Message
+    :param parameters: search parameters
+    :param hotels: found hotels
+    :return: None
+    """
+    add_search(msg.from_user.id, parameters, [hotel.to_dict() for hotel in hotels])
+
+
+def history_page(msg: Message, offset: int = 0) -> Optional[tuple[str, InlineKeyboardMarkup]]:
+    """
+    makes a page of the user's search history with buttons to see older and newer searches and to repeat the search
+    :param msg: Message
+    :param offset: number of newer searches, 0 - the latest search
+    :return: page text and buttons or None if there is no such search
+    """
+    record, has_older = get_search(msg.from_user.id, offset)
+    if record is None:
+        return None
+    parameters = search_parameters(record)
     if parameters['order'] == 'PRICE':
         order = _('lowprice', msg)
     elif parameters['order'] == 'PRICE_HIGHEST_FIRST':
         order = _('highprice', msg)
     else:
         order = _('bestdeal', msg)
+    history_msg = [history_message for hotel_info, history_message
+                   in renderers[get_user(msg.from_user.id).language].render(history_hotels(record),
+                                                                           parameters['currency'])]
+    # searches moved from the old history have no city
+    city = f"{_('city', msg)}: {record.destination_name}\n" if record.destination_name else ''
     history = (f"{order}\n\n"
-               f"{_('search_date', msg)}: {datetime.today()}\n\n"
+               f"{city}"
+               f"{_('search_date', msg)}: {record.created}\n\n"
                f"{_('hotels_list', msg)}:\n" +
                '\n'.join(history_msg) + '\n'
                )
-    curr_history = SearchHistory.select().where(SearchHistory.user_id == msg.from_user.id).get()
-    curr_history_lst = curr_history.history.split(';')
-    if len(curr_history_lst) >= 3:
-        del curr_history_lst[0]
-    curr_history_lst.append(history)
-    curr_history.history = ";".join(curr_history_lst)
-    curr_history.save()
-    return data
+    menu = InlineKeyboardMarkup()
+    pages = []
+    if has_older:
+        pages.append(InlineKeyboardButton(text=_('history_older', msg), callback_data=f'hist_{offset + 1}'))
+    if offset > 0:
+        pages.append(InlineKeyboardButton(text=_('history_newer', msg), callback_data=f'hist_{offset - 1}'))
+    if pages:
+        menu.row(*pages)
+    if not parameters.get('legacy'):
+        menu.add(InlineKeyboardButton(text=_('repeat', msg), callback_data=f'repeat_{record.id}'))
+    return history, menu
+
+
+def history_hotels(record: SearchRecord) -> list[Hotel]:
+    """
+    returns hotels found by the saved search
+    :param record: SearchRecord
+    :return: list of Hotel
+    """
+    return [Hotel.from_dict(hotel) for hotel in search_results(record)]
 
 
+def replay_search(msg: Message, record_id: int) -> Optional[tuple[dict, list[Hotel]]]:
+    """
+    takes a saved search from the user's history, the hotel api is not requested
+    :param msg: Message
+    :param record_id: search id
+    :return: search parameters and hotels or None if the search is not found
+    """
+    record = get_search_by_id(msg.from_user.id, record_id)
+    if record is None:
+        return None
+    return search_parameters(record), history_hotels(record)
+
+
+@timed('request_hotels')
 def request_hotels(parameters: dict, page: int = 1):
     """
-    request information from the hotel api
+    request information from the hotel api. Responses are cached: a fresh response is returned at once, a stale one
+    is returned at once and refreshed in the background, a stale response is also returned if the api fails
     :param parameters: search parameters
     :param page: page number
     :return: response from hotel api
     """
-    logger.info(f'Function {request_hotels.__name__} called with argument: page = {page}, parameters = {parameters}')
-    url = "https://hotels4.p.rapidapi.com/properties/list"
+    logger.debug('Function {} called with argument: page = {}, parameters = {}', request_hotels.__name__, page,
+                 payload(parameters))
+    querystring = make_hotels_querystring(parameters, page)
+    key = hotels_cache_key(querystring)
+    prefetcher.used('hotels', key)
+    state, cached = lookup_hotels_cache(key)
+    if state == 'fresh':
+        return cached
+    if state == 'stale':
+        refresh_hotels_in_background(key, querystring)
+        return cached
+
+    data = fetch_hotels(key, querystring)
+    if 'bad_req' in data and cached:
+        logger.warning(f'Hotels api failed, stale response taken from cache: {key}')
+        return cached
+    return data
+
 
+def make_hotels_querystring(parameters: dict, page: int = 1) -> dict:
+    """
+    makes parameters of the hotel api request
+    :param parameters: search parameters
+    :param page: page number
+    :return: querystring parameters
+    """
     querystring = {
         "adults1": "1",
         "pageNumber": page,
@@ -96,21 +238,67 @@ def request_hotels(parameters: dict, page: int = 1):
         querystring['priceMin'] = parameters['priceMin']
         querystring['pageSize'] = '25'
 
-    logger.info(f'Search parameters: {querystring}')
+    logger.debug('Search parameters: {}', payload(querystring))
+    return querystring
 
-    headers = {
-        'x-rapidapi-key': X_RAPIDAPI_KEY,
-        'x-rapidapi-host': "hotels4.p.rapidapi.com"
-    }
 
-    try:
-        response = requests.request("GET", url, headers=headers, params=querystring, timeout=20)
-        data = response.json()
-        if data.get('message'):
-            raise requests.exceptions.RequestException
+def hotels_cache_key(querystring: dict) -> str:
+    """
+    makes canonical cache key of the hotel api request
+    :param querystring: request parameters
+    :return: cache key
+    """
+    return urlencode(sorted((k, str(v)) for k, v in querystring.items()))
 
-        logger.info(f'Hotels api(properties/list) response received: {data}')
-        return data
+
+def lookup_hotels_cache(key: str) -> tuple[str, Optional[dict]]:
+    """
+    looks for the hotel api response in cache
+    :param key: cache key
+    :return: state of the entry ("fresh", "stale", "expired" or "miss") and cached response
+    """
+    entry = hotels_cache.get(key)
+    if not entry:
+        return 'miss', None
+    age = time.time() - entry['stored']
+    if age <= HOTELS_CACHE_TTL:
+        logger.info(f'Hotels api(properties/list) response taken from cache: {key}')
+        return 'fresh', entry['data']
+    if age <= HOTELS_CACHE_TTL + HOTELS_CACHE_STALE:
+        logger.info(f'Stale hotels api(properties/list) response taken from cache: {key}')
+        return 'stale', entry['data']
+    return 'expired', entry['data']
+
+
+def store_hotels(key: str, data: dict, size: int) -> dict:
+    """
+    checks the hotel api response and caches it if it is successful
+    :param key: cache key
+    :param data: response from hotel api
+    :param size: response size in bytes
+    :return: response from hotel api or {'bad_req': 'bad_req'}
+    """
+    if data.get('message'):
+        logger.error('Hotels api(properties/list) error: {}', payload(data, failed=True))
+        return {'bad_req': 'bad_req'}
+    logger.debug('Hotels api(properties/list) response received: {}', payload(data))
+    hotels_cache.set(key, {'data': data, 'stored': time.time(), 'size': size})
+    return data
+
+
+def fetch_hotels(key: str, querystring: dict) -> dict:
+    """
+    sends request to the hotel api and caches a successful response
+    :param key: cache key
+    :param querystring: request parameters
+    :return: response from hotel api
+    """
+    try:
+        response = api_get("properties/list", querystring)
+        if not response.ok:
+            logger.error(f'Hotels api(properties/list) answered with status {response.status_code}')
+            return {'bad_req': 'bad_req'}
+        return store_hotels(key, response.json(), len(response.content))
 
     except requests.exceptions.RequestException as e:
         logger.error(f'Error receiving response: {e}')
@@ -120,103 +308,92 @@ def request_hotels(parameters: dict, page: int = 1):
         return {'bad_req': 'bad_req'}
 
 
-def structure_hotels_info(msg: Message, data: dict, parameters: dict) -> dict:
+def refresh_hotels_in_background(key: str, querystring: dict) -> None:
+    """
+    refreshes cached hotel api response in the background, only one refresh of every key runs at a time
+    :param key: cache key
+    :param querystring: request parameters
+    :return: None
+    """
+    with refreshing_lock:
+        if key in refreshing:
+            return
+        refreshing.add(key)
+
+    def refresh() -> None:
+        try:
+            fetch_hotels(key, querystring)
+        finally:
+            with refreshing_lock:
+                refreshing.discard(key)
+
+    refresh_executor.submit(refresh)
+
+
+def structure_hotels_info(msg: Message, data: dict, parameters: dict, seen: Optional[set] = None) -> dict:
     """
     structures hotel data
     :param msg: Message
     :param data: hotel data
     :param parameters: dict
-    :return: dict of structured hotel data
+    :param seen: ids of hotels found on the previous pages, hotels of the page are added to it
+    :return: dict of structured hotel data, hotels are in results as Hotel
     """
-    logger.info(f'Function {structure_hotels_info.__name__} called with argument: msd = {msg}, data = {data}')
+    logger.debug('Function {} called by user {} with data: {}', structure_hotels_info.__name__, msg.from_user.id,
+                 payload(data))
     data = data.get('data', {}).get('body', {}).get('searchResults')
     hotels = dict()
     hotels['total_count'] = data.get('totalCount', 0)
 
-    logger.info(f"Next page: {data.get('pagination', {}).get('nextPageNumber', 0)}")
+    logger.debug('Next page: {}', data.get('pagination', {}).get('nextPageNumber', 0))
     hotels['next_page'] = data.get('pagination', {}).get('nextPageNumber')
     hotels['results'] = []
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
+    if seen is None:
+        seen = set()
 
     try:
         if hotels['total_count'] > 0:
+            # the user's language is looked up once per page, not for every hotel
+            no_information = _('no_information', msg)
             for cur_hotel in data.get('results'):
-                hotel = dict()
-                hotel['id'] = cur_hotel.get('id')
-                hotel['name'] = cur_hotel.get('name')
-                hotel['star_rating'] = cur_hotel.get('starRating', 0)
-                hotel['price'] = hotel_price(cur_hotel)
-                hotel['total_nights'] = parameters['total_nights']
-                hotel['total_price'] = round(parameters['total_nights'] * hotel['price'], 2)
-                if not hotel['price']:
+                hotel_id = cur_hotel.get('id')
+                if hotel_id in seen:
                     continue
-                hotel['distance'] = cur_hotel.get('landmarks')[0].get('distance', _('no_information', msg))
-                hotel['address'] = hotel_address(cur_hotel, msg)
-                if curr_user.photo_amt > 0:
-                    hotel['photos'] = request_photos(cur_hotel, curr_user.photo_amt)
-
-                if hotel not in hotels['results']:
-                    hotels['results'].append(hotel)
-        logger.info(f'Hotels in function {structure_hotels_info.__name__}: {hotels}')
+                price = hotel_price(cur_hotel)
+                if not price:
+                    continue
+                distance = cur_hotel.get('landmarks')[0].get('distance', no_information)
+                distance_value, distance_unit = parse_distance(distance)
+                coordinate = cur_hotel.get('coordinate') or {}
+                coordinates = (coordinate['lat'], coordinate['lon']) if 'lat' in coordinate and 'lon' in coordinate \
+                    else None
+                # positional arguments, keyword ones make creation of a hotel twice as slow
+                hotels['results'].append(Hotel(hotel_id, cur_hotel.get('name'), cur_hotel.get('starRating', 0), price,
+                                               parameters['total_nights'],
+                                               round(parameters['total_nights'] * price, 2), distance,
+                                               distance_value, distance_unit, hotel_address(cur_hotel, msg, no_information),
+                                               coordinates))
+                seen.add(hotel_id)
+        logger.debug('Hotels in function {}: {}', structure_hotels_info.__name__, payload(hotels))
         return hotels
 
     except Exception as e:
         logger.info(f'Error in function {structure_hotels_info.__name__}: {e}')
 
 
-def choose_best_hotels(hotels: list[dict], distance: float, limit: int) -> list[dict]:
-    """
-    deletes hotels that have a greater distance from the city center than the specified one, sorts the rest by price
-    in order increasing and limiting the selection
-    :param limit: number of hotels
-    :param distance: maximum distance from city center
-    :param hotels: structured hotels data
-    :return: required number of best hotels
-    """
-    logger.info(f'Function {choose_best_hotels.__name__} called with arguments: '
-                f'distance = {distance}, quantity = {limit}\n{hotels}')
-    hotels = list(filter(lambda x: float(x["distance"].strip().replace(',', '.').split()[0]) <= distance, hotels))
-    logger.info(f'Hotels filtered: {hotels}')
-    hotels = sorted(hotels, key=lambda k: k["price"])
-    logger.info(f'Hotels sorted: {hotels}')
-    if len(hotels) > limit:
-        hotels = hotels[:limit]
-    return hotels
-
-
-def generate_hotels_descriptions(hotels: dict, msg: Message) -> tuple[list, list]:
+def generate_hotels_descriptions(hotels: Iterable[Hotel], msg: Message,
+                                 currency: str = None) -> Iterator[tuple[dict, str]]:
     """
     generate hotels description
     :param msg: Message
     :param hotels: Hotels information
-    :return: list with hotel descriptions and list with information for saving in search history
+    :param currency: currency of hotel prices, the user's currency by default
+    :return: iterator of pairs: hotel description and information for search history
     """
-    logger.info(f'Function {generate_hotels_descriptions.__name__} called with argument {hotels}')
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    hotels_info = []
-    request_list = []
-
+    logger.debug('Function {} called with argument {}', generate_hotels_descriptions.__name__, payload(hotels))
+    curr_user = get_user(msg.from_user.id)
+    if currency is None:
+        currency = curr_user.currency
+    render_card = renderers[curr_user.language].render_card
     for hotel in hotels:
-        message = (
-            f"{_('hotel', msg)}: {hotel.get('name')}\n"
-            f"{_('rating', msg)}: {hotel_rating(hotel.get('star_rating'), msg)}\n"
-            f"{_('price', msg)}: {hotel['price']} {curr_user.currency}\n"
-            f"{_('total_nights', msg)}: {hotel['total_nights']}\n"
-            f"{_('total_price', msg)}: {hotel['total_price']} {curr_user.currency}\n"
-            f"{_('distance', msg)}: {hotel.get('distance')}\n"
-            f"{_('address', msg)}: {hotel.get('address')}\n"
-        )
-        history_message = (
-            f"{_('hotel', msg)}: {hotel.get('name')}\n"
-            f"{_('price', msg)}: {hotel['price']} {curr_user.currency}\n"
-            f"{_('address', msg)}: {hotel.get('address')}\n"
-            f"{_('site', msg)}: 'URL:' https://hotels.com/ho{hotel['id']}\n"
-        )
-        if hotel.get('photos'):
-            hotels_info.append({'photos': hotel.get('photos'), 'message': message})
-        else:
-            hotels_info.append({'message': message})
-
-        request_list.append(history_message)
-
-    return hotels_info, request_list
+        yield render_card(hotel, currency)
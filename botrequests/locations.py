@@ -5,12 +5,19 @@ import requests
 from telebot.types import Message
 from loguru import logger
 from dotenv import load_dotenv
-from config_data.config import X_RAPIDAPI_KEY
+from config_data.config import LOCATIONS_CACHE_TTL, LOCATIONS_CACHE_SIZE
 
-from database.bot_database import User
+from database.cache import PersistentCache
+from database.user_cache import get_user
+from utils.http_client import api_get
+from utils.log_config import payload
+from utils.metrics import timed, watch_cache
 
 load_dotenv()
 
+locations_cache = PersistentCache('locations', ttl=LOCATIONS_CACHE_TTL, maxsize=LOCATIONS_CACHE_SIZE)
+watch_cache('locations', locations_cache)
+
 
 def exact_location(data: dict, loc_id: str) -> tuple[str, str]:
     """
@@ -30,31 +37,37 @@ def delete_tags(html_text):
     return text
 
 
+def locations_cache_key(query: str, locale: str) -> str:
+    """
+    makes locations cache key from normalized query and locale
+    :param query: location name entered by user
+    :param locale: user's location code
+    :return: cache key
+    """
+    return f"{locale}:{' '.join(query.lower().split())}"
+
+
+@timed('request_locations')
 def request_locations(msg):
-    url = "https://hotels4.p.rapidapi.com/locations/search"
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
+    curr_user = get_user(msg.from_user.id)
 
     querystring = {
         "query": msg.text.strip(),
         "locale": curr_user.locale,
     }
 
-    headers = {
-        'x-rapidapi-key': X_RAPIDAPI_KEY,
-        'x-rapidapi-host': "hotels4.p.rapidapi.com"
-    }
-    logger.info(f'Parameters for search locations: {querystring}')
+    logger.debug('Parameters for search locations: {}', payload(querystring))
 
     try:
-        response = requests.request("GET", url, headers=headers, params=querystring, timeout=20)
-        if response.status_code == requests.codes.ok:
-            data = response.json()
-        else:
-            print(response.status_code) #заменить на логирование
-        logger.info(f'Hotels api(locations) response received: {data}')
+        response = api_get("locations/search", querystring)
+        if response.status_code != requests.codes.ok:
+            logger.error(f'Hotels api(locations) answered with status {response.status_code}')
+            return None
+        data = response.json()
+        logger.debug('Hotels api(locations) response received: {}', payload(data))
 
         if data.get('message'):
-            logger.error(f'Problems with subscription to hotels api {data}')
+            logger.error('Problems with subscription to hotels api {}', payload(data, failed=True))
             raise requests.exceptions.RequestException
         return data
     except requests.exceptions.RequestException as e:
@@ -63,23 +76,42 @@ def request_locations(msg):
         logger.error(f'Error: {e}')
 
 
+@timed('make_locations_list')
 def make_locations_list(msg: Message) -> dict:
     """
     gets data from hotel api response and generate dict: location name - location id
     :param msg: Message
     :return: dict: location name - location id
     """
+    key = locations_cache_key(msg.text, get_user(msg.from_user.id).locale)
+    locations = locations_cache.get(key)
+    if locations:
+        logger.info(f'Locations for {key} taken from cache')
+        return locations
+
     data = request_locations(msg)
     if not data:
         return {'bad_request': 'bad_request'}
 
+    locations = parse_locations(data)
+    if locations:
+        locations_cache.set(key, locations)
+    return locations
+
+
+def parse_locations(data: dict) -> [dict, None]:
+    """
+    generates dict: location name - location id from hotel api response
+    :param data: response from hotel api
+    :return: dict: location name - location id, None if there are no locations
+    """
     try:
         locations = dict()
         if len(data.get('suggestions')[0].get('entities')) > 0:
             for item in data.get('suggestions')[0].get('entities'):
                 location_name = delete_tags(item['caption'])
                 locations[location_name] = item['destinationId']
-            logger.info(locations)
+            logger.debug('Locations found: {}', payload(locations))
             return locations
     except Exception as e:
         logger.error(f'Could not parse hotel api response. {e}')
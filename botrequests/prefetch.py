@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+from loguru import logger
+from telebot.types import Message
+
+from botrequests.hotel_index import preview_deals
+from botrequests.hotels import make_hotels_querystring, hotels_cache_key, lookup_hotels_cache, fetch_hotels, \
+    structure_hotels_info
+from config_data.config import PREFETCH_NIGHTS, PREFETCH_PHOTOS, PHOTO_TIMEOUT
+from database.session_store import get_session, Session
+from utils.handling import extract_search_parameters, photos_cache, photo_links, MAX_PHOTOS
+from utils.http_client import api_get
+from utils.metrics import prefetch_requests
+from utils.prefetcher import prefetcher
+
+
+def prefetch_search(msg: Message) -> None:
+    """
+    guesses searches the user is likely to make with the parameters entered so far and warms the hotels and photos
+    caches for them in the background. After the check-in date is chosen, check-out dates PREFETCH_NIGHTS later are
+    guessed; after the check-out date, the search is known except for the photos and its hotels are prefetched; after
+    the user asks for photos, the photos of the hotels to be shown are prefetched. The prefetch is not needed for the
+    search, so its errors are only logged and the handler goes on
+    :param msg: Message or CallbackQuery
+    :return: None
+    """
+    if not prefetcher.enabled:
+        return
+    try:
+        guess_searches(msg)
+    except Exception as e:
+        logger.warning(f'Prefetch for user {msg.from_user.id} failed: {e}')
+
+
+def guess_searches(msg: Message) -> None:
+    """
+    queues prefetch of the searches guessed from the user's session
+    :param msg: Message or CallbackQuery
+    :return: None
+    """
+    user_id = msg.from_user.id
+    session = get_session(user_id)
+    if session.state == 7:
+        # the user asked for photos, the hotels of the search are prefetched already
+        if PREFETCH_PHOTOS:
+            prefetcher.submit(user_id, prefetch_search_photos, msg, extract_search_parameters(msg, session))
+            logger.info(f'Prefetch of photos of user {user_id} queued')
+        return
+    check_in = datetime.strptime(str(session.check_in), '%Y-%m-%d').date()
+    if session.state == 6:
+        check_outs = [check_in + timedelta(nights) for nights in PREFETCH_NIGHTS if nights > 0]
+    else:
+        check_outs = [datetime.strptime(str(session.check_out), '%Y-%m-%d').date()]
+        # guesses of the check-out date are not needed any more
+        prefetcher.cancel(user_id)
+    for check_out in check_outs:
+        guess = Session(user_id, dict(session.to_dict(), check_in=str(check_in), check_out=str(check_out)))
+        prefetcher.submit(user_id, prefetch_hotels, extract_search_parameters(msg, guess))
+    logger.info(f'Prefetch of {len(check_outs)} searches of user {user_id} queued')
+
+
+def prefetch_hotels(parameters: dict) -> None:
+    """
+    requests the first page of hotels of the search unless it is cached
+    :param parameters: search parameters
+    :return: None
+    """
+    querystring = make_hotels_querystring(parameters)
+    key = hotels_cache_key(querystring)
+    state, data = lookup_hotels_cache(key)
+    if state == 'fresh':
+        prefetch_requests.inc(kind='hotels', result='cached')
+        return
+    if not prefetcher.reserve('hotels'):
+        return
+    prefetcher.mark('hotels', key)
+    data = fetch_hotels(key, querystring)
+    if 'bad_req' in data:
+        prefetcher.unmark('hotels', key)
+        prefetch_requests.inc(kind='hotels', result='failed')
+
+
+def prefetch_search_photos(msg: Message, parameters: dict) -> None:
+    """
+    queues photos of the hotels that will be shown first, the hotels are taken from the cache only: if they are not
+    there, the search requests them and the photos itself
+    :param msg: Message or CallbackQuery
+    :param parameters: search parameters
+    :return: None
+    """
+    state, data = lookup_hotels_cache(hotels_cache_key(make_hotels_querystring(parameters)))
+    if state != 'fresh':
+        return
+    hotels = structure_hotels_info(msg, data, parameters)
+    if not hotels:
+        return
+    if parameters['order'] == 'DISTANCE_FROM_LANDMARK':
+        # the destination index is not changed by guesses
+        hotels = preview_deals(parameters, hotels['results'])
+    else:
+        hotels = hotels['results'][:int(parameters['quantity'])]
+    for hotel in hotels:
+        if hotel.id:
+            prefetcher.submit(msg.from_user.id, prefetch_photos, hotel.id)
+
+
+def prefetch_photos(hotel_id: int) -> None:
+    """
+    requests links to hotel photos unless they are cached
+    :param hotel_id: hotel id
+    :return: None
+    """
+    key = str(hotel_id)
+    if photos_cache.get(key) is not None:
+        prefetch_requests.inc(kind='photos', result='cached')
+        return
+    if not prefetcher.reserve('photos'):
+        return
+    prefetcher.mark('photos', key)
+    try:
+        response = api_get("properties/get-hotel-photos", {"id": hotel_id}, timeout=PHOTO_TIMEOUT)
+        photos_cache.set(key, photo_links(response.json(), MAX_PHOTOS))
+    except Exception:
+        prefetcher.unmark('photos', key)
+        prefetch_requests.inc(kind='photos', result='failed')
+        raise
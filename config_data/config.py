@@ -8,6 +8,82 @@ else:
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 X_RAPIDAPI_KEY = os.getenv('X_RAPIDAPI_KEY')
+BOT_MODE = os.getenv('BOT_MODE', 'threaded')
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 2))
+
+DB_PATH = os.getenv('DB_PATH', 'my_database.db')
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'wal')
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'normal')
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -8000))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 67108864))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1000))
+SESSION_STORE = os.getenv('SESSION_STORE', 'sqlite')
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 1))
+SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://127.0.0.1:6379/0')
+SESSION_TTL = int(os.getenv('SESSION_TTL', 86400))
+PHOTO_WORKERS = int(os.getenv('PHOTO_WORKERS', 8))
+PHOTO_TIMEOUT = float(os.getenv('PHOTO_TIMEOUT', 10))
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', 3))
+HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', 50))
+SEND_RATE = float(os.getenv('SEND_RATE', 25))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', 20))
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))
+SEND_RETRIES = int(os.getenv('SEND_RETRIES', 3))
+SEND_WAIT = float(os.getenv('SEND_WAIT', 10))
+LOCATIONS_CACHE_TTL = int(os.getenv('LOCATIONS_CACHE_TTL', 86400))
+LOCATIONS_CACHE_SIZE = int(os.getenv('LOCATIONS_CACHE_SIZE', 1000))
+HOTELS_CACHE_TTL = int(os.getenv('HOTELS_CACHE_TTL', 600))
+HOTELS_CACHE_STALE = int(os.getenv('HOTELS_CACHE_STALE', 1800))
+HOTELS_CACHE_SIZE = int(os.getenv('HOTELS_CACHE_SIZE', 500))
+HOTELS_CACHE_MAX_BYTES = int(os.getenv('HOTELS_CACHE_MAX_BYTES', 67108864))
+HOTEL_INDEX_SIZE = int(os.getenv('HOTEL_INDEX_SIZE', 200))
+PHOTOS_CACHE_TTL = int(os.getenv('PHOTOS_CACHE_TTL', 86400))
+PHOTOS_CACHE_SIZE = int(os.getenv('PHOTOS_CACHE_SIZE', 5000))
+PHOTO_FILE_ID_TTL = int(os.getenv('PHOTO_FILE_ID_TTL', 2592000))
+PHOTO_FILE_ID_CACHE_SIZE = int(os.getenv('PHOTO_FILE_ID_CACHE_SIZE', 20000))
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+PREFETCH_BUDGET = int(os.getenv('PREFETCH_BUDGET', 300))
+PREFETCH_NIGHTS = [int(nights) for nights in os.getenv('PREFETCH_NIGHTS', '1,2,3').split(',') if nights.strip()]
+PREFETCH_PHOTOS = os.getenv('PREFETCH_PHOTOS', 'true').lower() in ('1', 'true', 'yes')
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 20))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+HTTP_MIN_TIMEOUT = float(os.getenv('HTTP_MIN_TIMEOUT', 3))
+HTTP_TIMEOUT_FACTOR = float(os.getenv('HTTP_TIMEOUT_FACTOR', 3))
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', 0.95))
+LATENCY_WINDOW = int(os.getenv('LATENCY_WINDOW', 200))
+LATENCY_MIN_SAMPLES = int(os.getenv('LATENCY_MIN_SAMPLES', 20))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+LOG_FILE = os.getenv('LOG_FILE', 'logs/bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_ROTATION = os.getenv('LOG_ROTATION', '5 MB')
+LOG_ENQUEUE = os.getenv('LOG_ENQUEUE', 'true').lower() in ('1', 'true', 'yes')
+LOG_PAYLOADS = os.getenv('LOG_PAYLOADS', 'truncated')
+LOG_PAYLOAD_LIMIT = int(os.getenv('LOG_PAYLOAD_LIMIT', 1000))
+LOG_PAYLOAD_SAMPLE = float(os.getenv('LOG_PAYLOAD_SAMPLE', 0.01))
+HANDLER_WORKERS = int(os.getenv('HANDLER_WORKERS', 8))
+WORKERS = int(os.getenv('WORKERS', 1))
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', 1000))
+# set by the supervisor in worker processes: the workers share the rate limits and the budget of the bot, every
+# worker writes its own log file and serves its own metrics
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', -1))
+if WORKER_INDEX >= 0:
+    SEND_RATE = SEND_RATE / WORKERS
+    PREFETCH_BUDGET = max(1, PREFETCH_BUDGET // WORKERS)
+    LOG_FILE = '{0}.{2}{1}'.format(*os.path.splitext(LOG_FILE), WORKER_INDEX)
+    METRICS_PORT = METRICS_PORT and METRICS_PORT + 1 + WORKER_INDEX
 
 DEFAULT_COMMANDS = (
     ('help', "справка"),
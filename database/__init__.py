@@ -1 +1,5 @@
-from . import bot_database
\ No newline at end of file
+from . import bot_database
+from . import cache
+from . import history
+from . import user_cache
+from . import session_store
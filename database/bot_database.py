@@ -1,11 +1,52 @@
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+
 from peewee import *
 
-db = SqliteDatabase('my_database.db')
+from config_data.config import DB_PATH, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE
+
+pragmas = {
+    'journal_mode': DB_JOURNAL_MODE,
+    'synchronous': DB_SYNCHRONOUS,
+    'cache_size': DB_CACHE_SIZE,
+    'mmap_size': DB_MMAP_SIZE,
+}
+# queries of the update being handled are counted here, see CountingSqliteDatabase
+update_queries = ContextVar('update_queries', default=None)
+
+
+class CountingSqliteDatabase(SqliteDatabase):
+    """
+    class CountingSqliteDatabase. Parent - SqliteDatabase
+    Counts executed queries: all of them and the ones of the current update. The update counter is a one-item list
+    put to update_queries by the handler, it is shared with threads started by asyncio.to_thread
+     Attributes:
+        :queries(int): number of executed queries
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self._queries_lock = Lock()
+
+    def execute_sql(self, sql, *args, **kwargs):
+        counter = update_queries.get()
+        with self._queries_lock:
+            self.queries += 1
+            # threads of one update increment the same counter
+            if counter is not None:
+                counter[0] += 1
+        return super().execute_sql(sql, *args, **kwargs)
+
+
+# every thread opens its own connection, the pragmas are applied to each new connection
+db = CountingSqliteDatabase(DB_PATH, pragmas=pragmas, thread_safe=True, check_same_thread=False)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
+        only_save_dirty = True
 
 
 class User(BaseModel):
@@ -28,6 +69,8 @@ class User(BaseModel):
         :max_price(str): maximum price
         :distance(str): distance from the city center
         :photo_amt(str): required number of hotel photos
+    The search fields are filled when the user is created and are not updated any more, the conversation state is
+    kept in the session store (database/session_store.py)
     """
     id = IntegerField(unique=True)
     username = CharField()
@@ -47,20 +90,63 @@ class User(BaseModel):
     photo_amt = IntegerField()
 
 
-class SearchHistory(BaseModel):
+class SearchRecord(BaseModel):
+    """
+    class SearchRecord. Parent - BaseModel
+    Attributes:
+        :id(int): search id
+        :user_id(int): user id
+        :created(datetime): date and time of the search
+        :order(str): sort order of the search
+        :destination_name(str): destination name
+        :parameters(str): search parameters in json format
+        :results(bytes): zlib compressed json with structured data of the found hotels
+    """
+    user_id = IntegerField()
+    created = DateTimeField(default=datetime.now)
+    order = CharField()
+    destination_name = CharField()
+    parameters = TextField()
+    results = BlobField()
+
+    class Meta:
+        indexes = (
+            (('user_id', 'created'), False),
+        )
+
+
+class SessionState(BaseModel):
     """
-    class SearchHistory. Parent - BaseModel
+    class SessionState. Parent - BaseModel
     Attributes:
-        :id(int): id
         :user_id(int): user id
-        :history(str): the last 3 user's requests
+        :data(str): conversation state of the user in json format
     """
-    id = IntegerField(primary_key=True, unique=True)
-    user_id = IntegerField(unique=True)
-    history = CharField()
+    user_id = IntegerField(primary_key=True)
+    data = TextField()
+
+
+class CacheEntry(BaseModel):
+    """
+    class CacheEntry. Parent - BaseModel
+    Attributes:
+        :namespace(str): name of the cache
+        :key(str): cache key
+        :value(str): cached value in json format
+        :expires(float): unix time after which the value is out of date
+    """
+    namespace = CharField()
+    key = CharField()
+    value = TextField()
+    expires = FloatField()
+
+    class Meta:
+        primary_key = CompositeKey('namespace', 'key')
 
 
 db.connect()
 User.create_table()
-SearchHistory.create_table()
+SearchRecord.create_table()
+SessionState.create_table()
+CacheEntry.create_table()
 db.close()
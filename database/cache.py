@@ -0,0 +1,207 @@
+import json
+import time
+from collections import OrderedDict
+from threading import Lock, RLock
+from typing import Any, Callable, Hashable, Optional
+
+from database.bot_database import CacheEntry
+
+
+class LRUCache:
+    """
+    class LRUCache. Thread-safe mapping with a bounded size and least recently used eviction
+     Attributes:
+        :maxsize(int): maximum number of entries
+        :max_weight(int): maximum total weight of entries, None - unlimited
+        :weigher(Callable): returns weight of a value (for example, its size in bytes)
+        :weight(int): current total weight of entries
+        :hits(int): number of lookups that found an entry
+        :misses(int): number of lookups that found nothing
+    """
+    def __init__(self, maxsize: int = 1024, max_weight: Optional[int] = None,
+                 weigher: Optional[Callable[[Any], int]] = None) -> None:
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._weights = dict()
+        self._lock = RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        returns cached value and marks it as recently used
+        :param key: cache key
+        :param default: value returned on a miss
+        :return: cached value or default
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        stores value, evicting the least recently used entries if the cache is full
+        :param key: cache key
+        :param value: value to store
+        :return: None
+        """
+        with self._lock:
+            self.pop(key)
+            self._data[key] = value
+            if self.weigher:
+                self._weights[key] = self.weigher(value)
+                self.weight += self._weights[key]
+            while len(self._data) > self.maxsize or \
+                    (self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1):
+                old_key, _ = self._data.popitem(last=False)
+                self.weight -= self._weights.pop(old_key, 0)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        removes entry from the cache
+        :param key: cache key
+        :param default: value returned if there is no entry
+        :return: removed value or default
+        """
+        with self._lock:
+            self.weight -= self._weights.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        """
+        removes all entries and resets counters
+        :return: None
+        """
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        returns cache statistics
+        :return: dict with size, hits, misses and hit ratio
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'weight': self.weight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class PersistentCache:
+    """
+    class PersistentCache. Cache with time to live stored in the CacheEntry table with an in-memory LRUCache in front
+     Attributes:
+        :namespace(str): name of the cache, separates entries of different caches in the table
+        :ttl(float): entry lifetime in seconds
+        :memory(LRUCache): in-memory cache of (value, expires) pairs
+        :hits(int): number of lookups that found an entry in memory or in database
+        :misses(int): number of lookups that found nothing
+    """
+    def __init__(self, namespace: str, ttl: float, maxsize: int = 1024) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+        # lookups come from handler, photo, prefetch and refresh threads
+        self._stats_lock = Lock()
+
+    def count(self, hit: bool) -> None:
+        """
+        counts lookup
+        :param hit: True if an entry was found
+        :return: None
+        """
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        returns value if it is not out of date, looks in memory first and then in database
+        :param key: cache key
+        :param default: value returned on a miss
+        :return: cached value or default
+        """
+        entry = self.memory.get(key)
+        if entry is None:
+            row = CacheEntry.get_or_none(CacheEntry.namespace == self.namespace, CacheEntry.key == key)
+            if row is None:
+                self.count(False)
+                return default
+            entry = (json.loads(row.value), row.expires)
+            self.memory.set(key, entry)
+        value, expires = entry
+        if expires < time.time():
+            self.count(False)
+            self.delete(key)
+            return default
+        self.count(True)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        stores json serializable value in memory and in database
+        :param key: cache key
+        :param value: value to store
+        :return: None
+        """
+        expires = time.time() + self.ttl
+        self.memory.set(key, (value, expires))
+        CacheEntry.replace(namespace=self.namespace, key=key, value=json.dumps(value, ensure_ascii=False),
+                           expires=expires).execute()
+
+    def delete(self, key: str) -> None:
+        """
+        removes entry from memory and database
+        :param key: cache key
+        :return: None
+        """
+        self.memory.pop(key)
+        CacheEntry.delete().where(CacheEntry.namespace == self.namespace, CacheEntry.key == key).execute()
+
+    def stats(self) -> dict:
+        """
+        returns cache statistics, hits in memory and in database are counted together
+        :return: dict with size of the in-memory cache, hits, misses and hit ratio
+        """
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return dict(self.memory.stats(), hits=hits, misses=misses, hit_ratio=hits / total if total else 0.0)
+
+    def purge_expired(self) -> int:
+        """
+        removes out of date entries of this cache from database
+        :return: number of removed entries
+        """
+        return CacheEntry.delete().where(CacheEntry.namespace == self.namespace,
+                                         CacheEntry.expires < time.time()).execute()
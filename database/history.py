@@ -0,0 +1,149 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+
+from config_data.config import HISTORY_SIZE
+from database.bot_database import db, SearchRecord
+from translations.translations import vocabulary
+
+# titles of the searches in the old SearchHistory table, in any language
+LEGACY_ORDERS = {title: order for key, order in (('lowprice', 'PRICE'), ('highprice', 'PRICE_HIGHEST_FIRST'),
+                                                 ('bestdeal', 'DISTANCE_FROM_LANDMARK'))
+                 for title in vocabulary[key].values()}
+
+
+def add_search(user_id: int, parameters: dict, hotels: list[dict]) -> SearchRecord:
+    """
+    saves search parameters and found hotels, keeps no more than HISTORY_SIZE latest searches of the user
+    :param user_id: user id
+    :param parameters: search parameters
+    :param hotels: structured hotels data
+    :return: SearchRecord
+    """
+    record = SearchRecord.create(
+        user_id=user_id,
+        order=parameters['order'],
+        destination_name=parameters.get('destination_name', ''),
+        parameters=json.dumps(parameters, ensure_ascii=False),
+        results=zlib.compress(json.dumps(hotels, ensure_ascii=False).encode('utf-8'))
+    )
+    latest = (SearchRecord.select(SearchRecord.id)
+              .where(SearchRecord.user_id == user_id)
+              .order_by(SearchRecord.created.desc(), SearchRecord.id.desc())
+              .limit(HISTORY_SIZE))
+    SearchRecord.delete().where(SearchRecord.user_id == user_id, SearchRecord.id.not_in(latest)).execute()
+    return record
+
+
+def get_search(user_id: int, offset: int = 0) -> tuple[Optional[SearchRecord], bool]:
+    """
+    returns user's search by its position in history, the latest search has offset 0
+    :param user_id: user id
+    :param offset: number of newer searches
+    :return: SearchRecord or None and True if there are older searches
+    """
+    records = list(SearchRecord.select()
+                   .where(SearchRecord.user_id == user_id)
+                   .order_by(SearchRecord.created.desc(), SearchRecord.id.desc())
+                   .offset(offset)
+                   .limit(2))
+    if not records:
+        return None, False
+    return records[0], len(records) > 1
+
+
+def get_search_by_id(user_id: int, record_id: int) -> Optional[SearchRecord]:
+    """
+    returns user's search by id
+    :param user_id: user id
+    :param record_id: search id
+    :return: SearchRecord or None
+    """
+    return SearchRecord.get_or_none(SearchRecord.id == record_id, SearchRecord.user_id == user_id)
+
+
+def search_parameters(record: SearchRecord) -> dict:
+    """
+    returns parameters of the saved search
+    :param record: SearchRecord
+    :return: search parameters
+    """
+    return json.loads(record.parameters)
+
+
+def search_results(record: SearchRecord) -> list[dict]:
+    """
+    returns hotels found by the saved search
+    :param record: SearchRecord
+    :return: structured hotels data
+    """
+    return json.loads(zlib.decompress(record.results).decode('utf-8'))
+
+
+def parse_legacy_search(text: str) -> Optional[tuple[datetime, dict, list[dict]]]:
+    """
+    parses a search saved in the old SearchHistory table: the search title, the date and the list of hotels with
+    name, price, address and website lines, the lines of the hotels are the ones shown on a history page
+    :param text: search text
+    :return: date, search parameters and hotels or None if the text is not a saved search
+    """
+    title, _, rest = text.strip().partition('\n\n')
+    date_line, _, hotels_text = rest.partition('\n\n')
+    if title not in LEGACY_ORDERS or ': ' not in date_line:
+        return None
+    created = datetime.fromisoformat(date_line.split(': ', 1)[1].strip())
+    currency = ''
+    hotels = []
+    # the first line is the title of the hotel list
+    for block in hotels_text.split('\n', 1)[-1].strip().split('\n\n'):
+        values = [line.split(': ', 1)[1] for line in block.strip().split('\n')]
+        if len(values) != 4:
+            continue
+        name, price, address, site = values
+        price, currency = price.rsplit(' ', 1)
+        hotels.append({'id': int(site.rsplit('/ho', 1)[1]), 'name': name, 'star_rating': 0,
+                       'price': float(price) if '.' in price else int(price), 'address': address})
+    # the old history did not keep the other search parameters, such searches can not be repeated
+    return created, {'order': LEGACY_ORDERS[title], 'currency': currency, 'legacy': True}, hotels
+
+
+def migrate_search_history() -> None:
+    """
+    moves searches of the old SearchHistory table (the last 3 searches of a user as text) to SearchRecord and drops
+    the table, a search that can not be parsed is skipped with a warning
+    :return: None
+    """
+    if not db.table_exists('searchhistory'):
+        return
+    migrated = skipped = 0
+    with db.atomic():
+        for user_id, history in db.execute_sql('SELECT user_id, history FROM searchhistory').fetchall():
+            for text in (history or '').split(';'):
+                if not text.strip():
+                    continue
+                try:
+                    search = parse_legacy_search(text)
+                except (ValueError, IndexError):
+                    search = None
+                if search is None:
+                    logger.warning(f'Search of user {user_id} is not moved from the old history: {text[:50]!r}')
+                    skipped += 1
+                    continue
+                created, parameters, hotels = search
+                SearchRecord.create(
+                    user_id=user_id,
+                    created=created,
+                    order=parameters['order'],
+                    destination_name='',
+                    parameters=json.dumps(parameters, ensure_ascii=False),
+                    results=zlib.compress(json.dumps(hotels, ensure_ascii=False).encode('utf-8'))
+                )
+                migrated += 1
+        db.execute_sql('DROP TABLE searchhistory')
+    logger.info(f'{migrated} searches moved from the old history, {skipped} skipped')
+
+
+migrate_search_history()
@@ -0,0 +1,123 @@
+import argparse
+import socketserver
+import time
+from threading import Lock
+from typing import Any
+
+from loguru import logger
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    class RespServer. Parent - ThreadingTCPServer
+    Local stand-in for Redis that keeps data in memory and supports the commands used by the session store:
+    PING, SELECT, GET, SET (with EX and PX), DEL, EXISTS, DBSIZE, FLUSHDB
+     Attributes:
+        :data(dict): key - (value, expiration unix time or None)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379) -> None:
+        self.data = dict()
+        self.lock = Lock()
+        super().__init__((host, port), RespHandler)
+
+    def alive(self, key: bytes) -> bool:
+        """
+        checks if the key exists and removes it if it is out of date, must be called under lock
+        :param key: key
+        :return: True if the key exists
+        """
+        entry = self.data.get(key)
+        if entry is None:
+            return False
+        if entry[1] is not None and entry[1] < time.time():
+            del self.data[key]
+            return False
+        return True
+
+    def command(self, args: list[bytes]) -> Any:
+        """
+        executes command
+        :param args: command name and arguments
+        :return: reply: str - status, int, bytes, None - null reply, Exception - error
+        """
+        name = args[0].upper()
+        with self.lock:
+            if name == b'PING':
+                return 'PONG'
+            if name in (b'SELECT', b'FLUSHDB'):
+                if name == b'FLUSHDB':
+                    self.data.clear()
+                return 'OK'
+            if name == b'GET' and len(args) == 2:
+                return self.data[args[1]][0] if self.alive(args[1]) else None
+            if name == b'SET' and len(args) in (3, 5):
+                expires = None
+                if len(args) == 5:
+                    unit = args[3].upper()
+                    if unit not in (b'EX', b'PX'):
+                        return RuntimeError('ERR syntax error')
+                    expires = time.time() + int(args[4]) / (1 if unit == b'EX' else 1000)
+                self.data[args[1]] = (args[2], expires)
+                return 'OK'
+            if name in (b'DEL', b'EXISTS') and len(args) > 1:
+                found = [key for key in args[1:] if self.alive(key)]
+                if name == b'DEL':
+                    for key in found:
+                        del self.data[key]
+                return len(found)
+            if name == b'DBSIZE':
+                return sum(self.alive(key) for key in list(self.data))
+        return RuntimeError(f"ERR unknown command or wrong number of arguments for '{name.decode()}'")
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """
+    class RespHandler. Parent - StreamRequestHandler
+    Reads commands of one client connection and writes the replies
+    """
+    def handle(self) -> None:
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            self.wfile.write(self.encode(self.server.command(args)))
+
+    def read_command(self) -> [list[bytes], None]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def encode(reply: Any) -> bytes:
+        if isinstance(reply, Exception):
+            return f'-{reply}\r\n'.encode()
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, str):
+            return f'+{reply}\r\n'.encode()
+        if isinstance(reply, int):
+            return f':{reply}\r\n'.encode()
+        return f'${len(reply)}\r\n'.encode() + reply + b'\r\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for Redis used by SESSION_STORE=redis')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    with RespServer(args.host, args.port) as server:
+        logger.info(f'RESP server listens on {server.server_address}')
+        server.serve_forever()
@@ -0,0 +1,437 @@
+import atexit
+import json
+import socket
+from abc import ABC, abstractmethod
+from threading import Event, Lock, Thread
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from loguru import logger
+from peewee import chunked
+
+from config_data.config import SESSION_STORE, SESSION_FLUSH_INTERVAL, SESSION_REDIS_URL, SESSION_TTL, \
+    USER_CACHE_SIZE
+from database.bot_database import db, SessionState, User
+from database.cache import LRUCache
+
+SESSION_FIELDS = {
+    'state': int,
+    'order': str,
+    'dest_id': str,
+    'destination_name': str,
+    'check_in': str,
+    'check_out': str,
+    'quantity': str,
+    'min_price': str,
+    'max_price': str,
+    'distance': str,
+    'photo_amt': int,
+}
+DEFAULT_SESSION = {
+    'state': 0,
+    'order': 'start',
+    'dest_id': '0',
+    'destination_name': '0',
+    'check_in': '0',
+    'check_out': '0',
+    'quantity': '0',
+    'min_price': '0',
+    'max_price': '0',
+    'distance': '0',
+    'photo_amt': 0,
+}
+
+
+class Session:
+    """
+    class Session. Conversation state of a user while a search is in progress
+     Attributes:
+        :user_id(int): user id
+        :state(int): current user's state
+        :order(str): required way of sorting hotels
+        :dest_id(str): destination id
+        :destination_name(str): destination name
+        :check_in(str): check in date
+        :check_out(str): check out date
+        :quantity(str): required number of hotels
+        :min_price(str): minimum price
+        :max_price(str): maximum price
+        :distance(str): distance from the city center
+        :photo_amt(int): required number of hotel photos
+    """
+    def __init__(self, user_id: int, data: Optional[dict] = None) -> None:
+        self.user_id = user_id
+        for name, value in DEFAULT_SESSION.items():
+            setattr(self, name, value)
+        for name, value in (data or dict()).items():
+            if name in SESSION_FIELDS:
+                setattr(self, name, value)
+
+    def to_dict(self) -> dict:
+        """
+        returns session fields converted to their types, dates become strings like 2022-10-01
+        :return: dict field name - value
+        """
+        return {name: cast(getattr(self, name)) for name, cast in SESSION_FIELDS.items()}
+
+
+class SessionStore(ABC):
+    """
+    class SessionStore. Parent - ABC
+    Base class of conversation state storages, sessions are stored as dicts
+    """
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[dict]:
+        """
+        returns stored session
+        :param user_id: user id
+        :return: session fields or None if there is no session
+        """
+
+    @abstractmethod
+    def set(self, user_id: int, data: dict) -> None:
+        """
+        stores session
+        :param user_id: user id
+        :param data: session fields
+        :return: None
+        """
+
+    @abstractmethod
+    def delete(self, user_id: int) -> None:
+        """
+        removes session
+        :param user_id: user id
+        :return: None
+        """
+
+    def flush(self) -> None:
+        """
+        writes buffered changes, if the storage has any
+        :return: None
+        """
+
+    def close(self) -> None:
+        """
+        writes buffered changes and releases resources
+        :return: None
+        """
+        self.flush()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    class MemorySessionStore. Parent - SessionStore
+    Keeps sessions in memory of the process, they are lost on restart
+    """
+    def __init__(self) -> None:
+        self._sessions = dict()
+        self._lock = Lock()
+
+    def get(self, user_id: int) -> Optional[dict]:
+        with self._lock:
+            data = self._sessions.get(user_id)
+        return dict(data) if data is not None else None
+
+    def set(self, user_id: int, data: dict) -> None:
+        with self._lock:
+            self._sessions[user_id] = dict(data)
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    class SqliteSessionStore. Parent - SessionStore
+    Keeps sessions in memory and writes the changed ones to the SessionState table in one transaction every
+    flush_interval seconds
+     Attributes:
+        :flush_interval(float): seconds between writes
+        :memory(LRUCache): recently used sessions
+        :pending(dict): changed sessions that are not written yet, None - removed session
+        :flushing(dict): changed sessions that are being written now, they are read from here until the transaction
+         is committed
+    """
+    def __init__(self, flush_interval: float = SESSION_FLUSH_INTERVAL, maxsize: int = USER_CACHE_SIZE) -> None:
+        self.flush_interval = flush_interval
+        self.memory = LRUCache(maxsize=maxsize)
+        self.pending = dict()
+        self.flushing = dict()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._stopped = Event()
+        self._writer = Thread(target=self.write_behind, name='session_writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def get(self, user_id: int) -> Optional[dict]:
+        with self._lock:
+            for changed in (self.pending, self.flushing):
+                if user_id in changed:
+                    data = changed[user_id]
+                    return dict(data) if data is not None else None
+        data = self.memory.get(user_id)
+        if data is None:
+            row = SessionState.get_or_none(SessionState.user_id == user_id)
+            data = json.loads(row.data) if row is not None else None
+            with self._lock:
+                # the session could be changed while the row was read, the row is older then
+                for changed in (self.pending, self.flushing):
+                    if user_id in changed:
+                        data = changed[user_id]
+                        break
+                else:
+                    if data is not None:
+                        self.memory.set(user_id, data)
+            if data is None:
+                return None
+        return dict(data)
+
+    def set(self, user_id: int, data: dict) -> None:
+        data = dict(data)
+        with self._lock:
+            self.pending[user_id] = data
+        self.memory.set(user_id, data)
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self.pending[user_id] = None
+        self.memory.pop(user_id)
+
+    def write_behind(self) -> None:
+        """
+        writes changed sessions until the store is closed
+        :return: None
+        """
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, dict()
+                self.flushing = pending
+            if not pending:
+                return
+            rows = [{'user_id': user_id, 'data': json.dumps(data, ensure_ascii=False)}
+                    for user_id, data in pending.items() if data is not None]
+            removed = [user_id for user_id, data in pending.items() if data is None]
+            try:
+                with db.atomic():
+                    for batch in chunked(rows, 100):
+                        SessionState.replace_many(batch).execute()
+                    if removed:
+                        SessionState.delete().where(SessionState.user_id.in_(removed)).execute()
+            except Exception as e:
+                logger.error(f'Could not write {len(pending)} sessions: {e}')
+                with self._lock:
+                    for user_id, data in pending.items():
+                        self.pending.setdefault(user_id, data)
+                    self.flushing = dict()
+            else:
+                with self._lock:
+                    self.flushing = dict()
+                logger.debug(f'{len(pending)} sessions written')
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+
+class RespError(Exception):
+    """
+    class RespError. Parent - Exception
+    Error reply of a Redis protocol server
+    """
+
+
+class RespClient:
+    """
+    class RespClient. Minimal thread-safe client of the Redis protocol (RESP2) working over one connection
+     Attributes:
+        :host(str): server host
+        :port(int): server port
+        :db(int): database number
+        :timeout(float): socket timeout in seconds
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0, timeout: float = 5.0) -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = Lock()
+
+    def connect(self) -> None:
+        """
+        opens connection and selects the database
+        :return: None
+        """
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile('rb')
+        if self.db:
+            self._send('SELECT', self.db)
+            self._read()
+
+    def disconnect(self) -> None:
+        """
+        closes connection
+        :return: None
+        """
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = None
+        self._file = None
+
+    def execute(self, *args: Any) -> Any:
+        """
+        sends command and returns its reply, reconnects once if the connection was lost
+        :param args: command and its arguments, for example 'SET', 'key', 'value'
+        :return: decoded reply
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self.connect()
+                    self._send(*args)
+                    return self._read()
+                except OSError:
+                    self.disconnect()
+                    if attempt:
+                        raise
+
+    def _send(self, *args: Any) -> None:
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f'${len(arg)}\r\n'.encode() + arg + b'\r\n')
+        self._sock.sendall(b''.join(parts))
+
+    def _read(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RespError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            return None if length < 0 else self._file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RespError(f'Unknown reply: {line!r}')
+
+
+class RespSessionStore(SessionStore):
+    """
+    class RespSessionStore. Parent - SessionStore
+    Keeps sessions in Redis or any server speaking the Redis protocol, a session expires ttl seconds after the last
+    change
+     Attributes:
+        :client(RespClient): protocol client
+        :ttl(int): session lifetime in seconds
+    """
+    def __init__(self, url: str = SESSION_REDIS_URL, ttl: int = SESSION_TTL) -> None:
+        parsed = urlparse(url)
+        self.client = RespClient(parsed.hostname or '127.0.0.1', parsed.port or 6379,
+                                 int(parsed.path.strip('/') or 0))
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f'session:{user_id}'
+
+    def get(self, user_id: int) -> Optional[dict]:
+        data = self.client.execute('GET', self.key(user_id))
+        return json.loads(data) if data is not None else None
+
+    def set(self, user_id: int, data: dict) -> None:
+        self.client.execute('SET', self.key(user_id), json.dumps(data, ensure_ascii=False), 'EX', self.ttl)
+
+    def delete(self, user_id: int) -> None:
+        self.client.execute('DEL', self.key(user_id))
+
+    def close(self) -> None:
+        self.client.disconnect()
+
+
+def make_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    """
+    makes session store of the given kind
+    :param kind: "memory", "sqlite" or "redis"
+    :return: SessionStore
+    """
+    if kind == 'memory':
+        return MemorySessionStore()
+    if kind == 'sqlite':
+        return SqliteSessionStore()
+    if kind == 'redis':
+        return RespSessionStore()
+    raise ValueError(f'Unknown session store: {kind}')
+
+
+session_store = make_session_store()
+
+
+def get_session(user_id: int) -> Session:
+    """
+    returns conversation state of the user, a new session if there is no stored one
+    :param user_id: user id
+    :return: Session
+    """
+    return Session(user_id, session_store.get(user_id))
+
+
+def save_session(session: Session) -> None:
+    """
+    stores conversation state of the user
+    :param session: Session
+    :return: None
+    """
+    session_store.set(session.user_id, session.to_dict())
+
+
+def update_session(user_id: int, **fields: Any) -> None:
+    """
+    changes only the given fields of the stored session, the other fields keep the values stored meanwhile, for
+    example by a handler of a new command that ran while a search was in progress
+    :param user_id: user id
+    :param fields: field name - new value
+    :return: None
+    """
+    session = get_session(user_id)
+    for name, value in fields.items():
+        setattr(session, name, value)
+    save_session(session)
+
+
+def migrate_user_sessions() -> None:
+    """
+    moves searches that were in progress in the old state columns of the User table to the session store, the state
+    of the moved users is reset in the table, so it is done once
+    :return: None
+    """
+    users = list(User.select().where(User.state != 0))
+    if not users:
+        return
+    migrated = 0
+    for user in users:
+        if session_store.get(user.id) is None:
+            session_store.set(user.id, {name: cast(getattr(user, name)) for name, cast in SESSION_FIELDS.items()})
+            migrated += 1
+    session_store.flush()
+    User.update(state=0).where(User.id.in_([user.id for user in users])).execute()
+    logger.info(f'{migrated} searches in progress moved from the users table to the session store')
+
+
+migrate_user_sessions()
@@ -0,0 +1,48 @@
+from loguru import logger
+
+from config_data.config import USER_CACHE_SIZE
+from database.bot_database import User
+from database.cache import LRUCache
+
+user_cache = LRUCache(maxsize=USER_CACHE_SIZE)
+
+
+def get_user(user_id: int) -> User:
+    """
+    returns user profile from cache, reads it from database only on a cache miss
+    :param user_id: user id
+    :return: User
+    """
+    curr_user = user_cache.get(user_id)
+    if curr_user is None:
+        curr_user = User.select().where(User.id == user_id).get()
+        user_cache.set(user_id, curr_user)
+    return curr_user
+
+
+def save_user(curr_user: User) -> None:
+    """
+    saves user profile to database and keeps the cached copy up to date. Field values are converted the same way
+    as after reading them from database, so cached and stored profiles are identical
+    :param curr_user: User
+    :return: None
+    """
+    try:
+        curr_user.save()
+    except Exception:
+        user_cache.pop(curr_user.id)
+        logger.exception(f'Could not save user {curr_user.id}, cached profile dropped')
+        raise
+    for field in curr_user._meta.sorted_fields:
+        if field.name in curr_user.__data__:
+            curr_user.__data__[field.name] = field.python_value(field.db_value(curr_user.__data__[field.name]))
+    user_cache.set(curr_user.id, curr_user)
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    removes user profile from cache, the next read goes to database
+    :param user_id: user id
+    :return: None
+    """
+    user_cache.pop(user_id)
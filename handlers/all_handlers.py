@@ -1,49 +1,78 @@
 import os
+import time
+from typing import Iterable
 
-import telebot
 from telegram_bot_calendar import DetailedTelegramCalendar
 from loader import bot
-from telebot.types import Message, CallbackQuery, InputMediaPhoto
+from telebot.types import Message, CallbackQuery
 from dotenv import load_dotenv
 from loguru import logger
-from datetime import date
 
-from botrequests.hotels import get_hotels
-from botrequests.locations import exact_location, make_locations_list
-from utils.handling import internationalize as _, is_input_correct, get_parameters_information, \
-    make_message, steps, locales, logger_config, currencies, is_user_in_db, add_user, extract_search_parameters, \
-    check_in_date, check_out_date
-from database.bot_database import User, SearchHistory
+from botrequests.hotels import get_hotels, stream_hotels, generate_hotels_descriptions, history_page, \
+    replay_search
+from botrequests.locations import make_locations_list
+from botrequests.prefetch import prefetch_search
+from handlers.steps import Step, settings_menu, start_search, help_message, history_replies, text_step, \
+    input_mistake, locations_menu, parameter_step, calendar_step, button_step, search_failure, results_header
+from utils.handling import internationalize as _, is_user_in_db, add_user, extract_search_parameters
+from database.bot_database import User
+from database.user_cache import get_user, save_user
+from utils.send_scheduler import outbox, bulk_outbox
+from utils.log_config import logger_config, payload
+from utils.metrics import card_seconds, searches_in_flight
+from utils.telegram_photos import send_photos
+from database.session_store import Session, get_session, save_session, update_session
 
 logger.configure(**logger_config)
 load_dotenv()
 
 
-def get_locations(msg: Message) -> None:
+def run_step(msg: [Message, CallbackQuery], chat_id: int, step: Step, session: Session = None,
+             curr_user: User = None) -> None:
+    """
+    saves what the step changed, sends its replies and does its action
+    :param msg: Message or CallbackQuery
+    :param chat_id: chat id
+    :param step: Step made by a function of handlers.steps
+    :param session: conversation state of the user
+    :param curr_user: user
+    :return: None
+    """
+    if step.save_session:
+        save_session(session)
+    if step.save_user:
+        save_user(curr_user)
+    for text, options in step.replies:
+        outbox.send_message(chat_id, text, **options)
+    if step.action == 'locations':
+        get_locations(msg, session)
+    elif step.action == 'parameters':
+        get_search_parameters(msg, session)
+    elif step.action == 'prefetch':
+        prefetch_search(msg)
+    elif step.action == 'search':
+        hotels_list(msg)
+    elif step.action == 'history':
+        send_history_page(msg, chat_id, step.argument)
+    elif step.action == 'repeat':
+        repeat_search(msg, chat_id, step.argument)
+
+
+def get_locations(msg: Message, session: Session) -> None:
     """
     takes location name, searches locations with similar name and sends result to chat
     :param msg: Message
+    :param session: conversation state of the user
     :return: None
     """
-    if not is_input_correct(msg):
-        bot.send_message(msg.chat.id, make_message(msg, 'mistake_'))
-    else:
-        wait_msg = bot.send_message(msg.chat.id, _('wait', msg))
-        locations = make_locations_list(msg)
-        bot.delete_message(msg.chat.id, wait_msg.id)
-        if not locations or len(locations) < 1:
-            bot.send_message(msg.chat.id, str(msg.text) + _('locations_not_found', msg))
-        elif locations.get('bad_request'):
-            bot.send_message(msg.chat.id, _('bad_request', msg))
-        else:
-            menu = telebot.types.InlineKeyboardMarkup()
-            for loc_name, loc_id in locations.items():
-                menu.add(telebot.types.InlineKeyboardButton(
-                    text=loc_name,
-                    callback_data='code' + loc_id)
-                )
-            menu.add(telebot.types.InlineKeyboardButton(text=_('cancel', msg), callback_data='cancel'))
-            bot.send_message(msg.chat.id, _('loc_choose', msg), reply_markup=menu)
+    mistake = input_mistake(msg, session)
+    if mistake is not None:
+        run_step(msg, msg.chat.id, mistake)
+        return
+    wait_msg = outbox.queue(msg.chat.id, bot.send_message, msg.chat.id, _('wait', msg))
+    locations = make_locations_list(msg)
+    outbox.delete_queued(msg.chat.id, wait_msg)
+    run_step(msg, msg.chat.id, locations_menu(msg, locations))
 
 
 @bot.message_handler(commands=['settings'])
@@ -55,12 +84,8 @@ def get_command_settings(message: Message) -> None:
     """
     if not is_user_in_db(message):
         add_user(message)
-    logger.info(f'Функция {get_command_settings.__name__} вызвана с параметром: {message}')
-    menu = telebot.types.InlineKeyboardMarkup()
-    menu.add(telebot.types.InlineKeyboardButton(text=_("language_", message), callback_data='set_locale'))
-    menu.add(telebot.types.InlineKeyboardButton(text=_("currency_", message), callback_data='set_currency'))
-    menu.add(telebot.types.InlineKeyboardButton(text=_("cancel", message), callback_data='cancel'))
-    bot.send_message(message.chat.id, _("settings", message), reply_markup=menu)
+    logger.info('Функция {} вызвана пользователем {}', get_command_settings.__name__, message.from_user.id)
+    run_step(message, message.chat.id, settings_menu(message))
 
 
 @bot.message_handler(commands=['lowprice', 'highprice', 'bestdeal'])
@@ -75,26 +100,8 @@ def get_searching_commands(message: Message) -> None:
     logger.info("\n" + "=" * 100 + "\n")
     if not is_user_in_db(message):
         add_user(message)
-    chat_id = message.chat.id
-    curr_user = User.select().where(User.id == message.from_user.id).get()
-    curr_user.state = 1
-    curr_user.save()
-    if 'lowprice' in message.text:
-        curr_user.order = 'PRICE'
-        curr_user.save()
-        logger.info('"lowprice" command is called')
-    elif 'highprice' in message.text:
-        curr_user.order = 'PRICE_HIGHEST_FIRST'
-        curr_user.save()
-        logger.info('"highprice" command is called')
-    else:
-        curr_user.order = 'DISTANCE_FROM_LANDMARK'
-        curr_user.save()
-        logger.info('"bestdeal" command is called')
-    logger.info(curr_user.order)
-    state = curr_user.state
-    logger.info(f"Current state: {state}")
-    bot.send_message(chat_id, make_message(message, 'question_'))
+    session = get_session(message.from_user.id)
+    run_step(message, message.chat.id, start_search(message, session), session)
 
 
 @bot.message_handler(commands=['help', 'start'])
@@ -106,30 +113,49 @@ def get_command_help(message: Message) -> None:
     """
     if not is_user_in_db(message):
         add_user(message)
-    if 'start' in message.text:
-        logger.info(f'"start" command is called')
-        bot.send_message(message.chat.id, _('hello', message))
-    else:
-        logger.info(f'"help" command is called')
-        bot.send_message(message.chat.id, _('help', message))
+    run_step(message, message.chat.id, help_message(message))
 
 
 @bot.message_handler(commands=['history'])
 def get_history(message: Message) -> None:
     """
-    "/history" command handler, displays information about the last 3 requests from user
+    "/history" command handler, displays the latest search of the user with buttons to see older searches
     :param message: Message
     :return: None
     """
     if not is_user_in_db(message):
         add_user(message)
     logger.info(f'"history" command is called')
+    send_history_page(message, message.chat.id, 0)
 
-    curr_history = SearchHistory.select().where(SearchHistory.user_id == message.from_user.id).get()
-    if curr_history.history == ';':
-        bot.send_message(message.chat.id, _('no_history', message))
-    else:
-        bot.send_message(message.chat.id, curr_history.history.replace(';', ''), disable_web_page_preview=True)
+
+def send_history_page(msg: [Message, CallbackQuery], chat_id: int, offset: int) -> None:
+    """
+    displays a search from the user's history
+    :param msg: Message or CallbackQuery
+    :param chat_id: chat id
+    :param offset: number of newer searches, 0 - the latest search
+    :return: None
+    """
+    run_step(msg, chat_id, history_replies(msg, history_page(msg, offset)))
+
+
+def repeat_search(msg: CallbackQuery, chat_id: int, search_id: int) -> None:
+    """
+    displays the hotels of a search from the user's history again
+    :param msg: CallbackQuery
+    :param chat_id: chat id
+    :param search_id: search id
+    :return: None
+    """
+    search = replay_search(msg, search_id)
+    if search is None:
+        outbox.send_message(chat_id, _('search_not_found', msg))
+        return
+    parameters, hotels = search
+    logger.info(f'Search {search_id} repeated from history')
+    send_hotels(msg, parameters, hotels, (hotel_info for hotel_info, history_message
+                                          in generate_hotels_descriptions(hotels, msg, parameters['currency'])))
 
 
 @bot.callback_query_handler(func=DetailedTelegramCalendar.func())
@@ -139,39 +165,12 @@ def cal(c: CallbackQuery) -> None:
     :param c: CallbackQuery
     :return: None
     """
-    curr_user = User.select().where(User.id == c.from_user.id).get()
-    for k, v in locales.items():
-        if curr_user.locale == v:
-            locale = k
-            break
-        else:
-            locale = 'en'
-    state = curr_user.state
-    result, key, step = DetailedTelegramCalendar(locale=locale, min_date=date.today()).process(c.data)
-    if not result and key:
-        bot.edit_message_text(_('choose', c),
-                              c.message.chat.id,
-                              c.message.message_id,
-                              reply_markup=key)
-    elif result:
-        bot.edit_message_text(_('chosen', c) + f" {result}",
-                              c.message.chat.id,
-                              c.message.message_id)
-        if state == 5:
-            curr_user.check_in = result
-            curr_user.state = 6
-            curr_user.save()
-            check_out_date(c)
-
-        elif state == 6:
-            curr_user.check_out = result
-            curr_user.state = 0
-            curr_user.save()
-
-            yes_no = telebot.types.InlineKeyboardMarkup()
-            yes_no.add(telebot.types.InlineKeyboardButton(text=_("yes", c), callback_data='yes'))
-            yes_no.add(telebot.types.InlineKeyboardButton(text=_("no", c), callback_data='no'))
-            bot.send_message(c.message.chat.id, _('need_photo', c), reply_markup=yes_no)
+    session = get_session(c.from_user.id)
+    edit, step = calendar_step(c, session)
+    if edit is not None:
+        text, options = edit
+        outbox.edit_message_text(text, chat_id=c.message.chat.id, message_id=c.message.message_id, **options)
+    run_step(c, c.message.chat.id, step, session)
 
 
 @bot.callback_query_handler(func=lambda call: True)
@@ -181,121 +180,24 @@ def keyboard_handler(call: CallbackQuery) -> None:
     :param call: CallbackQuery
     :return: None
     """
-    logger.info(f'Function {keyboard_handler.__name__} called with argument: {call}')
+    logger.info('Function {} called by user {} with data {}', keyboard_handler.__name__, call.from_user.id, call.data)
     chat_id = call.message.chat.id
-    bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id)
-    curr_user = User.select().where(User.id == call.from_user.id).get()
-
-    if call.data.startswith('code'):
-        if curr_user.state != 1:
-            bot.send_message(call.message.chat.id, _('enter_command', call))
-            curr_user.state = 0
-            curr_user.save()
-        else:
-            loc_name, loc_id = exact_location(call.message.json, call.data)
-            curr_user.dest_id = loc_id
-            curr_user.destination_name = loc_name
-            curr_user.save()
-            logger.info(f"{loc_name} selected")
-            bot.send_message(
-                chat_id,
-                f"{_('loc_selected', call)}: {loc_name}",
-            )
-            if curr_user.order == 'DISTANCE_FROM_LANDMARK':
-                curr_user.state = 2
-                curr_user.save()
-            else:
-                curr_user.state += 3
-                curr_user.save()
-            bot.send_message(chat_id, make_message(call, 'question_'))
-
-    elif call.data.startswith('set'):
-        curr_user.state = 0
-        curr_user.save()
-        menu = telebot.types.InlineKeyboardMarkup()
-        if call.data == 'set_locale':
-            logger.info(f'language change menu')
-            menu.add(telebot.types.InlineKeyboardButton(text='Русский', callback_data='loc_ru_RU'))
-            menu.add(telebot.types.InlineKeyboardButton(text='English', callback_data='loc_en_US'))
-        elif call.data == 'set_currency':
-            logger.info(f'currency change menu')
-            menu.add(telebot.types.InlineKeyboardButton(text='RUB', callback_data='cur_RUB'))
-            menu.add(telebot.types.InlineKeyboardButton(text='USD', callback_data='cur_USD'))
-            menu.add(telebot.types.InlineKeyboardButton(text='EUR', callback_data='cur_EUR'))
-        menu.add(telebot.types.InlineKeyboardButton(text=_('cancel', call), callback_data='cancel'))
-        bot.send_message(chat_id, _('ask_to_select', call), reply_markup=menu)
-    elif call.data == 'yes':
-        curr_user.state = 7
-        curr_user.save()
-        bot.send_message(call.message.chat.id, _('photo_amt', call))
-    elif call.data == 'no':
-        curr_user.photo_amt = 0
-        curr_user.save()
-        hotels_list(call)
-
-    elif call.data.startswith('loc'):
-        curr_user.locale = call.data[4:]
-        curr_user.language = call.data[4:6]
-        curr_user.save()
-        bot.send_message(chat_id, f"{_('current_language', call)}: {_('language', call)}")
-        logger.info(f"Language changed to {curr_user.language}")
-        logger.info(f"Locale changed to {curr_user.locale}")
-
-    elif call.data.startswith('cur'):
-        curr_user.currency = call.data[4:]
-        curr_user.save()
-        bot.send_message(chat_id, f"{_('current_currency', call)}: {call.data[4:]}")
-        logger.info(f"Currency changed to {curr_user.currency}")
-
-    elif call.data == 'cancel':
-        logger.info(f'Canceled by user')
-        curr_user.state = 0
-        curr_user.save()
-        bot.send_message(chat_id, _('canceled', call))
-
-
-def get_search_parameters(msg: Message) -> None:
+    outbox.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id)
+    session = get_session(call.from_user.id)
+    curr_user = get_user(call.from_user.id)
+    run_step(call, chat_id, button_step(call, session, curr_user), session, curr_user)
+
+
+def get_search_parameters(msg: Message, session: Session) -> None:
     """
     fixes search parameters
     :param msg: Message
+    :param session: conversation state of the user
     :return: None
     """
-    logger.info(f'Function {get_search_parameters.__name__} called with argument: {msg}')
-    chat_id = msg.chat.id
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    state = curr_user.state
-    if not is_input_correct(msg):
-        bot.send_message(chat_id, make_message(msg, 'mistake_'))
-    else:
-        if state == 2:
-            min_price, max_price = sorted(msg.text.strip().split(), key=int)
-            curr_user.min_price = min_price
-            curr_user.save()
-            logger.info(f"{steps[str(state) + 'min']} set to {min_price}")
-            curr_user.max_price = max_price
-            curr_user.save()
-            logger.info(f"{steps[str(state) + 'max']} set to {max_price}")
-            curr_user.state = 3
-            curr_user.save()
-            bot.send_message(chat_id, make_message(msg, 'question_'))
-        elif state == 4:
-            curr_user.quantity = msg.text.strip()
-            curr_user.state = 5
-            curr_user.save()
-            logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
-            check_in_date(msg)
-        elif state == 7:
-            curr_user.photo_amt = msg.text.strip()
-            curr_user.state = 0
-            curr_user.save()
-            logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
-            hotels_list(msg)
-        else:
-            curr_user.distance = msg.text.strip()
-            curr_user.state = 4
-            curr_user.save()
-            logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
-            bot.send_message(chat_id, make_message(msg, 'question_'))
+    logger.info('Function {} called by user {} with text {}', get_search_parameters.__name__, msg.from_user.id,
+                msg.text)
+    run_step(msg, msg.chat.id, parameter_step(msg, session), session)
 
 
 def hotels_list(msg: Message, lang: str = None) -> None:
@@ -305,30 +207,49 @@ def hotels_list(msg: Message, lang: str = None) -> None:
     :param lang: str
     :return: None
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
     chat_id = msg.from_user.id
-    wait_msg = bot.send_message(chat_id, _('wait', msg))
-    params = extract_search_parameters(msg)
-    hotels = get_hotels(msg, params)
-    logger.info(f'Function {get_hotels.__name__} returned: {hotels}')
-    bot.delete_message(chat_id, wait_msg.id)
-    if not hotels or len(hotels) < 1:
-        bot.send_message(chat_id, _('hotels_not_found', msg))
-    elif 'bad_request' in hotels:
-        bot.send_message(chat_id, _('bad_request', msg))
-    else:
-        quantity = len(hotels)
-        bot.send_message(chat_id, get_parameters_information(msg), lang)
-        bot.send_message(chat_id, f"{_('hotels_found', msg)}: {quantity}")
-        for hotel in hotels:
-            if hotel.get('photos'):
-                media = []
-                for i_photo in hotel['photos']:
-                    media.append(InputMediaPhoto(media=i_photo))
-                bot.send_media_group(chat_id, media)
-            bot.send_message(chat_id, hotel['message'], lang)
-    curr_user.photo_amt = 0
-    curr_user.save()
+    wait_msg = outbox.queue(chat_id, bot.send_message, chat_id, _('wait', msg))
+    started = time.perf_counter()
+    with searches_in_flight.track():
+        params = extract_search_parameters(msg)
+        hotels = get_hotels(msg, params)
+        logger.debug('Function {} returned: {}', get_hotels.__name__, payload(hotels))
+        outbox.delete_queued(chat_id, wait_msg)
+        failure = search_failure(msg, hotels)
+        if failure is not None:
+            run_step(msg, chat_id, failure)
+        else:
+            send_hotels(msg, params, hotels, stream_hotels(msg, params, hotels), started, lang)
+    update_session(msg.from_user.id, photo_amt=0)
+
+
+def send_hotels(msg: [Message, CallbackQuery], parameters: dict, hotels: list[dict], cards: Iterable[dict],
+                started: float = None, lang: str = None) -> None:
+    """
+    displays search parameters and hotel cards in chat, the cards are sent in the background with lower priority
+    than replies to user actions
+    :param msg: Message or CallbackQuery
+    :param parameters: search parameters
+    :param hotels: structured hotels data
+    :param cards: hotel descriptions
+    :param started: time when the search started, to measure the time to the first and the last card
+    :param lang: str
+    :return: None
+    """
+    chat_id = msg.from_user.id
+    if started is None:
+        started = time.perf_counter()
+    for text, options in results_header(msg, parameters, hotels):
+        outbox.send_message(chat_id, text, lang, **options)
+    sent = None
+    for number, hotel in enumerate(cards):
+        if hotel.get('photos'):
+            bulk_outbox.submit(chat_id, send_photos, bot, chat_id, hotel['photos'])
+        sent = bulk_outbox.send_message(chat_id, hotel['message'], lang)
+        if number == 0:
+            sent.add_done_callback(lambda done: card_seconds.observe(time.perf_counter() - started, card='first'))
+    if sent is not None:
+        sent.add_done_callback(lambda done: card_seconds.observe(time.perf_counter() - started, card='last'))
 
 
 @bot.message_handler(content_types=['text'])
@@ -340,14 +261,8 @@ def get_text_messages(message: Message) -> None:
     """
     if not is_user_in_db(message):
         add_user(message)
-    curr_user = User.select().where(User.id == message.from_user.id).get()
-    state = str(curr_user.state)
-    if state == '1':
-        get_locations(message)
-    elif state in ['2', '3', '4', '5', '7']:
-        get_search_parameters(message)
-    else:
-        bot.send_message(message.chat.id, _('misunderstanding', message))
+    session = get_session(message.from_user.id)
+    run_step(message, message.chat.id, text_step(message, session), session)
 
 
 
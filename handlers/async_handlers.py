@@ -0,0 +1,350 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+import telebot
+from telegram_bot_calendar import DetailedTelegramCalendar
+from telebot.types import Message, CallbackQuery
+from loguru import logger
+
+from loader import async_bot
+from config_data.config import DEFAULT_COMMANDS, UPDATE_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+from botrequests.async_requests import async_get_hotels, async_stream_hotels, async_make_locations_list
+from botrequests.hotels import generate_hotels_descriptions, history_page, replay_search
+from botrequests.prefetch import prefetch_search
+from database.bot_database import User
+from database.user_cache import get_user, save_user
+from database.session_store import Session, get_session, save_session, update_session
+from utils.async_http_client import close_session
+from utils.log_config import logger_config, payload
+from utils.metrics import card_seconds, searches_in_flight
+from utils.telegram_photos import async_send_photos
+from utils.handling import internationalize as _, is_user_in_db, add_user, extract_search_parameters
+from handlers.steps import Step, settings_menu, start_search, help_message, history_replies, text_step, \
+    input_mistake, locations_menu, parameter_step, calendar_step, button_step, search_failure, results_header
+
+logger.configure(**logger_config)
+
+
+async def load_user(msg: [Message, CallbackQuery]) -> User:
+    """
+    reads user profile in a worker thread (adds the user to database if needed), so that the following calls of
+    internationalize() take the profile from cache without blocking the event loop
+    :param msg: Message or CallbackQuery
+    :return: User
+    """
+    def load() -> User:
+        if not is_user_in_db(msg):
+            add_user(msg)
+        return get_user(msg.from_user.id)
+
+    return await asyncio.to_thread(load)
+
+
+async def store_user(curr_user: User) -> None:
+    """
+    saves user profile in a worker thread
+    :param curr_user: User
+    :return: None
+    """
+    await asyncio.to_thread(save_user, curr_user)
+
+
+async def load_session(msg: [Message, CallbackQuery]) -> Session:
+    """
+    reads user profile and conversation state in a worker thread (adds the user to database if needed)
+    :param msg: Message or CallbackQuery
+    :return: Session
+    """
+    await load_user(msg)
+    return await asyncio.to_thread(get_session, msg.from_user.id)
+
+
+async def store_session(session: Session) -> None:
+    """
+    saves conversation state in a worker thread
+    :param session: Session
+    :return: None
+    """
+    await asyncio.to_thread(save_session, session)
+
+
+async def run_step(msg: [Message, CallbackQuery], chat_id: int, step: Step, session: Session = None,
+                   curr_user: User = None) -> None:
+    """
+    saves what the step changed, sends its replies and does its action
+    :param msg: Message or CallbackQuery
+    :param chat_id: chat id
+    :param step: Step made by a function of handlers.steps
+    :param session: conversation state of the user
+    :param curr_user: user
+    :return: None
+    """
+    if step.save_session:
+        await store_session(session)
+    if step.save_user:
+        await store_user(curr_user)
+    for text, options in step.replies:
+        await async_bot.send_message(chat_id, text, **options)
+    if step.action == 'locations':
+        await get_locations(msg, session)
+    elif step.action == 'parameters':
+        await get_search_parameters(msg, session)
+    elif step.action == 'prefetch':
+        await asyncio.to_thread(prefetch_search, msg)
+    elif step.action == 'search':
+        await hotels_list(msg)
+    elif step.action == 'history':
+        await send_history_page(msg, chat_id, step.argument)
+    elif step.action == 'repeat':
+        await repeat_search(msg, chat_id, step.argument)
+
+
+async def get_locations(msg: Message, session: Session) -> None:
+    """
+    takes location name, searches locations with similar name and sends result to chat
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: None
+    """
+    mistake = input_mistake(msg, session)
+    if mistake is not None:
+        await run_step(msg, msg.chat.id, mistake)
+        return
+    wait_msg = await async_bot.send_message(msg.chat.id, _('wait', msg))
+    locations = await async_make_locations_list(msg)
+    await async_bot.delete_message(msg.chat.id, wait_msg.id)
+    await run_step(msg, msg.chat.id, locations_menu(msg, locations))
+
+
+@async_bot.message_handler(commands=['settings'])
+async def get_command_settings(message: Message) -> None:
+    """
+    "/settings" command handler, opens settings menu
+    :param message: Message
+    :return: None
+    """
+    await load_user(message)
+    logger.info('Function {} called by user {}', get_command_settings.__name__, message.from_user.id)
+    await run_step(message, message.chat.id, settings_menu(message))
+
+
+@async_bot.message_handler(commands=['lowprice', 'highprice', 'bestdeal'])
+async def get_searching_commands(message: Message) -> None:
+    """
+    "/lowprice", "/highprice", "/bestdeal"  commands handler, sets the sort order and starts asking for parameters
+    from the user
+
+    :param message: Message
+    :return: None
+    """
+    logger.info("\n" + "=" * 100 + "\n")
+    session = await load_session(message)
+    await run_step(message, message.chat.id, start_search(message, session), session)
+
+
+@async_bot.message_handler(commands=['help', 'start'])
+async def get_command_help(message: Message) -> None:
+    """
+    "/help" command handler, displays information about bot commands in the chat
+    :param message: Message
+    :return: None
+    """
+    await load_user(message)
+    await run_step(message, message.chat.id, help_message(message))
+
+
+@async_bot.message_handler(commands=['history'])
+async def get_history(message: Message) -> None:
+    """
+    "/history" command handler, displays the latest search of the user with buttons to see older searches
+    :param message: Message
+    :return: None
+    """
+    await load_user(message)
+    logger.info(f'"history" command is called')
+    await send_history_page(message, message.chat.id, 0)
+
+
+async def send_history_page(msg: [Message, CallbackQuery], chat_id: int, offset: int) -> None:
+    """
+    displays a search from the user's history
+    :param msg: Message or CallbackQuery
+    :param chat_id: chat id
+    :param offset: number of newer searches, 0 - the latest search
+    :return: None
+    """
+    page = await asyncio.to_thread(history_page, msg, offset)
+    await run_step(msg, chat_id, history_replies(msg, page))
+
+
+async def repeat_search(msg: CallbackQuery, chat_id: int, search_id: int) -> None:
+    """
+    displays the hotels of a search from the user's history again
+    :param msg: CallbackQuery
+    :param chat_id: chat id
+    :param search_id: search id
+    :return: None
+    """
+    search = await asyncio.to_thread(replay_search, msg, search_id)
+    if search is None:
+        await async_bot.send_message(chat_id, _('search_not_found', msg))
+        return
+    parameters, hotels = search
+    logger.info(f'Search {search_id} repeated from history')
+    await send_hotels(msg, parameters, hotels, history_cards(msg, parameters, hotels))
+
+
+@async_bot.callback_query_handler(func=DetailedTelegramCalendar.func())
+async def cal(c: CallbackQuery) -> None:
+    """
+    calendar buttons handler
+    :param c: CallbackQuery
+    :return: None
+    """
+    session = await load_session(c)
+    edit, step = calendar_step(c, session)
+    if edit is not None:
+        text, options = edit
+        await async_bot.edit_message_text(text, c.message.chat.id, c.message.message_id, **options)
+    await run_step(c, c.message.chat.id, step, session)
+
+
+@async_bot.callback_query_handler(func=lambda call: True)
+async def keyboard_handler(call: CallbackQuery) -> None:
+    """
+    buttons handlers
+    :param call: CallbackQuery
+    :return: None
+    """
+    logger.info('Function {} called by user {} with data {}', keyboard_handler.__name__, call.from_user.id, call.data)
+    chat_id = call.message.chat.id
+    await async_bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id)
+    curr_user = await load_user(call)
+    session = await asyncio.to_thread(get_session, call.from_user.id)
+    await run_step(call, chat_id, button_step(call, session, curr_user), session, curr_user)
+
+
+async def get_search_parameters(msg: Message, session: Session) -> None:
+    """
+    fixes search parameters
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: None
+    """
+    logger.info('Function {} called by user {} with text {}', get_search_parameters.__name__, msg.from_user.id,
+                msg.text)
+    await run_step(msg, msg.chat.id, parameter_step(msg, session), session)
+
+
+async def hotels_list(msg: [Message, CallbackQuery]) -> None:
+    """
+    displays hotel search results in chat
+    :param msg: Message or CallbackQuery
+    :return: None
+    """
+    await load_user(msg)
+    chat_id = msg.from_user.id
+    wait_msg = await async_bot.send_message(chat_id, _('wait', msg))
+    started = time.perf_counter()
+    with searches_in_flight.track():
+        params = await asyncio.to_thread(extract_search_parameters, msg)
+        hotels = await async_get_hotels(msg, params)
+        logger.debug('Function {} returned: {}', async_get_hotels.__name__, payload(hotels))
+        await async_bot.delete_message(chat_id, wait_msg.id)
+        failure = search_failure(msg, hotels)
+        if failure is not None:
+            await run_step(msg, chat_id, failure)
+        else:
+            await send_hotels(msg, params, hotels, async_stream_hotels(msg, params, hotels), started)
+    await asyncio.to_thread(update_session, msg.from_user.id, photo_amt=0)
+
+
+async def send_hotels(msg: [Message, CallbackQuery], parameters: dict, hotels: list[dict],
+                      cards: AsyncIterator[dict], started: float = None) -> None:
+    """
+    displays search parameters and hotel cards in chat
+    :param msg: Message or CallbackQuery
+    :param parameters: search parameters
+    :param hotels: structured hotels data
+    :param cards: hotel descriptions
+    :param started: time when the search started, to measure the time to the first and the last card
+    :return: None
+    """
+    chat_id = msg.from_user.id
+    if started is None:
+        started = time.perf_counter()
+    for text, options in results_header(msg, parameters, hotels):
+        await async_bot.send_message(chat_id, text, **options)
+    number = 0
+    async for hotel in cards:
+        if hotel.get('photos'):
+            await async_send_photos(async_bot, chat_id, hotel['photos'])
+        await async_bot.send_message(chat_id, hotel['message'])
+        if number == 0:
+            card_seconds.observe(time.perf_counter() - started, card='first')
+        number += 1
+    if number:
+        card_seconds.observe(time.perf_counter() - started, card='last')
+
+
+async def history_cards(msg: CallbackQuery, parameters: dict, hotels: list[dict]) -> AsyncIterator[dict]:
+    """
+    yields descriptions of hotels saved in the user's history
+    :param msg: CallbackQuery
+    :param parameters: parameters of the saved search
+    :param hotels: structured hotels data
+    :return: async iterator of hotel descriptions
+    """
+    for hotel_info, history_message in generate_hotels_descriptions(hotels, msg, parameters['currency']):
+        yield hotel_info
+
+
+@async_bot.message_handler(content_types=['text'])
+async def get_text_messages(message: Message) -> None:
+    """
+    text messages handler
+    :param message: Message
+    :return: None
+    """
+    session = await load_session(message)
+    await run_step(message, message.chat.id, text_step(message, session), session)
+
+
+async def run() -> None:
+    """
+    starts the bot in asyncio mode
+    :return: None
+    """
+    await async_bot.set_my_commands(
+        [telebot.types.BotCommand(*i) for i in DEFAULT_COMMANDS]
+    )
+    try:
+        if UPDATE_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await async_bot.polling(non_stop=True, interval=0)
+    finally:
+        await close_session()
+
+
+async def run_webhook() -> None:
+    """
+    registers the webhook in Telegram (if WEBHOOK_URL is set) and starts the webhook server in a separate thread,
+    received updates are processed in the event loop
+    :return: None
+    """
+    from utils.webhook import WebhookServer
+
+    loop = asyncio.get_running_loop()
+    # the server checks the settings before the webhook is registered
+    server = WebhookServer(
+        lambda updates: asyncio.run_coroutine_threadsafe(async_bot.process_new_updates(updates), loop).result()
+    )
+    if WEBHOOK_URL:
+        await async_bot.remove_webhook()
+        await async_bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    try:
+        await asyncio.to_thread(server.serve_forever)
+    finally:
+        server.shutdown()
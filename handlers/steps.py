@@ -0,0 +1,341 @@
+from datetime import date, timedelta
+from typing import Any, Optional
+
+import telebot
+from telebot.types import Message, CallbackQuery
+from telebot.util import smart_split
+from telegram_bot_calendar import DetailedTelegramCalendar
+from loguru import logger
+
+from botrequests.locations import exact_location
+from database.bot_database import User
+from database.session_store import Session
+from translations.translations import vocabulary
+from utils.handling import internationalize as _, is_input_correct, make_message, steps, calendar_locale, \
+    get_parameters_information
+from utils.prefetcher import prefetcher
+
+# text of a message and keyword arguments of send_message
+Reply = tuple[str, dict]
+
+
+class Step:
+    """
+    class Step. Result of a conversation step made by the functions below, which are the same for the threaded and
+    the asyncio handlers. The handlers save the changed session and user, send the replies in order and then do the
+    action
+     Attributes:
+        :replies(list): replies to send
+        :save_session(bool): True if the session was changed
+        :save_user(bool): True if the user's settings were changed
+        :action(str): what to do after the replies: 'locations' - find locations by the message text, 'parameters' -
+         take a search parameter from the message text, 'prefetch' - prefetch the search, 'search' - find and send
+         hotels, 'history' - send a search from the history, 'repeat' - repeat a search from the history, None -
+         nothing
+        :argument(int): history offset or search id of the action
+    """
+    def __init__(self, replies: Optional[list[Reply]] = None, save_session: bool = False, save_user: bool = False,
+                 action: Optional[str] = None, argument: Optional[int] = None) -> None:
+        self.replies = replies or []
+        self.save_session = save_session
+        self.save_user = save_user
+        self.action = action
+        self.argument = argument
+
+
+def reply(text: str, **options: Any) -> Reply:
+    """
+    makes reply
+    :param text: message text
+    :param options: keyword arguments of send_message, for example reply_markup
+    :return: Reply
+    """
+    return text, options
+
+
+def settings_menu(msg: Message) -> Step:
+    """
+    opens settings menu
+    :param msg: Message
+    :return: Step
+    """
+    menu = telebot.types.InlineKeyboardMarkup()
+    menu.add(telebot.types.InlineKeyboardButton(text=_("language_", msg), callback_data='set_locale'))
+    menu.add(telebot.types.InlineKeyboardButton(text=_("currency_", msg), callback_data='set_currency'))
+    menu.add(telebot.types.InlineKeyboardButton(text=_("cancel", msg), callback_data='cancel'))
+    return Step([reply(_("settings", msg), reply_markup=menu)])
+
+
+def start_search(msg: Message, session: Session) -> Step:
+    """
+    sets the sort order of "/lowprice", "/highprice" or "/bestdeal" command and asks the first question
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: Step
+    """
+    prefetcher.cancel(msg.from_user.id)
+    session.state = 1
+    if 'lowprice' in msg.text:
+        session.order = 'PRICE'
+        logger.info('"lowprice" command is called')
+    elif 'highprice' in msg.text:
+        session.order = 'PRICE_HIGHEST_FIRST'
+        logger.info('"highprice" command is called')
+    else:
+        session.order = 'DISTANCE_FROM_LANDMARK'
+        logger.info('"bestdeal" command is called')
+    logger.info(session.order)
+    logger.info(f"Current state: {session.state}")
+    return Step([reply(make_message(msg, 'question_', session))], save_session=True)
+
+
+def help_message(msg: Message) -> Step:
+    """
+    greets the user on "/start" or describes the bot commands on "/help"
+    :param msg: Message
+    :return: Step
+    """
+    if 'start' in msg.text:
+        logger.info(f'"start" command is called')
+        return Step([reply(_('hello', msg))])
+    logger.info(f'"help" command is called')
+    return Step([reply(_('help', msg))])
+
+
+def history_replies(msg: [Message, CallbackQuery], page: Optional[tuple]) -> Step:
+    """
+    splits a search from the user's history into messages, the last one has buttons to see other searches
+    :param msg: Message or CallbackQuery
+    :param page: text of the search and buttons as history_page returns them, None if there is no history
+    :return: Step
+    """
+    if page is None:
+        return Step([reply(_('no_history', msg))])
+    history, menu = page
+    parts = smart_split(history)
+    replies = [reply(part, disable_web_page_preview=True) for part in parts[:-1]]
+    replies.append(reply(parts[-1], disable_web_page_preview=True, reply_markup=menu))
+    return Step(replies)
+
+
+def text_step(msg: Message, session: Session) -> Step:
+    """
+    chooses what the text message is, depending on the state
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: Step
+    """
+    state = str(session.state)
+    if state == '1':
+        return Step(action='locations')
+    if state in ['2', '3', '4', '5', '7']:
+        return Step(action='parameters')
+    return Step([reply(_('misunderstanding', msg))])
+
+
+def input_mistake(msg: Message, session: Session) -> Optional[Step]:
+    """
+    checks the message text as the answer to the current question
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: Step with the description of the mistake or None if the text is correct
+    """
+    if is_input_correct(msg, session):
+        return None
+    return Step([reply(make_message(msg, 'mistake_', session))])
+
+
+def locations_menu(msg: Message, locations: dict) -> Step:
+    """
+    offers the found locations to choose from
+    :param msg: Message
+    :param locations: location name - location id, as make_locations_list returns them
+    :return: Step
+    """
+    if not locations or len(locations) < 1:
+        return Step([reply(str(msg.text) + _('locations_not_found', msg))])
+    if locations.get('bad_request'):
+        return Step([reply(_('bad_request', msg))])
+    menu = telebot.types.InlineKeyboardMarkup()
+    for loc_name, loc_id in locations.items():
+        menu.add(telebot.types.InlineKeyboardButton(
+            text=loc_name,
+            callback_data='code' + loc_id)
+        )
+    menu.add(telebot.types.InlineKeyboardButton(text=_('cancel', msg), callback_data='cancel'))
+    return Step([reply(_('loc_choose', msg), reply_markup=menu)])
+
+
+def check_in_question(msg: Message) -> list[Reply]:
+    """
+    asks the user to select check in date
+    :param msg: Message
+    :return: replies
+    """
+    calendar, step = DetailedTelegramCalendar(locale=calendar_locale(msg), min_date=date.today()).build()
+    return [reply(_('check_in_date', msg)), reply(_('choose', msg), reply_markup=calendar)]
+
+
+def check_out_question(msg: CallbackQuery) -> list[Reply]:
+    """
+    asks the user to select check out date
+    :param msg: CallbackQuery
+    :return: replies
+    """
+    calendar, step = DetailedTelegramCalendar(locale=calendar_locale(msg), min_date=date.today() + timedelta(1)).build()
+    return [reply(_('check_out_date', msg)), reply(_('choose', msg), reply_markup=calendar)]
+
+
+def parameter_step(msg: Message, session: Session) -> Step:
+    """
+    fixes search parameter
+    :param msg: Message
+    :param session: conversation state of the user
+    :return: Step
+    """
+    mistake = input_mistake(msg, session)
+    if mistake is not None:
+        return mistake
+    state = session.state
+    if state == 2:
+        min_price, max_price = sorted(msg.text.strip().split(), key=int)
+        session.min_price = min_price
+        session.max_price = max_price
+        session.state = 3
+        logger.info(f"{steps[str(state) + 'min']} set to {min_price}")
+        logger.info(f"{steps[str(state) + 'max']} set to {max_price}")
+        return Step([reply(make_message(msg, 'question_', session))], save_session=True)
+    if state == 4:
+        session.quantity = msg.text.strip()
+        session.state = 5
+        logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
+        return Step(check_in_question(msg), save_session=True)
+    if state == 7:
+        session.photo_amt = msg.text.strip()
+        session.state = 0
+        logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
+        return Step(save_session=True, action='search')
+    session.distance = msg.text.strip()
+    session.state = 4
+    logger.info(f"{steps[str(state)]} set to {msg.text.strip()}")
+    return Step([reply(make_message(msg, 'question_', session))], save_session=True)
+
+
+def calendar_step(c: CallbackQuery, session: Session) -> tuple[Optional[Reply], Step]:
+    """
+    processes calendar button
+    :param c: CallbackQuery
+    :param session: conversation state of the user
+    :return: new text and keyword arguments of edit_message_text for the calendar message (None - the message is not
+     changed) and Step
+    """
+    result, key, step = DetailedTelegramCalendar(locale=calendar_locale(c), min_date=date.today()).process(c.data)
+    if not result and key:
+        return reply(_('choose', c), reply_markup=key), Step()
+    if not result:
+        return None, Step()
+    chosen = reply(_('chosen', c) + f" {result}")
+    if session.state == 5:
+        session.check_in = result
+        session.state = 6
+        return chosen, Step(check_out_question(c), save_session=True, action='prefetch')
+    if session.state == 6:
+        session.check_out = result
+        session.state = 0
+        yes_no = telebot.types.InlineKeyboardMarkup()
+        yes_no.add(telebot.types.InlineKeyboardButton(text=_("yes", c), callback_data='yes'))
+        yes_no.add(telebot.types.InlineKeyboardButton(text=_("no", c), callback_data='no'))
+        return chosen, Step([reply(_('need_photo', c), reply_markup=yes_no)], save_session=True, action='prefetch')
+    return chosen, Step()
+
+
+def button_step(call: CallbackQuery, session: Session, curr_user: User) -> Step:
+    """
+    processes button of a menu
+    :param call: CallbackQuery
+    :param session: conversation state of the user
+    :param curr_user: user, his settings are changed by the settings menu
+    :return: Step
+    """
+    if call.data.startswith('code'):
+        if session.state != 1:
+            session.state = 0
+            return Step([reply(_('enter_command', call))], save_session=True)
+        loc_name, loc_id = exact_location(call.message.json, call.data)
+        session.dest_id = loc_id
+        session.destination_name = loc_name
+        logger.info(f"{loc_name} selected")
+        if session.order == 'DISTANCE_FROM_LANDMARK':
+            session.state = 2
+        else:
+            session.state += 3
+        return Step([reply(f"{_('loc_selected', call)}: {loc_name}"), reply(make_message(call, 'question_', session))],
+                    save_session=True)
+    if call.data.startswith('set'):
+        session.state = 0
+        menu = telebot.types.InlineKeyboardMarkup()
+        if call.data == 'set_locale':
+            logger.info(f'language change menu')
+            menu.add(telebot.types.InlineKeyboardButton(text='Русский', callback_data='loc_ru_RU'))
+            menu.add(telebot.types.InlineKeyboardButton(text='English', callback_data='loc_en_US'))
+        elif call.data == 'set_currency':
+            logger.info(f'currency change menu')
+            menu.add(telebot.types.InlineKeyboardButton(text='RUB', callback_data='cur_RUB'))
+            menu.add(telebot.types.InlineKeyboardButton(text='USD', callback_data='cur_USD'))
+            menu.add(telebot.types.InlineKeyboardButton(text='EUR', callback_data='cur_EUR'))
+        menu.add(telebot.types.InlineKeyboardButton(text=_('cancel', call), callback_data='cancel'))
+        return Step([reply(_('ask_to_select', call), reply_markup=menu)], save_session=True)
+    if call.data == 'yes':
+        session.state = 7
+        return Step([reply(_('photo_amt', call))], save_session=True, action='prefetch')
+    if call.data == 'no':
+        session.photo_amt = 0
+        return Step(save_session=True, action='search')
+    if call.data.startswith('loc'):
+        curr_user.locale = call.data[4:]
+        curr_user.language = call.data[4:6]
+        logger.info(f"Language changed to {curr_user.language}")
+        logger.info(f"Locale changed to {curr_user.locale}")
+        # the reply is in the new language, the user is not saved yet
+        language = curr_user.language
+        return Step([reply(f"{vocabulary['current_language'][language]}: {vocabulary['language'][language]}")],
+                    save_user=True)
+    if call.data.startswith('cur'):
+        curr_user.currency = call.data[4:]
+        logger.info(f"Currency changed to {curr_user.currency}")
+        return Step([reply(f"{_('current_currency', call)}: {call.data[4:]}")], save_user=True)
+    if call.data == 'cancel':
+        logger.info(f'Canceled by user')
+        session.state = 0
+        prefetcher.cancel(call.from_user.id)
+        return Step([reply(_('canceled', call))], save_session=True)
+    if call.data.startswith('hist'):
+        return Step(action='history', argument=int(call.data[5:]))
+    if call.data.startswith('repeat'):
+        return Step(action='repeat', argument=int(call.data[7:]))
+    return Step()
+
+
+def search_failure(msg: [Message, CallbackQuery], hotels: [list, dict]) -> Optional[Step]:
+    """
+    tells the user why no hotels are shown
+    :param msg: Message or CallbackQuery
+    :param hotels: found hotels or {'bad_request': ...} if the hotels api failed
+    :return: Step or None if there are hotels to show
+    """
+    if not hotels or len(hotels) < 1:
+        return Step([reply(_('hotels_not_found', msg))])
+    if 'bad_request' in hotels:
+        return Step([reply(_('bad_request', msg))])
+    return None
+
+
+def results_header(msg: [Message, CallbackQuery], parameters: dict, hotels: list) -> list[Reply]:
+    """
+    describes the search before the hotel cards
+    :param msg: Message or CallbackQuery
+    :param parameters: search parameters
+    :param hotels: found hotels
+    :return: replies
+    """
+    return [reply(get_parameters_information(msg, parameters)), reply(f"{_('hotels_found', msg)}: {len(hotels)}")]
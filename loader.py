@@ -3,3 +3,8 @@ from config_data import config
 
 bot = TeleBot(token=config.BOT_TOKEN)
 
+if config.BOT_MODE == 'asyncio':
+    from telebot.async_telebot import AsyncTeleBot
+    async_bot = AsyncTeleBot(token=config.BOT_TOKEN)
+else:
+    async_bot = None
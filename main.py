@@ -1,16 +1,72 @@
-from loader import bot
+import asyncio
+from typing import Callable
+
+from loader import bot, async_bot
 from loguru import logger
 import handlers
 from telebot.custom_filters import StateFilter
+from telebot.types import Update
 from utils.set_bot_commands import set_default_commands
+from utils.send_scheduler import scheduler
+from utils.metrics import instrument_handlers, start_metrics_server
+from utils.user_pool import serialize_users
+from botrequests.locations import locations_cache
+from config_data import config
 
 
-if __name__ == '__main__':
-    bot.add_custom_filter(StateFilter(bot))
-    set_default_commands(bot)
-    bot.polling(none_stop=True, interval=0)
+def run_webhook(process_updates: Callable[[list[Update]], None]) -> None:
+    """
+    registers the webhook in Telegram (if WEBHOOK_URL is set) and starts the webhook server
+    :param process_updates: function that handles a list of updates
+    :return: None
+    """
+    from utils.webhook import WebhookServer
 
+    # the server checks the settings before the webhook is registered
+    server = WebhookServer(process_updates)
+    if config.WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=config.WEBHOOK_URL + config.WEBHOOK_PATH, secret_token=config.WEBHOOK_SECRET)
+    server.serve_forever()
 
 
+def run_supervisor() -> None:
+    """
+    starts WORKERS worker processes and passes them the updates received with polling or by the webhook server
+    :return: None
+    """
+    from utils.supervisor import Supervisor
 
+    supervisor = Supervisor()
+    supervisor.start()
+    try:
+        if config.UPDATE_MODE == 'webhook':
+            run_webhook(supervisor.process_new_updates)
+        else:
+            supervisor.polling(bot)
+    finally:
+        supervisor.stop()
 
+
+if __name__ == '__main__':
+    locations_cache.purge_expired()
+    start_metrics_server()
+    if config.BOT_MODE == 'asyncio':
+        from handlers import async_handlers
+        instrument_handlers(async_bot)
+        serialize_users(async_bot)
+        asyncio.run(async_handlers.run())
+    else:
+        instrument_handlers(bot)
+        serialize_users(bot)
+        bot.add_custom_filter(StateFilter(bot))
+        set_default_commands(bot)
+        try:
+            if config.WORKERS > 1:
+                run_supervisor()
+            elif config.UPDATE_MODE == 'webhook':
+                run_webhook(bot.process_new_updates)
+            else:
+                bot.polling(none_stop=True, interval=0)
+        finally:
+            scheduler.drain()
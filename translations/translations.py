@@ -253,4 +253,20 @@ vocabulary = {
             'ru': 'История поиска пуста',
             'en': 'Search history is empty'
     },
+    'history_older': {
+            'ru': '◀ Ранее',
+            'en': '◀ Older'
+    },
+    'history_newer': {
+            'ru': 'Позже ▶',
+            'en': 'Newer ▶'
+    },
+    'repeat': {
+            'ru': 'Показать снова',
+            'en': 'Show again'
+    },
+    'search_not_found': {
+            'ru': 'Этого запроса уже нет в истории',
+            'en': 'This search is no longer in the history'
+    },
 }
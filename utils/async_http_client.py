@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+from typing import Any, Optional
+
+import aiohttp
+from loguru import logger
+
+from config_data.config import X_RAPIDAPI_KEY, HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_RETRIES
+from utils.http_client import API_HOST, RETRY_STATUSES, retry_delay
+from utils.metrics import record_api_request, api_hedged
+from utils.resilience import CircuitOpenError, HALF_OPEN, endpoint_health, is_failure
+from utils.single_flight import AsyncSingleFlight, request_key
+
+session: Optional[aiohttp.ClientSession] = None
+flights = dict()
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    returns shared aiohttp session with keep-alive connection pool, creates it in the running event loop
+    :return: aiohttp.ClientSession
+    """
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            headers={
+                'x-rapidapi-key': X_RAPIDAPI_KEY,
+                'x-rapidapi-host': API_HOST
+            }
+        )
+    return session
+
+
+async def close_session() -> None:
+    """
+    closes shared aiohttp session
+    :return: None
+    """
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def async_api_get(endpoint: str, params: dict, timeout: float = HTTP_TIMEOUT) -> tuple[int, Any, int]:
+    """
+    sends GET request to the hotels api. Identical requests made by several coroutines at once are sent once, all of
+    them get the same decoded body, which must not be changed
+    :param endpoint: api endpoint, for example "properties/list"
+    :param params: querystring parameters
+    :param timeout: seconds to wait for the api response
+    :return: response status, decoded json body and body size in bytes
+    """
+    flight = flights.get(endpoint) or flights.setdefault(endpoint, AsyncSingleFlight(endpoint))
+    return await flight.do(request_key(endpoint, params), send_request, endpoint, params, timeout)
+
+
+async def send_request(endpoint: str, params: dict, timeout: float) -> tuple[int, Any, int]:
+    """
+    sends GET request to the hotels api unless the circuit of the endpoint is open, the retries, the deadline and
+    hedging work as in the threaded client
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param timeout: maximum seconds to wait for the api response
+    :return: response status, decoded json body and body size in bytes
+    """
+    health = endpoint_health(endpoint)
+    if not health.breaker.allow():
+        raise CircuitOpenError(f'Hotels api({endpoint}) circuit is open')
+    deadline = time.monotonic() + timeout
+    try:
+        for attempt_number in range(HTTP_RETRIES + 1):
+            try:
+                result, error = await exchange(endpoint, params, timeout, deadline), None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                result, error = None, e
+            if error is None and result[0] not in RETRY_STATUSES:
+                break
+            delay = retry_delay(result[3] if error is None else '', attempt_number)
+            if attempt_number == HTTP_RETRIES or time.monotonic() + delay >= deadline:
+                break
+            logger.debug(f'Hotels api({endpoint}) request is retried in {delay:.1f} s')
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+    except Exception:
+        health.breaker.failure()
+        raise
+    if is_failure(result[0]):
+        health.breaker.failure()
+    else:
+        health.breaker.success()
+    return result[:3]
+
+
+async def exchange(endpoint: str, params: dict, limit: float, deadline: float) -> tuple[int, Any, int, str]:
+    """
+    sends one attempt of the request and the same request once more if there is no answer after the hedging delay,
+    the slower attempt is finished in the background
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param limit: maximum timeout of the attempt
+    :param deadline: time.monotonic() value after which the request fails
+    :return: the first response status, decoded json body, body size in bytes and Retry-After header
+    """
+    health = endpoint_health(endpoint)
+    timeout = deadline - time.monotonic()
+    delay = None
+    # the trial request of a half-open circuit waits until the deadline to find out if the api is back
+    if health.breaker.state != HALF_OPEN:
+        timeout = min(timeout, health.latency.timeout(limit))
+        delay = health.latency.hedge_delay()
+    if delay is None or delay >= timeout:
+        return await attempt(endpoint, params, timeout)
+    first = asyncio.ensure_future(attempt(endpoint, params, timeout))
+    first.add_done_callback(forget_result)
+    done, _ = await asyncio.wait((first,), timeout=delay)
+    if done:
+        return first.result()
+    api_hedged.inc(endpoint=endpoint, result='sent')
+    second = asyncio.ensure_future(attempt(endpoint, params, timeout))
+    second.add_done_callback(forget_result)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            raise asyncio.TimeoutError(f'Hotels api({endpoint}) did not answer before the deadline')
+        for task in done:
+            if task.exception() is not None:
+                error = task.exception()
+                continue
+            if task is second:
+                api_hedged.inc(endpoint=endpoint, result='won')
+            return task.result()
+    raise error
+
+
+def forget_result(task: asyncio.Task) -> None:
+    """
+    retrieves the exception of a request nobody waits for any more, so that asyncio does not report it
+    :param task: request task
+    :return: None
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+async def attempt(endpoint: str, params: dict, timeout: float) -> tuple[int, Any, int, str]:
+    """
+    sends one GET request to the hotels api through the shared session and records its latency, the timeout covers
+    the whole exchange including reading of the body
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param timeout: seconds to wait for the api response
+    :return: response status, decoded json body, body size in bytes and Retry-After header
+    """
+    client = await get_session()
+    params = {k: str(v) for k, v in params.items()}
+    start = time.perf_counter()
+    error = True
+    try:
+        async with client.get(f"https://{API_HOST}/{endpoint}", params=params,
+                              timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            body = await response.read()
+            error = response.status >= 400
+            return (response.status, json.loads(body) if body else None, len(body),
+                    response.headers.get('Retry-After', ''))
+    finally:
+        seconds = time.perf_counter() - start
+        endpoint_health(endpoint).latency.observe(seconds)
+        record_api_request(endpoint, seconds, error)
+        logger.debug(f'Hotels api({endpoint}) answered in {seconds * 1000:.0f} ms')
@@ -1,17 +1,26 @@
 import re
-from datetime import datetime, timedelta, date
-
-import requests
-from telegram_bot_calendar import DetailedTelegramCalendar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from telebot.types import Message
 from loguru import logger
-from loader import bot
-from config_data.config import X_RAPIDAPI_KEY
-
-from database.bot_database import User, SearchHistory
+from config_data.config import PHOTO_WORKERS, PHOTO_TIMEOUT, PHOTOS_CACHE_TTL, PHOTOS_CACHE_SIZE
+from utils.http_client import api_get
+from utils.log_config import payload
+from utils.metrics import timed, watch_cache
+from utils.prefetcher import prefetcher
+
+from database.bot_database import User
+from database.cache import PersistentCache
+from database.user_cache import get_user, user_cache
+from database.session_store import get_session, Session
 from translations.translations import vocabulary
 
+if TYPE_CHECKING:
+    # botrequests imports utils, the record is only needed for annotations
+    from botrequests.hotel_record import Hotel
+
 steps = {
     '1': 'destination_id',
     '2min': 'min_price',
@@ -31,18 +40,11 @@ locales = {
     "en": "en_US"
 }
 
-logger_config = {
-    "handlers": [
-        {
-            "sink": "logs/bot.log",
-            "format": "{time} | {level} | {message}",
-            "encoding": "utf-8",
-            "level": "DEBUG",
-            "rotation": "5 MB",
-            "compression": "zip"
-        },
-    ],
-}
+MAX_PHOTOS = 6
+
+photo_executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix='photos')
+photos_cache = PersistentCache('photos', ttl=PHOTOS_CACHE_TTL, maxsize=PHOTOS_CACHE_SIZE)
+watch_cache('photos', photos_cache)
 
 
 def internationalize(key: str, msg: Message) -> str:
@@ -52,7 +54,7 @@ def internationalize(key: str, msg: Message) -> str:
     :param msg: Message
     :return: text of message from vocabulary
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
+    curr_user = get_user(msg.from_user.id)
     lang = curr_user.language
     return vocabulary[key][lang]
 
@@ -60,16 +62,16 @@ def internationalize(key: str, msg: Message) -> str:
 _ = internationalize
 
 
-def is_input_correct(msg: Message) -> bool:
+def is_input_correct(msg: Message, session: Session = None) -> bool:
     """
     Checks the correctness of incoming messages as search parameters
     :param msg: Message
+    :param session: conversation state of the user, the stored one by default
     :return: True if the message text is correct
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    state = str(curr_user.state)
+    state = str((session or get_session(msg.from_user.id)).state)
     msg = msg.text.strip()
-    if state == '7' and msg.isdigit() and int(msg) <= 6:
+    if state == '7' and msg.isdigit() and int(msg) <= MAX_PHOTOS:
         return True
     elif state == '5' and msg.replace(' ', '').replace('-', '').isdigit():
         return True
@@ -83,25 +85,28 @@ def is_input_correct(msg: Message) -> bool:
         return True
 
 
-def get_parameters_information(msg: Message) -> str:
+def get_parameters_information(msg: Message, parameters: dict = None) -> str:
     """
-    generates a message with information about the current search parameters
+    generates a message with information about the search parameters
     :param msg: Message
+    :param parameters: parameters of a saved search, the current search parameters of the user by default
     :return: string like information about search parameters
     """
-    logger.info(f'Function {get_parameters_information.__name__} called with argument: {msg}')
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    parameters = {
-        'destination_id': curr_user.dest_id,
-        'quantity': curr_user.quantity,
-        'order': curr_user.order,
-        'locale': curr_user.locale,
-        'currency': curr_user.currency,
-        'priceMax': curr_user.max_price,
-        'priceMin': curr_user.min_price,
-        'destination_name': curr_user.destination_name,
-        'distance': curr_user.distance,
-    }
+    logger.info('Function {} called by user {}', get_parameters_information.__name__, msg.from_user.id)
+    if parameters is None:
+        curr_user = get_user(msg.from_user.id)
+        session = get_session(msg.from_user.id)
+        parameters = {
+            'destination_id': session.dest_id,
+            'quantity': session.quantity,
+            'order': session.order,
+            'locale': curr_user.locale,
+            'currency': curr_user.currency,
+            'priceMax': session.max_price,
+            'priceMin': session.min_price,
+            'destination_name': session.destination_name,
+            'distance': session.distance,
+        }
     sort_order = parameters['order']
     city = parameters['destination_name']
     currency = parameters['currency']
@@ -115,23 +120,23 @@ def get_parameters_information(msg: Message) -> str:
         distance = parameters['distance']
         message += f"{_('price', msg)}: {price_min} - {price_max} {currency}\n" \
                    f"{_('max_distance', msg)}: {distance} {_('dis_unit', msg)}"
-    logger.info(f'Search parameters: {message}')
+    logger.debug('Search parameters: {}', message)
     return message
 
 
-def make_message(msg: Message, prefix: str) -> str:
+def make_message(msg: Message, prefix: str, session: Session = None) -> str:
     """
     makes and returns messages with information about an invalid input or with question, depending on the prefix and
     state
     :param msg: Message
     :param prefix: prefix for key in vocabulary dictionary
+    :param session: conversation state of the user, the stored one by default
     :return: string like message
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    state = str(curr_user.state)
+    state = str((session or get_session(msg.from_user.id)).state)
     message = _(prefix + state, msg)
     if state == '2':
-        message += f" ({curr_user.currency})"
+        message += f" ({get_user(msg.from_user.id).currency})"
 
     return message
 
@@ -156,14 +161,15 @@ def hotel_price(hotel: dict) -> int:
     return price
 
 
-def hotel_address(hotel: dict, msg: Message) -> str:
+def hotel_address(hotel: dict, msg: Message, no_information: Optional[str] = None) -> str:
     """
     returns hotel address
     :param msg: Message
     :param hotel: dict - hotel information
+    :param no_information: text shown without address, taken from the vocabulary if it is not given
     :return: hotel address
     """
-    message = _('no_information', msg)
+    message = no_information or _('no_information', msg)
     if hotel.get('address'):
         message = hotel.get('address').get('streetAddress', message)
     return message
@@ -181,71 +187,99 @@ def hotel_rating(rating: float, msg: Message) -> str:
     return '⭐' * int(rating)
 
 
-def request_photos(hotel: dict, amt: int) -> list[str]:
+@timed('request_photos')
+def request_photos(hotel: 'Hotel', amt: int, timeout: float = PHOTO_TIMEOUT) -> list[str]:
     """
         returns list with links to hotel photos
-        :param hotel: dict - hotel information
+        :param hotel: Hotel - hotel information
         :param amt: int - Number of photos
+        :param timeout: float - seconds to wait for the api response
         :return: links to hotel photos
         """
     photos_list = None
-    if hotel.get('id'):
-        url = "https://hotels4.p.rapidapi.com/properties/get-hotel-photos"
+    if hotel.id:
+        photos_list = hotel_photos(hotel.id, timeout)[:amt]
+
+    return photos_list
 
-        querystring = {"id": hotel.get('id')}
 
-        headers = {
-            "X-RapidAPI-Key": X_RAPIDAPI_KEY,
-            "X-RapidAPI-Host": "hotels4.p.rapidapi.com"
-        }
+def hotel_photos(hotel_id: int, timeout: float = PHOTO_TIMEOUT) -> list[str]:
+    """
+    returns links to MAX_PHOTOS first photos of the hotel, the links are cached for PHOTOS_CACHE_TTL
+    :param hotel_id: hotel id
+    :param timeout: float - seconds to wait for the api response
+    :return: links to hotel photos
+    """
+    key = str(hotel_id)
+    prefetcher.used('photos', key)
+    photos_list = photos_cache.get(key)
+    if photos_list is not None:
+        return photos_list
+    response = api_get("properties/get-hotel-photos", {"id": hotel_id}, timeout=timeout)
+    photos_list = photo_links(response.json(), MAX_PHOTOS)
+    photos_cache.set(key, photos_list)
+    return photos_list
 
-        response = requests.request("GET", url, headers=headers, params=querystring)
-        data = response.json()
-        photos_list = []
-        all_photos = data['hotelImages'][:amt]
-        for photo in all_photos:
-            curr_link = photo['baseUrl'].replace('{size}', 'z')
-            if curr_link not in photos_list:
-                photos_list.append(curr_link)
 
+def photo_links(data: dict, amt: int) -> list[str]:
+    """
+    takes links to hotel photos from the hotel api response
+    :param data: response from hotel api
+    :param amt: int - Number of photos
+    :return: links to hotel photos
+    """
+    photos_list = []
+    all_photos = data['hotelImages'][:amt]
+    for photo in all_photos:
+        curr_link = photo['baseUrl'].replace('{size}', 'z')
+        if curr_link not in photos_list:
+            photos_list.append(curr_link)
     return photos_list
 
 
-def check_in_date(msg: Message) -> None:
+def request_photos_safe(hotel: 'Hotel', amt: int) -> list[str]:
     """
-    asks the user to select check in date
-    :param msg: Message
-    :return: None
+    returns links to hotel photos, or an empty list if the photos could not be received
+    :param hotel: Hotel - hotel information
+    :param amt: int - Number of photos
+    :return: links to hotel photos
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
-    for k, v in locales.items():
-        if curr_user.locale == v:
-            locale = k
-            break
-        else:
-            locale = 'en'
+    try:
+        return request_photos(hotel, amt) or []
+    except Exception as e:
+        logger.warning(f'Could not get photos of hotel {hotel.id}: {e}')
+        return []
 
-    calendar, step = DetailedTelegramCalendar(locale=locale, min_date=date.today()).build()
-    bot.send_message(msg.chat.id, _('check_in_date', msg))
-    bot.send_message(msg.chat.id, _('choose', msg), reply_markup=calendar)
+
+def stream_photos(hotels: list['Hotel'], amt: int) -> Iterator['Hotel']:
+    """
+    requests photos of all hotels concurrently (no more than PHOTO_WORKERS requests at once) and yields every hotel
+    with its photos in hotel.photos as soon as they are received, keeping the hotels order
+    :param hotels: list of Hotel
+    :param amt: int - Number of photos
+    :return: iterator of hotels with photos
+    """
+    futures = [photo_executor.submit(request_photos_safe, hotel, amt) for hotel in hotels]
+    try:
+        for hotel, future in zip(hotels, futures):
+            hotel.photos = future.result()
+            yield hotel
+    finally:
+        for future in futures:
+            future.cancel()
 
 
-def check_out_date(msg: Message) -> None:
+def calendar_locale(msg: Message) -> str:
     """
-    asks the user to select check out date
+    returns calendar language corresponding to the user's locale
     :param msg: Message
-    :return: None
+    :return: 'ru' or 'en'
     """
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
+    curr_user = get_user(msg.from_user.id)
     for k, v in locales.items():
         if curr_user.locale == v:
-            locale = k
-            break
-        else:
-            locale = 'en'
-    calendar, step = DetailedTelegramCalendar(locale=locale, min_date=date.today() + timedelta(1)).build()
-    bot.send_message(msg.message.chat.id, _('check_out_date', msg))
-    bot.send_message(msg.message.chat.id, _('choose', msg), reply_markup=calendar)
+            return k
+    return 'en'
 
 
 def add_user(msg: Message) -> None:
@@ -263,7 +297,7 @@ def add_user(msg: Message) -> None:
         username = msg.from_user.username
     else:
         username = msg.from_user.full_name
-    User.create(
+    curr_user = User.create(
         id=user_id,
         username=username,
         language=lang,
@@ -281,10 +315,7 @@ def add_user(msg: Message) -> None:
         distance=0,
         photo_amt=0
     )
-    SearchHistory.create(
-        user_id=user_id,
-        history=';'
-    )
+    user_cache.set(user_id, curr_user)
 
 
 def is_user_in_db(msg: Message) -> bool:
@@ -296,33 +327,37 @@ def is_user_in_db(msg: Message) -> bool:
     logger.info('is_user_in_db called')
     user_id = msg.from_user.id
     try:
-        answer = User.get(User.id == user_id)
-    except Exception:
+        answer = get_user(user_id)
+    except User.DoesNotExist:
         answer = None
     return answer
 
 
-def extract_search_parameters(msg: Message) -> dict:
+def extract_search_parameters(msg: Message, session: Session = None) -> dict:
     """
-    extracts users search parameters from database
+    extracts search parameters from the user profile and session
     :param msg: Message
+    :param session: session with the parameters, the current session of the user by default
     :return: dict with search parameters
     """
     logger.info(f"Function {extract_search_parameters.__name__} called")
-    curr_user = User.select().where(User.id == msg.from_user.id).get()
+    curr_user = get_user(msg.from_user.id)
+    if session is None:
+        session = get_session(msg.from_user.id)
     params = {
-        'destination_id': curr_user.dest_id,
-        'quantity': curr_user.quantity,
-        'order': curr_user.order,
+        'destination_id': session.dest_id,
+        'quantity': session.quantity,
+        'order': session.order,
         'locale': curr_user.locale,
         'currency': curr_user.currency,
-        'priceMax': curr_user.max_price,
-        'priceMin': curr_user.min_price,
-        'distance': curr_user.distance,
-        'check_in': curr_user.check_in,
-        'check_out': curr_user.check_out,
-        'total_nights': (datetime.strptime(curr_user.check_out, "%Y-%m-%d") - datetime.strptime(curr_user.check_in, "%Y-%m-%d")).days,
-        'photo_amt': curr_user.photo_amt
+        'priceMax': session.max_price,
+        'priceMin': session.min_price,
+        'destination_name': session.destination_name,
+        'distance': session.distance,
+        'check_in': session.check_in,
+        'check_out': session.check_out,
+        'total_nights': (datetime.strptime(session.check_out, "%Y-%m-%d") - datetime.strptime(session.check_in, "%Y-%m-%d")).days,
+        'photo_amt': session.photo_amt
     }
-    logger.info(f"parameters: {params}")
+    logger.debug('parameters: {}', payload(params))
     return params
@@ -0,0 +1,163 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed, wait
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from config_data.config import X_RAPIDAPI_KEY, HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF
+from utils.metrics import record_api_request, api_hedged
+from utils.resilience import CircuitOpenError, HALF_OPEN, endpoint_health, is_failure
+from utils.single_flight import SingleFlight, request_key
+
+API_HOST = "hotels4.p.rapidapi.com"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session() -> requests.Session:
+    """
+    makes http session with keep-alive connection pool. The session does not retry requests: send_request does it,
+    so that the latency of every attempt is recorded on its own
+    :return: requests.Session
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    new_session = requests.Session()
+    new_session.mount('https://', adapter)
+    new_session.headers.update({
+        'x-rapidapi-key': X_RAPIDAPI_KEY,
+        'x-rapidapi-host': API_HOST
+    })
+    return new_session
+
+
+session = make_session()
+flights = dict()
+# every request may have a hedged attempt running next to it
+request_executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE * 2, thread_name_prefix='hotels_api')
+
+
+def retry_delay(retry_after: str, attempt_number: int) -> float:
+    """
+    returns delay before the next retry: Retry-After header if the api sent it, otherwise exponential backoff with
+    full jitter, so that retries of many requests do not hit the api at the same moment
+    :param retry_after: Retry-After header of the failed response, empty string if there is none
+    :param attempt_number: number of the failed attempt, starting from 0
+    :return: delay in seconds
+    """
+    if retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, HTTP_BACKOFF * 2 ** attempt_number)
+
+
+def api_get(endpoint: str, params: dict, timeout: float = HTTP_TIMEOUT) -> requests.Response:
+    """
+    sends GET request to the hotels api. Identical requests (the same endpoint and parameters) made by several
+    threads at once are sent once, all of them get the same response
+    :param endpoint: api endpoint, for example "properties/list"
+    :param params: querystring parameters
+    :param timeout: seconds to wait for the api response
+    :return: requests.Response
+    """
+    flight = flights.get(endpoint) or flights.setdefault(endpoint, SingleFlight(endpoint))
+    return flight.do(request_key(endpoint, params), send_request, endpoint, params, timeout)
+
+
+def send_request(endpoint: str, params: dict, timeout: float) -> requests.Response:
+    """
+    sends GET request to the hotels api unless the circuit of the endpoint is open and retries it on 429 and 5xx
+    responses and connection errors. The request with all its retries and pauses between them takes no more than
+    timeout seconds. The timeout of every attempt follows the recent latency of the endpoint, if there is no answer
+    after the hedging delay (p95 of the recent latency), the attempt is sent once more and the first answer is taken
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param timeout: maximum seconds to wait for the api response
+    :return: requests.Response
+    """
+    health = endpoint_health(endpoint)
+    if not health.breaker.allow():
+        raise CircuitOpenError(f'Hotels api({endpoint}) circuit is open')
+    deadline = time.monotonic() + timeout
+    try:
+        for attempt_number in range(HTTP_RETRIES + 1):
+            try:
+                response, error = exchange(endpoint, params, timeout, deadline), None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            if error is None and response.status_code not in RETRY_STATUSES:
+                break
+            delay = retry_delay(response.headers.get('Retry-After', '') if error is None else '', attempt_number)
+            if attempt_number == HTTP_RETRIES or time.monotonic() + delay >= deadline:
+                break
+            logger.debug(f'Hotels api({endpoint}) request is retried in {delay:.1f} s')
+            time.sleep(delay)
+        if error is not None:
+            raise error
+    except Exception:
+        health.breaker.failure()
+        raise
+    if is_failure(response.status_code):
+        health.breaker.failure()
+    else:
+        health.breaker.success()
+    return response
+
+
+def exchange(endpoint: str, params: dict, limit: float, deadline: float) -> requests.Response:
+    """
+    sends one attempt of the request and the same request once more if there is no answer after the hedging delay.
+    The attempts are sent by the executor threads, the caller stops waiting at the deadline, the slower or late
+    attempt is finished in the background
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param limit: maximum timeout of the attempt
+    :param deadline: time.monotonic() value after which the request fails
+    :return: the first response
+    """
+    health = endpoint_health(endpoint)
+    timeout = deadline - time.monotonic()
+    delay = None
+    # the trial request of a half-open circuit waits until the deadline to find out if the api is back
+    if health.breaker.state != HALF_OPEN:
+        timeout = min(timeout, health.latency.timeout(limit))
+        delay = health.latency.hedge_delay()
+    first = request_executor.submit(attempt, endpoint, params, timeout)
+    attempts = [first]
+    if delay is not None and delay < timeout and not wait((first,), timeout=delay).done:
+        api_hedged.inc(endpoint=endpoint, result='sent')
+        attempts.append(request_executor.submit(attempt, endpoint, params, timeout))
+    error = None
+    try:
+        for future in as_completed(attempts, timeout=max(0.0, deadline - time.monotonic())):
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is not first:
+                api_hedged.inc(endpoint=endpoint, result='won')
+            return response
+    except FuturesTimeoutError:
+        raise requests.Timeout(f'Hotels api({endpoint}) did not answer before the deadline')
+    raise error
+
+
+def attempt(endpoint: str, params: dict, timeout: float) -> requests.Response:
+    """
+    sends one GET request to the hotels api through the shared session and records its latency
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :param timeout: seconds to wait for the api response
+    :return: requests.Response
+    """
+    start = time.perf_counter()
+    error = True
+    try:
+        response = session.get(f"https://{API_HOST}/{endpoint}", params=params, timeout=timeout)
+        error = not response.ok
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        endpoint_health(endpoint).latency.observe(seconds)
+        record_api_request(endpoint, seconds, error)
+        logger.debug(f'Hotels api({endpoint}) answered in {seconds * 1000:.0f} ms')
@@ -0,0 +1,84 @@
+import json
+import random
+from typing import Any
+
+from config_data.config import LOG_FILE, LOG_LEVEL, LOG_ROTATION, LOG_ENQUEUE, LOG_PAYLOADS, LOG_PAYLOAD_LIMIT, \
+    LOG_PAYLOAD_SAMPLE
+
+# with enqueue the records are written, rotated and compressed by a background thread
+logger_config = {
+    "handlers": [
+        {
+            "sink": LOG_FILE,
+            "format": "{time} | {level} | {message}",
+            "encoding": "utf-8",
+            "level": LOG_LEVEL,
+            "rotation": LOG_ROTATION,
+            "compression": "zip",
+            "enqueue": LOG_ENQUEUE,
+        },
+    ],
+}
+
+# not one-shot iterencode yields the text in small chunks, so a body can be cut without encoding all of it
+encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, default=repr)
+
+
+def format_payload(data: Any, failed: bool = False, mode: str = LOG_PAYLOADS, limit: int = LOG_PAYLOAD_LIMIT,
+                   sample: float = LOG_PAYLOAD_SAMPLE) -> str:
+    """
+    converts request or response body to text for the log. The truncated text is json, only its first limit
+    characters are encoded
+    :param data: body
+    :param failed: True if the request failed
+    :param mode: full, truncated or failed (full bodies of failed requests only, the others as type and size)
+    :param limit: maximum length of the truncated text
+    :param sample: share of bodies written in full in the truncated mode
+    :return: text
+    """
+    if mode == 'full' or (mode == 'failed' and failed):
+        return str(data)
+    if mode == 'failed':
+        size = f', {len(data)} items' if hasattr(data, '__len__') else ''
+        return f'<{type(data).__name__}{size}>'
+    if sample and random.random() < sample:
+        return str(data)
+    chunks = []
+    length = 0
+    for chunk in encoder.iterencode(data):
+        chunks.append(chunk)
+        length += len(chunk)
+        if length > limit:
+            return ''.join(chunks)[:limit] + '...'
+    return ''.join(chunks)
+
+
+class Payload:
+    """
+    class Payload. Request or response body passed to the logger as an argument: logger.debug('Response: {}',
+    payload(data)). It is converted to text only if the record is written, see format_payload
+     Attributes:
+        :data(Any): body
+        :failed(bool): True if the request failed
+    """
+    __slots__ = ('data', 'failed')
+
+    def __init__(self, data: Any, failed: bool = False) -> None:
+        self.data = data
+        self.failed = failed
+
+    def __str__(self) -> str:
+        return format_payload(self.data, self.failed)
+
+    def __format__(self, format_spec: str) -> str:
+        return format(str(self), format_spec)
+
+
+def payload(data: Any, failed: bool = False) -> Payload:
+    """
+    wraps request or response body for lazy logging
+    :param data: body
+    :param failed: True if the request failed, in the failed mode only such bodies are written in full
+    :return: Payload
+    """
+    return Payload(data, failed)
@@ -0,0 +1,521 @@
+import bisect
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from inspect import iscoroutinefunction
+from threading import Lock, Thread
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from loguru import logger
+from telebot import TeleBot
+
+from config_data.config import METRICS_HOST, METRICS_PORT
+from database.bot_database import db, update_queries
+from database.user_cache import user_cache
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HANDLER_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CALLBACK_PREFIX = re.compile(r'[a-z]+')
+
+
+def format_value(value: float) -> str:
+    """
+    formats sample value for the text exposition format
+    :param value: number
+    :return: text
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    """
+    formats labels for the text exposition format
+    :param labels: dict label - value
+    :return: text like {endpoint="properties/list"} or empty string
+    """
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """
+    class Metric. Named metric with values for every combination of label values
+     Attributes:
+        :name(str): metric name
+        :help(str): metric description
+        :labelnames(tuple): label names
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = Lock()
+
+    def key(self, labels: dict) -> tuple:
+        """
+        returns label values in the order of label names
+        :param labels: dict label - value
+        :return: tuple of label values
+        """
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        """
+        returns current values
+        :return: iterator of (name suffix, labels, value)
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', dict(zip(self.labelnames, key)), value
+
+    def render(self) -> str:
+        """
+        returns metric in the text exposition format
+        :return: text
+        """
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    class Counter. Parent - Metric
+    Value that only grows
+    """
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        increases value
+        :param amount: increment
+        :param labels: label values
+        :return: None
+        """
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    class Gauge. Parent - Metric
+    Value that goes up and down
+    """
+    type = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        """
+        sets value
+        :param value: new value
+        :param labels: label values
+        :return: None
+        """
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        increases value
+        :param amount: increment, negative to decrease
+        :param labels: label values
+        :return: None
+        """
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        """
+        increases value while the block runs, used for the number of operations in progress
+        :param labels: label values
+        :return: context manager
+        """
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(-1, **labels)
+
+
+class Histogram(Metric):
+    """
+    class Histogram. Parent - Metric
+    Distribution of observed values over buckets
+     Attributes:
+        :buckets(tuple): upper bounds of buckets
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        adds observed value
+        :param value: value, for example duration in seconds
+        :param labels: label values
+        :return: None
+        """
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """
+        observes duration of the block in seconds
+        :param labels: label values
+        :return: context manager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', dict(labels, le=format_value(bound)), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class Registry:
+    """
+    class Registry. Metrics of the bot and collectors that read values of other components at scrape time
+     Attributes:
+        :metrics(list): registered metrics
+        :collectors(list): functions returning lists of metrics made at scrape time
+    """
+    def __init__(self) -> None:
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Any:
+        """
+        adds metric to the registry
+        :param metric: Metric
+        :return: the same metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function: Callable[[], list[Metric]]) -> Callable[[], list[Metric]]:
+        """
+        adds collector, can be used as a decorator
+        :param function: function returning list of metrics
+        :return: the same function
+        """
+        self.collectors.append(function)
+        return function
+
+    def render(self) -> str:
+        """
+        returns all metrics in the text exposition format
+        :return: text
+        """
+        parts = [metric.render() for metric in self.metrics]
+        for function in self.collectors:
+            try:
+                parts.extend(metric.render() for metric in function())
+            except Exception as e:
+                logger.error(f'Metrics collector {function.__name__} failed: {e}')
+        return '\n'.join(parts) + '\n'
+
+
+registry = Registry()
+handler_seconds = registry.register(Histogram(
+    'bot_handler_seconds', 'Duration of update handlers by command or callback type', ('kind', 'handler'),
+    HANDLER_BUCKETS))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors_total', 'Update handlers that raised an exception', ('kind', 'handler')))
+handler_queries = registry.register(Histogram(
+    'bot_handler_db_queries', 'SQLite queries executed while handling one update', ('kind', 'handler'),
+    QUERY_BUCKETS))
+function_seconds = registry.register(Histogram(
+    'bot_function_seconds', 'Duration of hotels, locations and photos requests including cache lookups',
+    ('function',)))
+api_seconds = registry.register(Histogram(
+    'hotels_api_request_seconds', 'Duration of hotels api requests', ('endpoint',)))
+api_requests = registry.register(Counter(
+    'hotels_api_requests_total', 'Hotels api requests by result', ('endpoint', 'result')))
+api_coalesced = registry.register(Counter(
+    'hotels_api_coalesced_total', 'Hotels api requests that took the result of an identical request in flight',
+    ('endpoint',)))
+api_hedged = registry.register(Counter(
+    'hotels_api_hedged_total', 'Hotels api requests sent again after the hedging delay by result: sent, won (the '
+    'second request answered first)', ('endpoint', 'result')))
+breaker_state = registry.register(Gauge(
+    'hotels_api_circuit_state', 'Circuit breaker state of hotels api endpoints: 0 closed, 1 half-open, 2 open',
+    ('endpoint',)))
+breaker_rejected = registry.register(Counter(
+    'hotels_api_circuit_rejected_total', 'Hotels api requests not sent because the circuit was open',
+    ('endpoint',)))
+send_seconds = registry.register(Histogram(
+    'telegram_send_seconds', 'Duration of Telegram requests', ('method',)))
+send_wait_seconds = registry.register(Histogram(
+    'telegram_send_wait_seconds', 'Time Telegram requests waited in the send queue', ('priority',)))
+card_seconds = registry.register(Histogram(
+    'bot_hotel_card_seconds', 'Time from the start of a search to the first and the last hotel card', ('card',),
+    HANDLER_BUCKETS))
+searches_in_flight = registry.register(Gauge(
+    'bot_searches_in_flight', 'Hotel searches in progress'))
+photo_sends = registry.register(Counter(
+    'telegram_photos_total', 'Hotel photos sent to Telegram by source: cached file_id or link', ('source',)))
+photo_file_ids_rejected = registry.register(Counter(
+    'telegram_photo_file_ids_rejected_total', 'Cached photo file_ids removed after Telegram rejected them'))
+prefetch_requests = registry.register(Counter(
+    'bot_prefetch_requests_total', 'Speculative hotels and photos requests by result: sent, cached, over_budget, '
+    'failed or cancelled', ('kind', 'result')))
+prefetch_hits = registry.register(Counter(
+    'bot_prefetch_hits_total', 'Searches that used a response prefetched for them', ('kind',)))
+updates_serialized = registry.register(Counter(
+    'bot_updates_serialized_total', 'Updates that waited for the previous update of the same user'))
+worker_updates = registry.register(Counter(
+    'bot_worker_updates_total', 'Updates routed by the supervisor to worker processes', ('worker',)))
+worker_restarts = registry.register(Counter(
+    'bot_worker_restarts_total', 'Worker processes restarted by the supervisor after a crash', ('worker',)))
+
+caches = dict()
+
+
+def watch_cache(name: str, cache: Any) -> None:
+    """
+    adds cache to the cache metrics
+    :param name: cache name used as the label value
+    :param cache: object with stats() method returning size, hits and misses, for example LRUCache
+    :return: None
+    """
+    caches[name] = cache
+
+
+@registry.collector
+def cache_metrics() -> list[Metric]:
+    """
+    reads statistics of watched caches
+    :return: list of metrics
+    """
+    hits = Counter('cache_hits_total', 'Cache lookups that found an entry', ('cache',))
+    misses = Counter('cache_misses_total', 'Cache lookups that found nothing', ('cache',))
+    ratio = Gauge('cache_hit_ratio', 'Share of cache lookups that found an entry', ('cache',))
+    size = Gauge('cache_entries', 'Number of cache entries', ('cache',))
+    for name, cache in list(caches.items()):
+        stats = cache.stats()
+        hits.inc(stats['hits'], cache=name)
+        misses.inc(stats['misses'], cache=name)
+        ratio.set(stats['hit_ratio'], cache=name)
+        size.set(stats['size'], cache=name)
+    return [hits, misses, ratio, size]
+
+
+@registry.collector
+def database_metrics() -> list[Metric]:
+    """
+    reads number of executed SQLite queries
+    :return: list of metrics
+    """
+    queries = Counter('db_queries_total', 'Executed SQLite queries')
+    queries.inc(db.queries)
+    return [queries]
+
+
+def record_api_request(endpoint: str, seconds: float, error: bool) -> None:
+    """
+    saves duration and result of a hotels api request
+    :param endpoint: api endpoint
+    :param seconds: request duration
+    :param error: True if the request failed
+    :return: None
+    """
+    api_seconds.observe(seconds, endpoint=endpoint)
+    api_requests.inc(endpoint=endpoint, result='error' if error else 'ok')
+
+
+def timed(function_name: str) -> Callable:
+    """
+    decorator observing duration of the function in bot_function_seconds, works with coroutine functions as well
+    :param function_name: label value, the same for the threaded and asyncio versions of a function
+    :return: decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with function_seconds.time(function=function_name):
+                    return await function(*args, **kwargs)
+        else:
+            @wraps(function)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with function_seconds.time(function=function_name):
+                    return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def handling(kind: str, handler: str) -> Iterator[None]:
+    """
+    measures handling of one update: duration, exceptions and SQLite queries
+    :param kind: message or callback
+    :param handler: command, callback type or handler name
+    :return: context manager
+    """
+    counter = [0]
+    token = update_queries.set(counter)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        handler_errors.inc(kind=kind, handler=handler)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, kind=kind, handler=handler)
+        handler_queries.observe(counter[0], kind=kind, handler=handler)
+        update_queries.reset(token)
+
+
+def instrument_handler(function: Callable, kind: str, commands: Optional[list[str]] = None) -> Callable:
+    """
+    wraps update handler with metrics. Messages are labeled with the command or the handler name, callbacks with the
+    leading letters of their data (code, hist, repeat, cbcal...), so the number of label values stays small
+    :param function: handler
+    :param kind: message or callback
+    :param commands: commands of the handler
+    :return: wrapped handler
+    """
+    def label(update: Any) -> str:
+        if kind == 'callback':
+            match = CALLBACK_PREFIX.match(update.data or '')
+            return match.group() if match else 'other'
+        if commands and update.text:
+            command = update.text.split()[0][1:].split('@')[0]
+            if command in commands:
+                return command
+        return function.__name__
+
+    if iscoroutinefunction(function):
+        @wraps(function)
+        async def wrapper(update: Any, *args: Any, **kwargs: Any) -> Any:
+            with handling(kind, label(update)):
+                return await function(update, *args, **kwargs)
+    else:
+        @wraps(function)
+        def wrapper(update: Any, *args: Any, **kwargs: Any) -> Any:
+            with handling(kind, label(update)):
+                return function(update, *args, **kwargs)
+    return wrapper
+
+
+def instrument_handlers(telegram_bot: TeleBot) -> None:
+    """
+    wraps registered message and callback query handlers of the bot with metrics, called after the handlers are
+    registered. Works with TeleBot and AsyncTeleBot
+    :param telegram_bot: bot
+    :return: None
+    """
+    for kind, handlers in (('message', telegram_bot.message_handlers),
+                           ('callback', telegram_bot.callback_query_handlers)):
+        for handler in handlers:
+            handler['function'] = instrument_handler(handler['function'], kind,
+                                                     handler['filters'].get('commands'))
+
+
+class MetricsServer:
+    """
+    class MetricsServer. HTTP server that returns metrics in the Prometheus text format at /metrics
+     Attributes:
+        :registry(Registry): metrics
+        :httpd(ThreadingHTTPServer): http server
+    """
+    def __init__(self, metrics_registry: Registry = registry, host: str = METRICS_HOST,
+                 port: int = METRICS_PORT) -> None:
+        self.registry = metrics_registry
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+
+    def make_handler(self) -> type:
+        """
+        makes request handler class bound to this server
+        :return: BaseHTTPRequestHandler subclass
+        """
+        server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return MetricsHandler
+
+    def start(self) -> None:
+        """
+        starts the http server in a background thread
+        :return: None
+        """
+        Thread(target=self.httpd.serve_forever, name='metrics_server', daemon=True).start()
+        logger.info(f'Metrics server listens on {self.httpd.server_address}')
+
+    def shutdown(self) -> None:
+        """
+        stops the http server
+        :return: None
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics_server() -> Optional[MetricsServer]:
+    """
+    starts the metrics endpoint if METRICS_PORT is set
+    :return: MetricsServer or None
+    """
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer()
+    server.start()
+    return server
+
+
+watch_cache('users', user_cache)
@@ -0,0 +1,134 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+from loguru import logger
+
+from config_data.config import PREFETCH_WORKERS, PREFETCH_BUDGET
+from database.cache import LRUCache
+from utils.metrics import prefetch_requests, prefetch_hits
+
+
+class Prefetcher:
+    """
+    class Prefetcher. Runs speculative requests in background threads while the user is still answering questions.
+    No more than workers requests run at once and no more than budget api requests are sent per period, queued
+    requests of a user are cancelled when the user cancels the search. Prefetched keys are remembered to count how
+    many of them were used
+     Attributes:
+        :workers(int): number of threads, 0 - prefetching is off
+        :budget(int): maximum number of api requests per period
+        :period(float): budget period in seconds
+    """
+    def __init__(self, workers: int, budget: int, period: float = 3600) -> None:
+        self.workers = workers
+        self.budget = budget
+        self.period = period
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') if workers else None
+        self._sent = deque()
+        self._tasks = dict()
+        self._marks = LRUCache(maxsize=10000)
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        returns True if prefetching is on
+        :return: bool
+        """
+        return self._executor is not None
+
+    def submit(self, user_id: int, function: Callable, *args: Any) -> Optional[Future]:
+        """
+        queues a speculative request of the user
+        :param user_id: user id
+        :param function: function making the request
+        :param args: arguments of the function
+        :return: Future or None if prefetching is off
+        """
+        if not self.enabled:
+            return None
+        future = self._executor.submit(self._run, function, *args)
+        with self._lock:
+            self._tasks.setdefault(user_id, set()).add(future)
+        future.add_done_callback(lambda done: self._forget(user_id, done))
+        return future
+
+    @staticmethod
+    def _run(function: Callable, *args: Any) -> Any:
+        try:
+            return function(*args)
+        except Exception as e:
+            logger.warning(f'Prefetch {function.__name__} failed: {e}')
+
+    def _forget(self, user_id: int, future: Future) -> None:
+        with self._lock:
+            tasks = self._tasks.get(user_id)
+            if tasks is not None:
+                tasks.discard(future)
+                if not tasks:
+                    del self._tasks[user_id]
+
+    def cancel(self, user_id: int) -> int:
+        """
+        cancels queued requests of the user, running ones are finished, their responses stay in cache
+        :param user_id: user id
+        :return: number of cancelled requests
+        """
+        with self._lock:
+            tasks = list(self._tasks.pop(user_id, ()))
+        cancelled = sum(future.cancel() for future in tasks)
+        if cancelled:
+            prefetch_requests.inc(cancelled, kind='any', result='cancelled')
+            logger.info(f'{cancelled} prefetch requests of user {user_id} cancelled')
+        return cancelled
+
+    def reserve(self, kind: str) -> bool:
+        """
+        takes one api request from the budget
+        :param kind: kind of request for the metrics
+        :return: True if the request may be sent
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._sent and self._sent[0] <= now - self.period:
+                self._sent.popleft()
+            if len(self._sent) >= self.budget:
+                prefetch_requests.inc(kind=kind, result='over_budget')
+                return False
+            self._sent.append(now)
+        prefetch_requests.inc(kind=kind, result='sent')
+        return True
+
+    def mark(self, kind: str, key: Hashable) -> None:
+        """
+        remembers that the response of the key was prefetched
+        :param kind: 'hotels' or 'photos'
+        :param key: cache key of the response
+        :return: None
+        """
+        self._marks.set((kind, key), True)
+
+    def unmark(self, kind: str, key: Hashable) -> None:
+        """
+        forgets the key whose prefetch failed
+        :param kind: 'hotels' or 'photos'
+        :param key: cache key of the response
+        :return: None
+        """
+        self._marks.pop((kind, key))
+
+    def used(self, kind: str, key: Hashable) -> None:
+        """
+        counts a search that took the prefetched response of the key, every prefetched response is counted once
+        :param kind: 'hotels' or 'photos'
+        :param key: cache key of the response
+        :return: None
+        """
+        if self._marks.pop((kind, key)) is not None:
+            prefetch_hits.inc(kind=kind)
+
+
+prefetcher = Prefetcher(PREFETCH_WORKERS, PREFETCH_BUDGET)
@@ -0,0 +1,81 @@
+from typing import TYPE_CHECKING, Iterable
+
+from translations.translations import vocabulary
+
+if TYPE_CHECKING:
+    from botrequests.hotel_record import Hotel
+
+LANGUAGES = tuple(vocabulary['hotel'])
+
+
+def escape(text: str) -> str:
+    """
+    escapes braces, so that vocabulary text is not taken for template fields
+    :param text: text from vocabulary
+    :return: text for str.format template
+    """
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+class CardRenderer:
+    """
+    class CardRenderer. Hotel card and search history templates of one language, the vocabulary labels are put into
+    the templates once, so a card is rendered with one str.format call
+     Attributes:
+        :lang(str): language
+        :card(str): template of the hotel card
+        :history(str): template of the hotel description for search history
+        :no_rating(str): text shown instead of stars if the hotel rating is unknown
+    """
+    def __init__(self, lang: str) -> None:
+        label = {key: escape(vocabulary[key][lang]) for key in
+                 ('hotel', 'rating', 'price', 'total_nights', 'total_price', 'distance', 'address', 'site')}
+        self.lang = lang
+        self.card = (
+            f"{label['hotel']}: {{name}}\n"
+            f"{label['rating']}: {{rating}}\n"
+            f"{label['price']}: {{price}} {{currency}}\n"
+            f"{label['total_nights']}: {{total_nights}}\n"
+            f"{label['total_price']}: {{total_price}} {{currency}}\n"
+            f"{label['distance']}: {{distance}}\n"
+            f"{label['address']}: {{address}}\n"
+        )
+        self.history = (
+            f"{label['hotel']}: {{name}}\n"
+            f"{label['price']}: {{price}} {{currency}}\n"
+            f"{label['address']}: {{address}}\n"
+            f"{label['site']}: 'URL:' https://hotels.com/ho{{id}}\n"
+        )
+        self.no_rating = vocabulary['no_information'][lang]
+        self._card = self.card.format
+        self._history = self.history.format
+
+    def render_card(self, hotel: 'Hotel', currency: str) -> tuple[dict, str]:
+        """
+        renders hotel card and hotel description for search history
+        :param hotel: Hotel
+        :param currency: currency of hotel prices
+        :return: dict with the card text and photos (if there are any) and text for search history
+        """
+        rating = hotel.star_rating
+        message = self._card(name=hotel.name, rating='⭐' * int(rating) if rating else self.no_rating,
+                             price=hotel.price, currency=currency, total_nights=hotel.total_nights,
+                             total_price=hotel.total_price, distance=hotel.distance, address=hotel.address)
+        history_message = self._history(name=hotel.name, price=hotel.price, currency=currency, address=hotel.address,
+                                        id=hotel.id)
+        if hotel.photos:
+            return {'photos': hotel.photos, 'message': message}, history_message
+        return {'message': message}, history_message
+
+    def render(self, hotels: Iterable['Hotel'], currency: str) -> list[tuple[dict, str]]:
+        """
+        renders cards of the whole result set
+        :param hotels: list of Hotel
+        :param currency: currency of hotel prices
+        :return: list of pairs: hotel card and text for search history
+        """
+        render_card = self.render_card
+        return [render_card(hotel, currency) for hotel in hotels]
+
+
+renderers = {lang: CardRenderer(lang) for lang in LANGUAGES}
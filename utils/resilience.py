@@ -0,0 +1,187 @@
+import math
+import time
+from collections import deque
+from threading import Lock
+from typing import Optional
+
+import requests
+from loguru import logger
+
+from config_data.config import HTTP_MIN_TIMEOUT, HTTP_TIMEOUT_FACTOR, HEDGE_QUANTILE, LATENCY_WINDOW, \
+    LATENCY_MIN_SAMPLES, BREAKER_FAILURES, BREAKER_RESET
+from utils.metrics import breaker_state, breaker_rejected
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    class CircuitOpenError. Parent - requests RequestException
+    The request was not sent, because the api endpoint failed too many times in a row
+    """
+
+
+class LatencyTracker:
+    """
+    class LatencyTracker. Durations of the recent requests of an endpoint, used to choose the hedging delay and the
+    timeout. Timed out requests are counted with their timeout, so the timeout grows when the api becomes slower
+     Attributes:
+        :window(int): number of recent requests
+        :min_samples(int): number of requests needed before the quantiles are used
+        :hedge_quantile(float): quantile of durations after which a request is hedged, 0 - hedging is off
+    """
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES,
+                 hedge_quantile: float = HEDGE_QUANTILE) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self.hedge_quantile = hedge_quantile
+        self._samples = deque(maxlen=window)
+        self._lock = Lock()
+
+    def observe(self, seconds: float) -> None:
+        """
+        saves request duration
+        :param seconds: request duration
+        :return: None
+        """
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        returns quantile of the recent durations
+        :param q: quantile from 0 to 1
+        :return: seconds or None if there are too few requests
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        returns time after which a second identical request is sent
+        :return: seconds or None if the request is not hedged
+        """
+        return self.quantile(self.hedge_quantile) if self.hedge_quantile else None
+
+    def timeout(self, limit: float, factor: float = HTTP_TIMEOUT_FACTOR, minimum: float = HTTP_MIN_TIMEOUT) -> float:
+        """
+        returns timeout of the next request: p99 of the recent durations multiplied by factor
+        :param limit: maximum timeout, used while there are too few requests
+        :param factor: multiplier of p99
+        :param minimum: minimum timeout
+        :return: seconds
+        """
+        p99 = self.quantile(0.99)
+        if p99 is None:
+            return limit
+        return min(limit, max(minimum, p99 * factor))
+
+
+class CircuitBreaker:
+    """
+    class CircuitBreaker. Stops requests to an endpoint after failures in a row: the circuit opens and requests fail
+    at once for reset seconds, then one trial request is let through (half-open state), its success closes the
+    circuit, its failure opens it again
+     Attributes:
+        :name(str): endpoint, used as the metric label
+        :failures(int): failures in a row that open the circuit
+        :reset(float): seconds the circuit stays open
+        :state(str): "closed", "half_open" or "open"
+    """
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset: float = BREAKER_RESET) -> None:
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.state = CLOSED
+        self._failed = 0
+        self._opened = 0.0
+        self._trial = None
+        self._lock = Lock()
+        breaker_state.set(STATE_VALUES[CLOSED], endpoint=name)
+
+    def allow(self) -> bool:
+        """
+        checks if a request may be sent, in the half-open state only one trial request at a time is allowed
+        :return: bool
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened >= self.reset:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            # a trial request that did not finish in reset seconds (for example, a cancelled one) is not waited for
+            if self.state == HALF_OPEN and (self._trial is None or now - self._trial >= self.reset):
+                self._trial = now
+                return True
+        breaker_rejected.inc(endpoint=self.name)
+        return False
+
+    def success(self) -> None:
+        """
+        closes the circuit after a successful request
+        :return: None
+        """
+        with self._lock:
+            self._failed = 0
+            self._trial = None
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def failure(self) -> None:
+        """
+        counts a failed request, opens the circuit after too many of them or after a failed trial request
+        :return: None
+        """
+        with self._lock:
+            self._failed += 1
+            self._trial = None
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failed >= self.failures):
+                self._opened = time.monotonic()
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        if state == OPEN:
+            logger.warning(f'Hotels api({self.name}) failed {self._failed} times in a row, requests are stopped for '
+                           f'{self.reset} s')
+        else:
+            logger.info(f'Hotels api({self.name}) circuit is {state}')
+        self.state = state
+        breaker_state.set(STATE_VALUES[state], endpoint=self.name)
+
+
+def is_failure(status: int) -> bool:
+    """
+    checks if the response status means that the api is unhealthy
+    :param status: http status
+    :return: True for 429 and 5xx
+    """
+    return status == 429 or status >= 500
+
+
+class EndpointHealth:
+    """
+    class EndpointHealth. Latency and circuit breaker of an api endpoint
+     Attributes:
+        :latency(LatencyTracker): durations of the recent requests
+        :breaker(CircuitBreaker): circuit breaker
+    """
+    def __init__(self, endpoint: str) -> None:
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(endpoint)
+
+
+endpoints = dict()
+
+
+def endpoint_health(endpoint: str) -> EndpointHealth:
+    """
+    returns latency and circuit breaker of the endpoint, they are shared by the threaded and asyncio clients
+    :param endpoint: api endpoint
+    :return: EndpointHealth
+    """
+    return endpoints.get(endpoint) or endpoints.setdefault(endpoint, EndpointHealth(endpoint))
@@ -0,0 +1,415 @@
+import heapq
+import inspect
+import itertools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from threading import Condition, Thread
+from typing import Any, Callable, Optional
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+from config_data.config import SEND_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_WORKERS, SEND_RETRIES, \
+    SEND_WAIT
+from database.cache import LRUCache
+from loader import bot
+from utils.metrics import registry, send_seconds, send_wait_seconds, Counter, Gauge, Metric
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class TokenBucket:
+    """
+    class TokenBucket. Allows rate events per second on average and up to capacity events at once. Not thread-safe,
+    the scheduler uses it under its lock
+     Attributes:
+        :rate(float): tokens added per second
+        :capacity(float): maximum number of tokens
+        :tokens(float): current number of tokens
+        :updated(float): time of the last refill
+    """
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """
+        adds tokens for the time passed since the last refill
+        :param now: current monotonic time
+        :return: None
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        returns seconds until a token is available
+        :param now: current monotonic time
+        :return: 0 if a token is available now
+        """
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """
+        takes one token
+        :param now: current monotonic time
+        :return: None
+        """
+        self.refill(now)
+        self.tokens -= 1
+
+
+class SendJob:
+    """
+    class SendJob. Telegram request waiting in the scheduler queue, jobs are ordered by priority and arrival
+     Attributes:
+        :priority(int): INTERACTIVE or BULK
+        :seq(int): arrival number
+        :chat_id(int): chat id
+        :func(Callable): bot method
+        :future(Future): result of the request
+        :queued(float): monotonic time when the job was queued
+        :retries(int): number of repeats after 429 answers
+    """
+    def __init__(self, priority: int, seq: int, chat_id: int, func: Callable, args: tuple, kwargs: dict) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued = time.monotonic()
+        self.retries = 0
+
+    def __lt__(self, other: 'SendJob') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    """
+    class SendScheduler. Sends Telegram requests in worker threads within the global and per-chat rate limits.
+    Requests of one chat are sent one at a time, interactive replies go before bulk result cards, requests of the
+    same priority keep their order. When Telegram answers 429, the chat is paused for retry_after seconds and the
+    request is repeated
+     Attributes:
+        :global_bucket(TokenBucket): limit of all requests of the bot
+        :chat_buckets(LRUCache): limits of recently used chats
+        :lanes(dict): chat id - heap of waiting jobs
+        :busy(set): chats with a request in progress
+        :paused(dict): chat id - monotonic time until which the chat is paused after 429
+    """
+    def __init__(self, rate: float = SEND_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, workers: int = SEND_WORKERS,
+                 retries: int = SEND_RETRIES) -> None:
+        self.global_bucket = TokenBucket(rate, max(1.0, rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self.chat_buckets = LRUCache(maxsize=10000)
+        self.lanes = dict()
+        self.busy = set()
+        self.paused = dict()
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='telegram_send')
+        self._dispatcher = Thread(target=self.dispatch, name='send_dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, chat_id: int, func: Callable, /, *args: Any, priority: int = BULK, **kwargs: Any) -> Future:
+        """
+        puts request to the queue
+        :param chat_id: chat id
+        :param func: bot method, for example bot.send_message
+        :param args: method arguments
+        :param priority: INTERACTIVE or BULK
+        :param kwargs: method keyword arguments
+        :return: Future with the method result
+        """
+        job = SendJob(priority, next(self._seq), chat_id, func, args, kwargs)
+        with self._cond:
+            heapq.heappush(self.lanes.setdefault(chat_id, []), job)
+            self.max_queued = max(self.max_queued, self.queued())
+            self._cond.notify_all()
+        return job.future
+
+    def queued(self) -> int:
+        """
+        returns number of waiting requests, must be called under lock
+        :return: queue depth
+        """
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        """
+        returns rate limit of the chat
+        :param chat_id: chat id
+        :return: TokenBucket
+        """
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def next_job(self) -> tuple[Optional[SendJob], Optional[float]]:
+        """
+        takes the most urgent job that can be sent now, must be called under lock
+        :return: job or None and seconds to wait before the next try (None - until a new job comes)
+        """
+        now = time.monotonic()
+        best = None
+        wait = None
+        for chat_id, lane in self.lanes.items():
+            if chat_id in self.busy:
+                continue
+            delay = max(self.paused.get(chat_id, 0) - now, self.chat_bucket(chat_id).delay(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or lane[0] < self.lanes[best][0]:
+                best = chat_id
+        if best is None:
+            return None, wait
+        delay = self.global_bucket.delay(now)
+        if delay > 0:
+            return None, delay
+        self.global_bucket.take(now)
+        self.chat_bucket(best).take(now)
+        self.paused.pop(best, None)
+        lane = self.lanes[best]
+        job = heapq.heappop(lane)
+        if not lane:
+            del self.lanes[best]
+        self.busy.add(best)
+        self.total_wait += now - job.queued
+        send_wait_seconds.observe(now - job.queued, priority=PRIORITIES[job.priority])
+        return job, None
+
+    def dispatch(self) -> None:
+        """
+        passes jobs to worker threads as the rate limits allow
+        :return: None
+        """
+        while True:
+            with self._cond:
+                job, wait = self.next_job()
+                while job is None:
+                    self._cond.wait(wait)
+                    job, wait = self.next_job()
+            self._executor.submit(self.run, job)
+
+    def run(self, job: SendJob) -> None:
+        """
+        sends request, repeats it after the pause if Telegram answers 429
+        :param job: SendJob
+        :return: None
+        """
+        start = time.perf_counter()
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.retries < self.retries:
+                retry_after = (e.result_json.get('parameters') or dict()).get('retry_after', 1)
+                with self._cond:
+                    self.rate_limited += 1
+                    job.retries += 1
+                    self.paused[job.chat_id] = time.monotonic() + retry_after
+                    heapq.heappush(self.lanes.setdefault(job.chat_id, []), job)
+                    self.busy.discard(job.chat_id)
+                    queued = self.queued()
+                    self._cond.notify_all()
+                logger.warning(f'Telegram flood limit in chat {job.chat_id}, retry after {retry_after} s, '
+                               f'{queued} requests queued')
+                return
+            self.finish(job, error=e)
+        except Exception as e:
+            self.finish(job, error=e)
+        else:
+            self.finish(job, result=result)
+        finally:
+            send_seconds.observe(time.perf_counter() - start, method=getattr(job.func, '__name__', 'request'))
+
+    def finish(self, job: SendJob, result: Any = None, error: Optional[Exception] = None) -> None:
+        """
+        releases the chat and passes the result to the future
+        :param job: SendJob
+        :param result: method result
+        :param error: exception raised by the method
+        :return: None
+        """
+        with self._cond:
+            self.busy.discard(job.chat_id)
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """
+        waits until all queued requests are sent, used before shutdown
+        :param timeout: maximum seconds to wait
+        :return: True if the queue is empty
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.lanes or self.busy:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(min(left, 0.05))
+        return True
+
+    def stats(self) -> dict:
+        """
+        returns queue depth and counters
+        :return: dict metric - value
+        """
+        with self._cond:
+            waiting = [job for lane in self.lanes.values() for job in lane]
+            handled = self.sent + self.failed
+            return {
+                'queued': len(waiting),
+                'queued_interactive': sum(job.priority == INTERACTIVE for job in waiting),
+                'queued_bulk': sum(job.priority == BULK for job in waiting),
+                'max_queued': self.max_queued,
+                'in_flight': len(self.busy),
+                'paused_chats': sum(until > time.monotonic() for until in self.paused.values()),
+                'sent': self.sent,
+                'failed': self.failed,
+                'rate_limited': self.rate_limited,
+                'avg_wait_ms': round(self.total_wait / handled * 1000, 1) if handled else 0.0,
+            }
+
+
+def log_failure(future: Future, chat_id: int, func: Callable) -> None:
+    """
+    logs the error of a request nobody waits for
+    :param future: Future of the request
+    :param chat_id: chat id
+    :param func: function of the request
+    :return: None
+    """
+    name = getattr(func, '__name__', 'request')
+    future.add_done_callback(lambda done: done.exception() and logger.error(
+        f'Could not send {name} to chat {chat_id}: {done.exception()}'))
+
+
+class Outbox:
+    """
+    class Outbox. Sends requests of bot methods through the scheduler: outbox.send_message(chat_id, text) has the
+    same arguments as bot.send_message, outbox.submit(chat_id, func, ...) sends with any other function. Interactive
+    outbox waits for the result no longer than wait seconds, so that a handler does not sleep through a long flood
+    limit pause of the chat, bulk outbox returns a Future at once
+     Attributes:
+        :bot(TeleBot): bot
+        :scheduler(SendScheduler): scheduler
+        :priority(int): INTERACTIVE or BULK
+        :wait(float): seconds to wait for the result of an interactive request
+    """
+    def __init__(self, telegram_bot: TeleBot, send_scheduler: SendScheduler, priority: int,
+                 wait: float = SEND_WAIT) -> None:
+        self.bot = telegram_bot
+        self.scheduler = send_scheduler
+        self.priority = priority
+        self.wait = wait
+
+    def queue(self, chat_id: int, func: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        """
+        puts request of any function sending to the chat to the scheduler without waiting, errors are logged
+        :param chat_id: chat id
+        :param func: function
+        :param args: positional arguments of the function
+        :param kwargs: keyword arguments of the function
+        :return: Future with the result of the function
+        """
+        future = self.scheduler.submit(chat_id, func, *args, priority=self.priority, **kwargs)
+        log_failure(future, chat_id, func)
+        return future
+
+    def submit(self, chat_id: int, func: Callable, /, *args: Any, **kwargs: Any) -> Any:
+        """
+        sends request of any function sending to the chat through the scheduler
+        :param chat_id: chat id
+        :param func: function
+        :param args: positional arguments of the function
+        :param kwargs: keyword arguments of the function
+        :return: result of the function for interactive outbox (None if it is not sent in wait seconds, the request
+         stays in the queue), Future for bulk outbox
+        """
+        if self.priority != INTERACTIVE:
+            return self.queue(chat_id, func, *args, **kwargs)
+        future = self.scheduler.submit(chat_id, func, *args, priority=self.priority, **kwargs)
+        try:
+            return future.result(timeout=self.wait)
+        except FuturesTimeoutError:
+            logger.warning(f'{getattr(func, "__name__", "request")} to chat {chat_id} is not sent in {self.wait} s, '
+                           f'it stays in the queue')
+            log_failure(future, chat_id, func)
+            return None
+
+    def delete_queued(self, chat_id: int, message: Future) -> Any:
+        """
+        deletes message that was put to the queue by queue(), the deletion goes to the same chat lane, so it is sent
+        after the message
+        :param chat_id: chat id
+        :param message: Future of the sent message
+        :return: result of bot.delete_message as submit returns it
+        """
+        def delete_message() -> bool:
+            return self.bot.delete_message(chat_id, message.result().id)
+
+        return self.submit(chat_id, delete_message)
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self.bot, name)
+
+        def send(*args: Any, **kwargs: Any) -> Any:
+            # chat_id is not the first argument of every method (edit_message_text starts with the text)
+            arguments = inspect.signature(method).bind(*args, **kwargs).arguments
+            if 'chat_id' not in arguments:
+                arguments = kwargs if 'chat_id' in kwargs else {'chat_id': args[0]}
+            chat_id = arguments['chat_id']
+            return self.submit(chat_id, method, *args, **kwargs)
+
+        return send
+
+
+scheduler = SendScheduler()
+outbox = Outbox(bot, scheduler, INTERACTIVE)
+bulk_outbox = Outbox(bot, scheduler, BULK)
+
+
+@registry.collector
+def send_metrics() -> list[Metric]:
+    """
+    reads queue depth and counters of the scheduler
+    :return: list of metrics
+    """
+    stats = scheduler.stats()
+    queued = Gauge('telegram_send_queue', 'Telegram requests waiting in the send queue', ('priority',))
+    queued.set(stats['queued_interactive'], priority='interactive')
+    queued.set(stats['queued_bulk'], priority='bulk')
+    in_flight = Gauge('telegram_send_in_flight', 'Telegram requests in progress')
+    in_flight.set(stats['in_flight'])
+    paused = Gauge('telegram_paused_chats', 'Chats paused after Telegram flood limit answers')
+    paused.set(stats['paused_chats'])
+    results = Counter('telegram_sends_total', 'Telegram requests by result', ('result',))
+    for result in ('sent', 'failed', 'rate_limited'):
+        results.inc(stats[result], result=result)
+    return [queued, in_flight, paused, results]
@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable
+
+from loguru import logger
+
+from utils.metrics import api_coalesced
+
+
+def request_key(endpoint: str, params: dict) -> tuple:
+    """
+    makes canonical key of a hotels api request, the order of parameters and the types of their values do not matter
+    :param endpoint: api endpoint
+    :param params: querystring parameters
+    :return: key
+    """
+    return endpoint, tuple(sorted((str(k), str(v)) for k, v in params.items()))
+
+
+class SingleFlight:
+    """
+    class SingleFlight. Runs one call of a key at a time: threads calling with the key while the call is in progress
+    wait for it and get its result or exception. A call that starts after the previous one has finished is run again
+     Attributes:
+        :name(str): name used as the metric label
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls = dict()
+        self._lock = Lock()
+
+    def do(self, key: Hashable, function: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        calls function or waits for the call of the same key started by another thread
+        :param key: key of identical calls
+        :param function: function to call
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: result of the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            api_coalesced.inc(endpoint=self.name)
+            logger.debug('Request {} joined the same request in flight', key)
+            return call.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key)
+            call.set_exception(e)
+            raise
+        self._finish(key)
+        call.set_result(result)
+        return result
+
+    def _finish(self, key: Hashable) -> None:
+        """
+        removes the call, so that the next call of the key is run again
+        :param key: key of identical calls
+        :return: None
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """
+    class AsyncSingleFlight. asyncio version of SingleFlight, must be used in one event loop. The call runs in its own
+    task, so it is not cancelled when one of the waiting coroutines is cancelled
+     Attributes:
+        :name(str): name used as the metric label
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls = dict()
+
+    async def do(self, key: Hashable, function: Callable[..., Awaitable], *args: Any, **kwargs: Any) -> Any:
+        """
+        awaits function or the call of the same key started by another coroutine
+        :param key: key of identical calls
+        :param function: coroutine function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: result of the function
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(function(*args, **kwargs))
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        else:
+            api_coalesced.inc(endpoint=self.name)
+            logger.debug('Request {} joined the same request in flight', key)
+        return await asyncio.shield(task)
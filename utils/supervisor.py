@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+from queue import Full
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.types import Update
+
+from config_data.config import WORKERS, WORKER_QUEUE_SIZE
+from utils.metrics import worker_updates, worker_restarts
+
+# workers are spawned, not forked: a forked worker would get copies of the loguru queue, the send scheduler and the
+# sqlite connections of the supervisor in whatever state their threads left them
+context = multiprocessing.get_context('spawn')
+
+
+def update_user_id(update: Update) -> Optional[int]:
+    """
+    finds the user who sent the update
+    :param update: Update
+    :return: user id or None if the update has no sender
+    """
+    for value in vars(update).values():
+        user = getattr(value, 'from_user', None)
+        if user is not None:
+            return user.id
+    return None
+
+
+def run_worker(index: int, updates: multiprocessing.Queue) -> None:
+    """
+    handles the updates routed to the worker process until None is received
+    :param index: worker index
+    :param updates: queue of updates of the worker
+    :return: None
+    """
+    from telebot.custom_filters import StateFilter
+
+    from loader import bot
+    import handlers  # registers the handlers of the bot
+    from database.session_store import session_store
+    from utils.metrics import instrument_handlers, start_metrics_server
+    from utils.send_scheduler import scheduler
+    from utils.user_pool import serialize_users
+
+    instrument_handlers(bot)
+    serialize_users(bot)
+    bot.add_custom_filter(StateFilter(bot))
+    start_metrics_server()
+    logger.info(f'Worker {index} started, pid {os.getpid()}')
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        bot.process_new_updates([update])
+    # atexit handlers are not run in worker processes
+    if bot.threaded:
+        bot.worker_pool.close()
+    scheduler.drain()
+    session_store.close()
+    logger.info(f'Worker {index} stopped')
+    logger.complete()
+
+
+class Supervisor:
+    """
+    class Supervisor. Starts worker processes and routes every update by the id of its sender, so the conversation
+    of a user is always handled by the same worker. Crashed workers are restarted, the updates queued for a crashed
+    worker are lost
+     Attributes:
+        :workers(int): number of worker processes
+        :target(Callable): function run in a worker process with the worker index, its queue of updates and args
+        :args(tuple): more arguments of target
+        :queue_size(int): maximum number of updates waiting for a worker
+        :queues(list): queues of updates of the workers
+        :processes(list): worker processes
+    """
+    def __init__(self, workers: int = WORKERS, target: Callable = run_worker, args: tuple = (),
+                 queue_size: int = WORKER_QUEUE_SIZE) -> None:
+        self.workers = workers
+        self.target = target
+        self.args = args
+        self.queue_size = queue_size
+        self.queues = [None] * workers
+        self.processes = [None] * workers
+        self._lock = Lock()
+        self._stopping = Event()
+        self._monitor = Thread(target=self.monitor, name='supervisor', daemon=True)
+
+    def start(self) -> None:
+        """
+        starts worker processes and restarts them when they exit
+        :return: None
+        """
+        with self._lock:
+            for index in range(self.workers):
+                self.start_worker(index)
+        self._monitor.start()
+        logger.info(f'Supervisor started {self.workers} workers')
+
+    def start_worker(self, index: int) -> None:
+        """
+        starts worker process, the worker gets a new queue: a worker killed while waiting for an update keeps the
+        lock of its queue
+        :param index: worker index
+        :return: None
+        """
+        old_queue = self.queues[index]
+        if old_queue is not None:
+            old_queue.close()
+            old_queue.cancel_join_thread()
+        self.queues[index] = context.Queue(maxsize=self.queue_size)
+        process = context.Process(target=self.target, args=(index, self.queues[index], *self.args),
+                                  name=f'worker_{index}', daemon=True)
+        # worker settings are read by config_data.config in the new process
+        os.environ.update(WORKERS=str(self.workers), WORKER_INDEX=str(index))
+        try:
+            process.start()
+        finally:
+            del os.environ['WORKER_INDEX']
+        self.processes[index] = process
+
+    def route(self, update: Update) -> int:
+        """
+        chooses the worker of the update
+        :param update: Update
+        :return: worker index, updates without a sender go to the first worker
+        """
+        user_id = update_user_id(update)
+        return user_id % self.workers if user_id is not None else 0
+
+    def process_new_updates(self, updates: list[Update]) -> None:
+        """
+        passes updates to the workers, has the same arguments as bot.process_new_updates. Waits while the queue of a
+        worker is full, the queue is read again every second: a worker that died with a full queue is restarted with
+        a new one
+        :param updates: list of Update
+        :return: None
+        """
+        for update in updates:
+            index = self.route(update)
+            while True:
+                with self._lock:
+                    queue = self.queues[index]
+                try:
+                    queue.put(update, timeout=1.0)
+                except Full:
+                    if not self._stopping.is_set():
+                        continue
+                    logger.warning(f'Worker {index} is stopping with a full queue, update {update.update_id} dropped')
+                    break
+                worker_updates.inc(worker=index)
+                break
+
+    def monitor(self) -> None:
+        """
+        waits for worker processes to exit and restarts them
+        :return: None
+        """
+        while not self._stopping.is_set():
+            wait([process.sentinel for process in self.processes], timeout=1.0)
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        logger.error(f'Worker {index} exited with code {process.exitcode}, restarting')
+                        worker_restarts.inc(worker=index)
+                        self.start_worker(index)
+
+    def polling(self, telegram_bot: TeleBot, timeout: int = 20) -> None:
+        """
+        receives updates with getUpdates and passes them to the workers
+        :param telegram_bot: TeleBot
+        :param timeout: long polling timeout in seconds
+        :return: None
+        """
+        offset = None
+        while not self._stopping.is_set():
+            try:
+                updates = telegram_bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout)
+            except Exception as e:
+                logger.error(f'Could not get updates: {e}')
+                time.sleep(3)
+                continue
+            if updates:
+                offset = updates[-1].update_id + 1
+                self.process_new_updates(updates)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """
+        lets the workers handle queued updates and stops them
+        :param timeout: seconds to wait for every worker
+        :return: None
+        """
+        self._stopping.set()
+        with self._lock:
+            for index, queue in enumerate(self.queues):
+                try:
+                    queue.put(None, timeout=timeout)
+                except Full:
+                    logger.warning(f'Worker {index} did not take updates for {timeout} s')
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f'Worker {index} did not stop in {timeout} s, terminating')
+                process.terminate()
+        logger.info('Supervisor stopped')
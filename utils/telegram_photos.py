@@ -0,0 +1,120 @@
+import asyncio
+from typing import Any
+
+from loguru import logger
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMediaPhoto, Message
+
+from config_data.config import PHOTO_FILE_ID_TTL, PHOTO_FILE_ID_CACHE_SIZE
+from database.cache import PersistentCache
+from utils.metrics import photo_sends, photo_file_ids_rejected, watch_cache
+
+file_ids = PersistentCache('photo_file_id', ttl=PHOTO_FILE_ID_TTL, maxsize=PHOTO_FILE_ID_CACHE_SIZE)
+watch_cache('photo_file_id', file_ids)
+
+
+def photo_media(links: list[str], cached: dict) -> list[InputMediaPhoto]:
+    """
+    makes media group of hotel photos, photos already uploaded to Telegram are sent by file_id
+    :param links: links to hotel photos
+    :param cached: dict link - file_id of cached photos
+    :return: list of InputMediaPhoto
+    """
+    return [InputMediaPhoto(media=cached.get(link, link)) for link in links]
+
+
+def cached_file_ids(links: list[str]) -> dict:
+    """
+    looks up file_ids of the photos
+    :param links: links to hotel photos
+    :return: dict link - file_id of the photos found in cache
+    """
+    cached = dict()
+    for link in links:
+        file_id = file_ids.get(link)
+        if file_id is not None:
+            cached[link] = file_id
+    return cached
+
+
+def remember_file_ids(links: list[str], messages: list[Message], cached: dict) -> None:
+    """
+    caches file_ids that Telegram gave to photos sent by link and counts sent photos
+    :param links: links to hotel photos
+    :param messages: messages of the sent media group in the order of links
+    :param cached: dict link - file_id of photos sent by file_id
+    :return: None
+    """
+    for link, message in zip(links, messages or ()):
+        if link not in cached and message.photo:
+            # the last size is the original photo
+            file_ids.set(link, message.photo[-1].file_id)
+    photo_sends.inc(len(cached), source='file_id')
+    photo_sends.inc(len(links) - len(cached), source='link')
+
+
+def forget_file_ids(cached: dict, error: Exception) -> None:
+    """
+    removes file_ids of the media group Telegram rejected, the photos are sent by link again
+    :param cached: dict link - file_id of photos sent by file_id
+    :param error: Telegram error
+    :return: None
+    """
+    logger.warning(f'Telegram rejected cached photos {list(cached)}: {error}')
+    for link in cached:
+        file_ids.delete(link)
+    photo_file_ids_rejected.inc(len(cached))
+
+
+def is_rejected(error: Exception, cached: dict) -> bool:
+    """
+    checks if Telegram may have rejected cached file_ids, a bad request is not repeated if there were none
+    :param error: Telegram error
+    :param cached: dict link - file_id of photos sent by file_id
+    :return: bool
+    """
+    return bool(cached) and error.error_code == 400
+
+
+def send_photos(telegram_bot: Any, chat_id: int, links: list[str]) -> list[Message]:
+    """
+    sends hotel photos as a media group, photos sent before are sent by file_id, so that Telegram does not download
+    them from hotels.com again
+    :param telegram_bot: TeleBot
+    :param chat_id: chat id
+    :param links: links to hotel photos
+    :return: messages of the media group
+    """
+    cached = cached_file_ids(links)
+    try:
+        messages = telegram_bot.send_media_group(chat_id, photo_media(links, cached))
+    except ApiTelegramException as e:
+        if not is_rejected(e, cached):
+            raise
+        forget_file_ids(cached, e)
+        cached = dict()
+        messages = telegram_bot.send_media_group(chat_id, photo_media(links, cached))
+    remember_file_ids(links, messages, cached)
+    return messages
+
+
+async def async_send_photos(telegram_bot: Any, chat_id: int, links: list[str]) -> list[Message]:
+    """
+    asyncio version of send_photos
+    :param telegram_bot: AsyncTeleBot
+    :param chat_id: chat id
+    :param links: links to hotel photos
+    :return: messages of the media group
+    """
+    cached = await asyncio.to_thread(cached_file_ids, links)
+    try:
+        messages = await telegram_bot.send_media_group(chat_id, photo_media(links, cached))
+    except asyncio_helper.ApiTelegramException as e:
+        if not is_rejected(e, cached):
+            raise
+        await asyncio.to_thread(forget_file_ids, cached, e)
+        cached = dict()
+        messages = await telegram_bot.send_media_group(chat_id, photo_media(links, cached))
+    await asyncio.to_thread(remember_file_ids, links, messages, cached)
+    return messages
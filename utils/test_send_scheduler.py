@@ -0,0 +1,149 @@
+import time
+from threading import Event, Lock
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from utils.send_scheduler import BULK, INTERACTIVE, Outbox, SendScheduler, TokenBucket
+
+
+def flood_error(retry_after: float) -> ApiTelegramException:
+    return ApiTelegramException('sendMessage', None, {'ok': False, 'error_code': 429,
+                                                      'description': 'Too Many Requests: retry later',
+                                                      'parameters': {'retry_after': retry_after}})
+
+
+class Chat:
+    """
+    class Chat. Imitation of a bot method: remembers sent texts and the time of every call
+     Attributes:
+        :sent(list): texts in the order they were sent
+        :calls(list): (monotonic time, text) of every call including failed ones
+        :failures(dict): text - errors raised by the next calls with this text
+    """
+    def __init__(self) -> None:
+        self.sent = []
+        self.calls = []
+        self.failures = dict()
+        self._lock = Lock()
+
+    def send(self, chat_id: int, text: str) -> str:
+        with self._lock:
+            self.calls.append((time.monotonic(), text))
+            errors = self.failures.get(text)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append(text)
+        return text
+
+
+@pytest.fixture
+def chat() -> Chat:
+    return Chat()
+
+
+def blocker(gate: Event) -> str:
+    gate.wait(5)
+    return 'blocker'
+
+
+def test_bucket_allows_burst_then_rate() -> None:
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_bucket_does_not_exceed_capacity() -> None:
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.refill(bucket.updated + 60)
+    assert bucket.tokens == 2
+
+
+def test_interactive_requests_go_before_bulk(chat: Chat) -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=1)
+    gate = Event()
+    # the chat is busy with the first request while the others are queued
+    first = scheduler.submit(1, blocker, gate, priority=BULK)
+    futures = [scheduler.submit(1, chat.send, 1, 'bulk 1', priority=BULK),
+               scheduler.submit(1, chat.send, 1, 'bulk 2', priority=BULK),
+               scheduler.submit(1, chat.send, 1, 'reply 1', priority=INTERACTIVE),
+               scheduler.submit(1, chat.send, 1, 'reply 2', priority=INTERACTIVE)]
+    gate.set()
+    assert first.result(5) == 'blocker'
+    assert [future.result(5) for future in futures] == ['bulk 1', 'bulk 2', 'reply 1', 'reply 2']
+    assert chat.sent == ['reply 1', 'reply 2', 'bulk 1', 'bulk 2']
+
+
+def test_flood_limit_pauses_only_its_chat(chat: Chat) -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=2)
+    chat.failures['first'] = [flood_error(0.3)]
+    start = time.monotonic()
+    paused = scheduler.submit(1, chat.send, 1, 'first', priority=INTERACTIVE)
+    time.sleep(0.05)
+    other = scheduler.submit(2, chat.send, 2, 'other chat', priority=INTERACTIVE)
+    assert other.result(5) == 'other chat'
+    assert not paused.done()
+    assert paused.result(5) == 'first'
+    retried = [called for called, text in chat.calls if text == 'first']
+    assert len(retried) == 2
+    assert retried[1] - start >= 0.3
+    assert scheduler.stats()['rate_limited'] == 1
+
+
+def test_flood_limit_retries_are_limited(chat: Chat) -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=1, retries=1)
+    chat.failures['text'] = [flood_error(0.01), flood_error(0.01)]
+    future = scheduler.submit(1, chat.send, 1, 'text', priority=BULK)
+    with pytest.raises(ApiTelegramException):
+        future.result(5)
+    assert scheduler.stats()['failed'] == 1
+
+
+def test_drain_waits_for_queued_requests(chat: Chat) -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=20, chat_burst=1, workers=2)
+    for number in range(5):
+        scheduler.submit(1, chat.send, 1, f'card {number}', priority=BULK)
+    assert scheduler.drain(5)
+    assert chat.sent == [f'card {number}' for number in range(5)]
+    assert scheduler.stats()['queued'] == 0
+
+
+def test_drain_gives_up_after_timeout() -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=1)
+    gate = Event()
+    scheduler.submit(1, blocker, gate, priority=BULK)
+    assert not scheduler.drain(0.1)
+    gate.set()
+    assert scheduler.drain(5)
+
+
+def test_interactive_outbox_does_not_wait_through_pause(chat: Chat) -> None:
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=1)
+    outbox = Outbox(None, scheduler, INTERACTIVE, wait=0.1)
+    chat.failures['reply'] = [flood_error(0.5)]
+    start = time.monotonic()
+    assert outbox.submit(1, chat.send, 1, 'reply') is None
+    assert time.monotonic() - start < 0.4
+    assert scheduler.drain(5)
+    assert chat.sent == ['reply']
+
+
+def test_queued_message_is_deleted_after_it_is_sent(chat: Chat) -> None:
+    class Bot:
+        def delete_message(self, chat_id: int, message_id: int) -> bool:
+            chat.sent.append(f'delete {message_id}')
+            return True
+
+    class Sent:
+        id = 7
+
+    scheduler = SendScheduler(rate=100, chat_rate=100, chat_burst=100, workers=2)
+    outbox = Outbox(Bot(), scheduler, INTERACTIVE)
+    chat.failures['wait'] = [flood_error(0.2)]
+    message = outbox.queue(1, lambda *args: chat.send(*args) and Sent(), 1, 'wait')
+    assert outbox.delete_queued(1, message) is True
+    assert chat.sent == ['wait', 'delete 7']
@@ -0,0 +1,183 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from threading import Event, Lock
+from typing import Any, Callable, Hashable, Optional, Union
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.async_telebot import AsyncTeleBot
+
+from config_data.config import HANDLER_WORKERS
+from utils.metrics import updates_serialized
+
+
+def update_sender(obj: Any) -> Optional[Hashable]:
+    """
+    finds whose update is handled: the user who sent it or the chat it came from
+    :param obj: Message, CallbackQuery or another object passed to a handler
+    :return: user id, chat id or None
+    """
+    user = getattr(obj, 'from_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(obj, 'chat', None)
+    return chat.id if chat is not None else None
+
+
+class UserThreadPool:
+    """
+    class UserThreadPool. Replacement of the TeleBot thread pool: handlers of different users run in parallel,
+    handlers of one user run one at a time in the order the updates came, so two quick taps of a user can not
+    interleave their reads and writes of the user's state. Has the methods of telebot.util.ThreadPool the bot uses
+     Attributes:
+        :telebot(TeleBot): bot whose exception handler is called
+        :num_threads(int): number of threads
+        :exception_event(Event): set when a handler raised an exception the exception handler did not handle
+        :exception_info(Exception): that exception
+    """
+    def __init__(self, telebot: TeleBot, num_threads: int = HANDLER_WORKERS) -> None:
+        self.telebot = telebot
+        self.num_threads = num_threads
+        self.exception_event = Event()
+        self.exception_info = None
+        self._executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='handler')
+        self._waiting = dict()
+        self._lock = Lock()
+
+    def put(self, func: Callable, *args: Any, **kwargs: Any) -> None:
+        """
+        runs handler task in the pool after the previous tasks of the same user
+        :param func: task
+        :param args: positional arguments, the first one is the update object
+        :param kwargs: keyword arguments
+        :return: None
+        """
+        key = update_sender(args[0]) if args else None
+        if key is None:
+            self._executor.submit(self._run, None, func, args, kwargs)
+            return
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting is not None:
+                waiting.append((func, args, kwargs))
+                updates_serialized.inc()
+                return
+            self._waiting[key] = deque()
+        self._executor.submit(self._run, key, func, args, kwargs)
+
+    def _run(self, key: Optional[Hashable], func: Callable, args: tuple, kwargs: dict) -> None:
+        """
+        runs the task, then queues the next task of the user. The next task goes to the end of the pool queue, so a
+        user with many updates does not keep a thread from the other users
+        :param key: user or chat id
+        :param func: task
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: None
+        """
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            self.on_exception(e)
+        if key is None:
+            return
+        with self._lock:
+            waiting = self._waiting[key]
+            if not waiting:
+                del self._waiting[key]
+                return
+            task = waiting.popleft()
+        self._executor.submit(self._run, key, *task)
+
+    def on_exception(self, exception: Exception) -> None:
+        """
+        passes exception of a handler to the exception handler of the bot, an unhandled one is raised by polling
+        :param exception: exception
+        :return: None
+        """
+        if self.telebot.exception_handler is not None and self.telebot.exception_handler.handle(exception):
+            return
+        logger.opt(exception=exception).error(f'Handler failed: {exception}')
+        self.exception_info = exception
+        self.exception_event.set()
+
+    def raise_exceptions(self) -> None:
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self) -> None:
+        self.exception_event.clear()
+
+    def close(self) -> None:
+        """
+        waits for the queued tasks and stops the threads
+        :return: None
+        """
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    break
+            self._executor.submit(lambda: None).result()
+        self._executor.shutdown(wait=True)
+
+
+class UserLocks:
+    """
+    class UserLocks. asyncio locks of the users whose handlers are running or waiting. AsyncTeleBot runs every update
+    as a task, the lock makes a handler of a user wait until the previous one finishes, the waiting handlers get the
+    lock in the order the updates came. A lock is removed when no handler of the user holds or waits for it
+     Attributes:
+        :locks(dict): user or chat id - lock and number of handlers holding or waiting for it
+    """
+    def __init__(self) -> None:
+        self.locks = dict()
+
+    def wrap(self, function: Callable) -> Callable:
+        """
+        wraps async handler, so handlers of one user run one at a time
+        :param function: handler
+        :return: wrapped handler
+        """
+        @wraps(function)
+        async def wrapper(update: Any, *args: Any, **kwargs: Any) -> Any:
+            key = update_sender(update)
+            if key is None:
+                return await function(update, *args, **kwargs)
+            entry = self.locks.get(key)
+            if entry is None:
+                entry = self.locks[key] = [asyncio.Lock(), 0]
+            elif entry[0].locked():
+                updates_serialized.inc()
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    return await function(update, *args, **kwargs)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+        return wrapper
+
+
+def serialize_users(telegram_bot: Union[TeleBot, AsyncTeleBot], workers: int = HANDLER_WORKERS) -> None:
+    """
+    makes handlers of one user run one at a time in the order the updates came: replaces the thread pool of the
+    threaded bot with UserThreadPool, wraps the handlers of AsyncTeleBot with per-user locks. Called after the
+    handlers are registered
+    :param telegram_bot: TeleBot or AsyncTeleBot
+    :param workers: number of handler threads of the threaded bot
+    :return: None
+    """
+    if isinstance(telegram_bot, AsyncTeleBot):
+        locks = UserLocks()
+        for handlers in (telegram_bot.message_handlers, telegram_bot.callback_query_handlers):
+            for handler in handlers:
+                handler['function'] = locks.wrap(handler['function'])
+        return
+    if not telegram_bot.threaded:
+        return
+    telegram_bot.worker_pool.close()
+    telegram_bot.worker_pool = UserThreadPool(telegram_bot, workers)
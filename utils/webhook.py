@@ -0,0 +1,160 @@
+import argparse
+import hmac
+import json
+import queue
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable
+
+from loguru import logger
+from telebot.types import Update
+
+from config_data.config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, \
+    WEBHOOK_WORKERS
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# an update of Telegram is a few kilobytes, a larger body is not read
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """
+    class WebhookServer. HTTP server that receives updates from Telegram. A request is answered with 200 as soon as
+    its body is put to the queue, worker threads decode the updates and pass them to the bot
+     Attributes:
+        :process_updates(Callable): function that handles a list of updates, for example bot.process_new_updates
+        :secret(str): expected value of the X-Telegram-Bot-Api-Secret-Token header, required: without it anyone
+        could send forged updates to the server
+        :updates(queue.Queue): bounded queue of received request bodies
+        :httpd(ThreadingHTTPServer): http server
+    """
+    def __init__(self, process_updates: Callable[[list[Update]], None], host: str = WEBHOOK_HOST,
+                 port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS) -> None:
+        if not secret:
+            raise ValueError('WEBHOOK_SECRET must be set in webhook mode')
+        self.process_updates = process_updates
+        self.path = path
+        self.secret = secret
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.workers = [Thread(target=self.work, name=f'webhook_{i}', daemon=True) for i in range(workers)]
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+
+    def make_handler(self) -> type:
+        """
+        makes request handler class bound to this server
+        :return: BaseHTTPRequestHandler subclass
+        """
+        server = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                if self.path != server.path:
+                    self.answer(404)
+                elif not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), server.secret):
+                    logger.warning(f'Webhook request with a wrong secret token from {self.client_address[0]}')
+                    self.answer(403)
+                elif (status := self.check_length()) != 200:
+                    # the body is not read, the connection can not be used for the next request
+                    self.close_connection = True
+                    self.answer(status)
+                else:
+                    body = self.rfile.read(int(self.headers['Content-Length']))
+                    try:
+                        server.updates.put_nowait(body)
+                    except queue.Full:
+                        logger.warning('Webhook queue is full, update rejected')
+                        self.answer(503)
+                    else:
+                        self.answer(200)
+
+            def check_length(self) -> int:
+                """
+                checks Content-Length of the request before the body is read
+                :return: 200, 411 if it is missing, 400 if it is not a number or negative, 413 if it is too large
+                """
+                length = self.headers.get('Content-Length')
+                if length is None:
+                    return 411
+                if not length.isdigit():
+                    return 400
+                if int(length) > MAX_BODY_SIZE:
+                    return 413
+                return 200
+
+            def answer(self, status: int) -> None:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format: str, *args) -> None:
+                logger.debug(f'Webhook: {format % args}')
+
+        return WebhookHandler
+
+    def work(self) -> None:
+        """
+        takes request bodies from the queue and passes decoded updates to the bot
+        :return: None
+        """
+        while True:
+            body = self.updates.get()
+            try:
+                self.process_updates([Update.de_json(body.decode('utf-8'))])
+            except Exception as e:
+                logger.exception(f'Could not process webhook update: {e}')
+            finally:
+                self.updates.task_done()
+
+    def serve_forever(self) -> None:
+        """
+        starts worker threads and the http server
+        :return: None
+        """
+        for worker in self.workers:
+            worker.start()
+        logger.info(f'Webhook server listens on {self.httpd.server_address} {self.path}')
+        self.httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        """
+        stops the http server
+        :return: None
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def post_updates(file_name: str, url: str, secret: str = WEBHOOK_SECRET) -> None:
+    """
+    sends recorded updates to a webhook server, used to test the webhook mode locally. The file contains one update
+    or a list of updates in json format, as Telegram sends them
+    :param file_name: path to json file
+    :param url: webhook url, for example http://127.0.0.1:8443/webhook
+    :param secret: secret token
+    :return: None
+    """
+    with open(file_name, encoding='utf-8') as file:
+        updates = json.load(file)
+    if isinstance(updates, dict):
+        updates = [updates]
+    for update in updates:
+        request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST',
+                                         headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+        try:
+            with urllib.request.urlopen(request) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        print(update.get('update_id'), status)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send recorded Telegram updates to the webhook server')
+    parser.add_argument('file', help='json file with an update or a list of updates')
+    parser.add_argument('--url', default=f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}')
+    parser.add_argument('--secret', default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+    post_updates(args.file, args.url, args.secret)